@@ -30,6 +30,10 @@ alt_writer_v5_semantic_router.py
 - “要 / かんなめ”: 生成のブレを抑える中核規範（口調・構文・禁則）を常時注入
 - Semantic Router: 商品名⇄知見語彙の類似度で“その商品に効く語彙/構文”を抽出投入
 - OpenAI: .env の OPENAI_MODEL / OPENAI_MODE / OPENAI_TEMPERATURE / OPENAI_MAX_TOKENS を尊重
+  * AsyncOpenAI で商品ごとの呼び出しを並行実行（同時数は OPENAI_CONCURRENCY、既定16。出力は入力順）
+  * OPENAI_RPM / OPENAI_TPM を設定すると分間リクエスト数・トークン数の上限内に送信ペースを抑える（0 なら無制限）
+  * 応答は OUT_DIR/.cache_router_v5.sqlite にプロンプトのハッシュで保存し、再実行時は API を呼ばない（OPENAI_PROMPT_CACHE=0 で無効）
+  * OPENAI_BATCH_API=on で全商品を Batch API に1回で投入（夜間一括向け・半額・24h以内。欠けた商品だけ個別に再生成）
   * 未設定時は model="gpt-5.1-mini" があれば使用、なければ "gpt-4o" へ自動フォールバック
   * response_format={"type":"text"} / max_completion_tokens=env or 1000 / 温度は env or 1.0
 
@@ -45,7 +49,14 @@ import glob
 import json
 import time
 import math
+import random
+import pickle
+import asyncio
+import hashlib
+import importlib.util
+import sqlite3
 from collections import defaultdict, Counter
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -55,9 +66,20 @@ try:
 except Exception:
     def tqdm(x, **k): return x
 
+# JSONの読み書きは orjson があれば使う（無ければ標準 json。Batch 用 JSONL は1行1件・UTF-8）
+try:
+    import orjson
+    _json_loads = orjson.loads
+    def _json_line(obj):
+        return orjson.dumps(obj) + b"\n"
+except Exception:
+    _json_loads = json.loads
+    def _json_line(obj):
+        return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
 # OpenAIクライアント
 try:
-    from openai import OpenAI
+    from openai import AsyncOpenAI
 except Exception:
     raise SystemExit("openai SDK が見つかりません。`pip install openai python-dotenv` を実行してください。")
 
@@ -69,6 +91,9 @@ INPUT_CSV = BASE / "sauce" / "rakuten.csv"
 SEMANTICS_DIR = BASE / "output" / "semantics"
 OUT_DIR = BASE / "output" / "ai_writer"
 
+# 正規化済み商品名のキャッシュ（入力CSVの mtime・サイズが変わらない限り pickle から読む）
+PRODUCTS_CACHE_PREFIX = ".cache_router_v5_products_"
+
 RAW_PATH  = OUT_DIR / "alt_text_ai_raw_router_v5.csv"
 REF_PATH  = OUT_DIR / "alt_text_refined_router_v5.csv"
 DIFF_PATH = OUT_DIR / "alt_text_diff_router_v5.csv"
@@ -89,11 +114,33 @@ FORBIDDEN_GLOBAL = [
 LEADING_ENUM_RE = re.compile(r"^\s*[\d①②③④⑤⑥⑦⑧⑨⑩\-・\*\u2022]\s*[\.．、]?\s*")
 MULTI_COMMA_RE  = re.compile(r"、{3,}")
 WS_RE           = re.compile(r"\s+")
+# トークンとして残す文字の連なり（それ以外の記号・空白はすべて区切り）
+TOKEN_RE        = re.compile(r"[\w\dぁ-んァ-ン一-龥\-＋+/\.％%㎜mmcmCMxX]+")
 
 # AI出力→ローカル整形の目標レンジ
 RAW_MIN, RAW_MAX     = 100, 130
 FINAL_MIN, FINAL_MAX =  80, 110
 
+# 同時に投げるリクエスト数（RPM に合わせて .env で調整）
+CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "16"))
+RETRY_MAX = int(os.getenv("OPENAI_RETRY", "4"))            # 1商品あたりの試行回数
+RPM_LIMIT = int(os.getenv("OPENAI_RPM", "0"))             # 0 なら無制限
+TPM_LIMIT = int(os.getenv("OPENAI_TPM", "0"))             # 0 なら無制限
+NO_RETRY_STATUS = {400, 401, 403}                          # 再試行しても結果が変わらない（404 はモデル切替で再試行）
+
+# OPENAI_BATCH_API=on で Batch API 経由（完了まで最大24時間。OPENAI_BATCH_POLL_SEC 秒ごとに状態確認）
+USE_BATCH_API = os.getenv("OPENAI_BATCH_API", "off").lower() == "on"
+BATCH_POLL_SEC = int(os.getenv("OPENAI_BATCH_POLL_SEC", "30"))
+BATCH_INPUT_PATH = OUT_DIR / "batch_input_router_v5.jsonl"
+
+# OpenAI応答のキャッシュ（同一プロンプトは再実行時もAPIを呼ばない。OPENAI_PROMPT_CACHE=0 で無効）
+PROMPT_CACHE_PATH = OUT_DIR / ".cache_router_v5.sqlite"
+PROMPT_CACHE_ENABLED = os.getenv("OPENAI_PROMPT_CACHE", "1") != "0"
+
+# 知見ヒントの上限（語彙ではなく文ごと拾われた長文は送らない。全体も字数で打ち切って入力トークンを抑える）
+HINT_TERM_MAX_LEN = 40
+HINT_MAX_CHARS    = 400
+
 # “要 / かんなめ” — コア規範（プロンプト常駐）
 KANNAME_COVENANT = (
     "【要/かんなめ】\n"
@@ -107,6 +154,19 @@ KANNAME_COVENANT = (
 # ─────────────────────────────────────────────────────────
 # 2) 環境 & OpenAI 初期化（.env 固定/フォールバック）
 # ─────────────────────────────────────────────────────────
+# 並行実行（CONCURRENCY本）でも接続を張り直さないよう、keep-alive 枠を並列数に合わせた httpx.AsyncClient を渡す。
+# h2 が入っていれば HTTP/2 で1接続に多重化する（httpx が無ければ SDK の既定）
+def _make_http_client():
+    try:
+        import httpx
+    except Exception:
+        return None
+    return httpx.AsyncClient(
+        http2=importlib.util.find_spec("h2") is not None,
+        timeout=httpx.Timeout(120.0, connect=10.0),
+        limits=httpx.Limits(max_connections=CONCURRENCY * 2, max_keepalive_connections=CONCURRENCY),
+    )
+
 def init_env_and_client():
     load_dotenv(override=True)
     api_key = (os.getenv("OPENAI_API_KEY") or "").strip()
@@ -123,29 +183,52 @@ def init_env_and_client():
     temperature = float(os.getenv("OPENAI_TEMPERATURE") or "1.0")
     max_tokens  = int(os.getenv("OPENAI_MAX_TOKENS") or "1000")
 
-    client = OpenAI(api_key=api_key)
+    client = AsyncOpenAI(api_key=api_key, http_client=_make_http_client())
     return client, model, fallback_model, mode, temperature, max_tokens
 
 # ─────────────────────────────────────────────────────────
 # 3) 入力（商品名）
 # ─────────────────────────────────────────────────────────
 def load_products(path: Path):
+    """重複除去済みの商品名リスト。入力CSVが前回から変わっていなければ pickle キャッシュから読む"""
     if not path.exists():
         raise SystemExit(f"入力CSVが見つかりません: {path}")
-    products = []
+    st = path.stat()
+    sig = hashlib.sha1(repr((str(path), st.st_mtime_ns, st.st_size)).encode("utf-8")).hexdigest()
+    cache_path = OUT_DIR / f"{PRODUCTS_CACHE_PREFIX}{sig}.pkl"
+    try:
+        with cache_path.open("rb") as f:
+            return pickle.load(f)
+    except Exception:
+        pass
+    uniq = read_products(path)
+    # 古い世代は掃除してから原子的に書き込む（失敗しても本処理は続行）
+    try:
+        for old in OUT_DIR.glob(f"{PRODUCTS_CACHE_PREFIX}*.pkl"):
+            if old != cache_path:
+                old.unlink()
+        tmp = cache_path.with_suffix(".tmp")
+        with tmp.open("wb") as f:
+            pickle.dump(uniq, f)
+        os.replace(tmp, cache_path)
+    except Exception:
+        pass
+    return uniq
+
+def read_products(path: Path):
+    # 使うのは「商品名」列だけなので、行ごとに dict を作る DictReader ではなく列番号で引く。
+    # 読みながら順序を保って重複除去する（全行のリストは作らない）
+    seen, uniq = set(), []
     with path.open("r", encoding="utf-8", newline="") as f:
-        reader = csv.DictReader(f)
-        if "商品名" not in reader.fieldnames:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        if "商品名" not in header:
             raise SystemExit("入力CSVに『商品名』ヘッダが見つかりません。")
+        name_idx = header.index("商品名")
         for r in reader:
-            nm = (r.get("商品名") or "").strip()
-            if nm:
-                products.append(nm)
-    # 順序を保った重複除去
-    seen, uniq = set(), []
-    for nm in products:
-        if nm not in seen:
-            uniq.append(nm); seen.add(nm)
+            nm = r[name_idx].strip() if len(r) > name_idx else ""
+            if nm and nm not in seen:
+                uniq.append(nm); seen.add(nm)
     return uniq
 
 # ─────────────────────────────────────────────────────────
@@ -153,8 +236,8 @@ def load_products(path: Path):
 # ─────────────────────────────────────────────────────────
 def safe_load_json(p: Path):
     try:
-        with p.open("r", encoding="utf-8") as f:
-            return json.load(f)
+        with p.open("rb") as f:
+            return _json_loads(f.read())
     except Exception:
         return None
 
@@ -187,45 +270,59 @@ def flatten_terms(data):
     return out
 
 def tokenize(s: str):
-    # 簡易トークン化：全角→半角の一部、非文字除去、空白split
-    s2 = re.sub(r"[^\w\dぁ-んァ-ン一-龥\-＋+/\.％%㎜mmcmCMxX ]+", " ", s)
-    s2 = WS_RE.sub(" ", s2).strip()
-    return [t for t in s2.split(" ") if t]
+    # 簡易トークン化：残す文字の連なりを1パスで拾う（記号→空白置換→空白圧縮→split と同じ結果）
+    return TOKEN_RE.findall(s)
 
 def jaccard(a: set, b: set):
     if not a or not b: return 0.0
     return len(a & b) / len(a | b)
 
-def semantic_router(product: str, all_buckets: dict, top_k=24):
+def build_router_index(all_buckets: dict):
+    """
+    知見語彙を1回だけトークン化し、トークン → 語彙番号 の転置索引を作る。
+    Jaccard > 0 になるのはトークンを共有する語彙だけなので、商品ごとに全語彙を走査しなくて済む。
+    """
+    terms, term_tokens = [], []
+    inverted = defaultdict(list)
+    seen = set()
+    for terms_in_bucket in all_buckets.values():
+        for t in terms_in_bucket:
+            # 同じ語は同じスコアになるので最初の1回だけ登録（順位の並びも従来どおり初出順）
+            if t in seen: continue
+            seen.add(t)
+            t_tokens = set(tokenize(t))
+            if not t_tokens: continue
+            for tok in t_tokens:
+                inverted[tok].append(len(terms))
+            terms.append(t)
+            term_tokens.append(t_tokens)
+    return terms, term_tokens, dict(inverted)
+
+def semantic_router(product: str, router_index, top_k=24):
     """
     商品名のトークン集合と知見語彙の集合の Jaccard 類似で粗くスコア → 上位抽出
-    ※精緻でなくてOK。安定・高速・再現性重視。
+    ※精緻でなくてOK。安定・高速・再現性重視。router_index は build_router_index の戻り値。
     """
+    terms, term_tokens, inverted = router_index
     p_tokens = set(tokenize(product))
-    scored = []
-    # それぞれのバケツから語彙を収集
-    for bucket_name, terms in all_buckets.items():
-        for t in terms:
-            t_tokens = set(tokenize(t))
-            score = jaccard(p_tokens, t_tokens)
-            if score > 0:
-                scored.append((t, score))
-    # 上位抽出（重複語はスコア最大のみ）
-    score_map = {}
-    for t, sc in scored:
-        if t not in score_map or sc > score_map[t]:
-            score_map[t] = sc
-    top_terms = [t for t, _ in sorted(score_map.items(), key=lambda x: x[1], reverse=True)[:top_k]]
+    # トークンを共有する語彙だけを初出順に採点
+    hits = sorted({i for tok in p_tokens for i in inverted.get(tok, ())})
+    scored = [(terms[i], jaccard(p_tokens, term_tokens[i])) for i in hits]
+    top_terms = [t for t, _ in sorted(scored, key=lambda x: x[1], reverse=True)[:top_k]]
     return top_terms
 
 def load_knowledge_for_router():
     files = list_semantic_files()
+    # 読み込み（I/O 待ち）はスレッドで重ねて先に済ませ、集約は下で従来どおりの順に行う
+    paths = list(dict.fromkeys(p for ps in files.values() for p in ps))
+    with ThreadPoolExecutor(max_workers=min(32, len(paths) or 1)) as ex:
+        loaded = dict(zip(paths, ex.map(safe_load_json, paths)))
     buckets = defaultdict(list)
     forb_local = set()
 
     # lexical clusters
     for p in files.get("lexical", []):
-        data = safe_load_json(p)
+        data = loaded[p]
         if not data: continue
         if isinstance(data, dict) and "clusters" in data:
             for c in (data.get("clusters") or []):
@@ -236,7 +333,7 @@ def load_knowledge_for_router():
 
     # market vocab
     for p in files.get("market", []):
-        data = safe_load_json(p)
+        data = loaded[p]
         if not data: continue
         if isinstance(data, list):
             for v in data:
@@ -251,7 +348,7 @@ def load_knowledge_for_router():
 
     # structured semantics
     for p in files.get("semantic", []):
-        data = safe_load_json(p)
+        data = loaded[p]
         if not data: continue
         # 想定: {"concepts":[...], "scenes":[...], "targets":[...], "use_cases":[...], "features":[...], "benefits":[...]}
         if isinstance(data, dict):
@@ -263,7 +360,7 @@ def load_knowledge_for_router():
 
     # persona（口調/レジスター）
     for p in files.get("persona", []):
-        data = safe_load_json(p)
+        data = loaded[p]
         if not data: continue
         if isinstance(data, dict):
             tone = data.get("tone") or {}
@@ -274,7 +371,7 @@ def load_knowledge_for_router():
 
     # normalized（禁則）
     for p in files.get("normalized", []):
-        data = safe_load_json(p)
+        data = loaded[p]
         if not data: continue
         if isinstance(data, dict):
             fw = data.get("forbidden_words") or []
@@ -283,7 +380,7 @@ def load_knowledge_for_router():
 
     # template composer（骨子/型ヒント）
     for p in files.get("template", []):
-        data = safe_load_json(p)
+        data = loaded[p]
         if not data: continue
         if isinstance(data, dict):
             hints = data.get("hints") or data.get("templates") or []
@@ -305,56 +402,225 @@ SYSTEM_PROMPT = (
     "・出力はテキストのみ（JSON/記号/枠なし）。\n"
 )
 
-def build_user_prompt(product: str, top_terms: list, forbidden_words: list):
-    # ルータが渡す“この商品に効く語彙/骨子”
-    router_hint = "、".join(top_terms[:30]) if top_terms else ""
+def build_prompt_tail(forbidden_words: list):
+    """商品によらないプロンプト後半（構成ヒント・禁止語・出力指示）。全商品で共通なので1回だけ作る"""
     forbid_txt  = "、".join(sorted(set(forbidden_words)))
     # 構成ヒント（テンプレではなく自然に）
     structure = "商品スペック→コアコンピタンス→どんな人→利用シーン→便益（自然な日本語、詰め込みすぎない）"
     return (
-        f"商品名: {product}\n"
-        f"知見ヒント: {router_hint}\n"
         f"構成ヒント: {structure}\n"
         f"禁止語: {forbid_txt}\n"
         "出力: 20行の自然文（各行1〜2文）。句点で終える。"
     )
 
+def build_router_hint(top_terms: list):
+    """ルータが渡す“この商品に効く語彙/骨子”（上位から HINT_MAX_CHARS 字に収まるぶんだけ）"""
+    picked, total = [], 0
+    for t in top_terms[:30]:
+        if len(t) > HINT_TERM_MAX_LEN:
+            continue
+        total += len(t) + (1 if picked else 0)
+        if total > HINT_MAX_CHARS:
+            break
+        picked.append(t)
+    return "、".join(picked)
+
+def build_user_prompt(product: str, top_terms: list, prompt_tail: str):
+    router_hint = build_router_hint(top_terms)
+    return (
+        f"商品名: {product}\n"
+        f"知見ヒント: {router_hint}\n"
+        + prompt_tail
+    )
+
 # ─────────────────────────────────────────────────────────
 # 6) OpenAI 呼び出し（堅牢・バックオフ付き）
 # ─────────────────────────────────────────────────────────
-def call_openai_lines(client, model, fallback_model, mode, temperature, max_tokens, system_prompt, user_prompt, retry=4, wait=6):
+_cache_conn = None
+
+def _cache_db():
+    global _cache_conn
+    if _cache_conn is None:
+        _cache_conn = sqlite3.connect(PROMPT_CACHE_PATH)
+        _cache_conn.execute("CREATE TABLE IF NOT EXISTS kv(k TEXT PRIMARY KEY, v TEXT)")
+    return _cache_conn
+
+def _cache_key(model, temperature, max_tokens, system_prompt, user_prompt):
+    payload = json.dumps(build_chat_body(model, temperature, max_tokens, system_prompt, user_prompt),
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _cache_get(key):
+    if not PROMPT_CACHE_ENABLED:
+        return None
+    row = _cache_db().execute("SELECT v FROM kv WHERE k = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def _cache_set(key, content):
+    if not PROMPT_CACHE_ENABLED:
+        return
+    db = _cache_db()
+    db.execute("INSERT OR REPLACE INTO kv (k, v) VALUES (?, ?)", (key, content))
+    db.commit()
+
+def build_chat_body(model, temperature, max_tokens, system_prompt, user_prompt):
+    """chat.completions の引数（通常呼び出しと Batch API の body で共通）"""
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user",   "content": user_prompt},
+        ],
+        "response_format": {"type": "text"},
+        "max_completion_tokens": max_tokens,
+        "temperature": temperature,
+    }
+
+class TokenBucket:
+    """RPM/TPM のトークンバケット（並行実行中の全呼び出しで共有）。経過時間で補充し、足りない分だけ待ってから消費する"""
+    def __init__(self, rpm=RPM_LIMIT, tpm=TPM_LIMIT):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.available_requests = float(rpm)
+        self.available_tokens = float(tpm)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        if self.rpm > 0:
+            self.available_requests = min(self.rpm, self.available_requests + elapsed * self.rpm / 60.0)
+        if self.tpm > 0:
+            self.available_tokens = min(self.tpm, self.available_tokens + elapsed * self.tpm / 60.0)
+
+    async def consume(self, est_tokens=0):
+        tokens = min(est_tokens, self.tpm)  # 容量超えの見積りで永久に待たないように
+        while True:
+            # イベントループは1スレッドなので、確認から消費までの間に他の呼び出しは割り込まない
+            self._refill(time.monotonic())
+            short_req = (1 - self.available_requests) * 60.0 / self.rpm if self.rpm > 0 else 0.0
+            short_tok = (tokens - self.available_tokens) * 60.0 / self.tpm if self.tpm > 0 else 0.0
+            delay = max(short_req, short_tok)
+            if delay <= 0:
+                if self.rpm > 0:
+                    self.available_requests -= 1
+                if self.tpm > 0:
+                    self.available_tokens -= tokens
+                return
+            await asyncio.sleep(delay)
+
+def backoff_delay(prev, retry_after=None, base=1.0, cap=60.0):
+    """次の待機秒数。Retry-After ヘッダがあればそれに従い、無ければ decorrelated jitter（前回×3 までの乱数）"""
+    if retry_after is not None:
+        try:
+            return min(cap, max(0.0, float(retry_after)))
+        except (TypeError, ValueError):
+            pass
+    return min(cap, random.uniform(base, max(base, prev * 3)))
+
+def is_permanent_error(e):
+    """再試行しても無駄なエラー（認証・不正リクエスト・クォータ切れ）"""
+    return getattr(e, "status_code", None) in NO_RETRY_STATUS or getattr(e, "code", None) == "insufficient_quota"
+
+def is_model_missing(e):
+    """指定モデルが未開通（→ fallback_model で即再試行）"""
+    err_msg = str(e)
+    return getattr(e, "code", None) == "model_not_found" or "model_not_found" in err_msg or "does not exist" in err_msg
+
+async def call_openai_lines(client, model, fallback_model, mode, temperature, max_tokens, system_prompt, user_prompt, retry=RETRY_MAX, bucket=None):
+    cache_key = _cache_key(model, temperature, max_tokens, system_prompt, user_prompt)
+    cached = _cache_get(cache_key)
+    if cached:
+        return cached
     last_err = None
     use_model = model
+    delay = 1.0
     for attempt in range(retry):
         try:
-            res = client.chat.completions.create(
-                model=use_model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user",   "content": user_prompt},
-                ],
-                response_format={"type": "text"},
-                max_completion_tokens=max_tokens,
-                temperature=temperature,
+            if bucket:
+                await bucket.consume(est_tokens=max_tokens + (len(system_prompt) + len(user_prompt)) // 2)
+            res = await client.chat.completions.create(
+                **build_chat_body(use_model, temperature, max_tokens, system_prompt, user_prompt)
             )
-            content = (res.choices[0].message.content or "").strip()
+            choice = res.choices[0]
+            content = (choice.message.content or "").strip()
             if not content:
                 raise RuntimeError("Empty content from OpenAI.")
+            # 途中で切れた応答（finish_reason=length）はその回だけ使い、キャッシュしない
+            if choice.finish_reason != "length":
+                _cache_set(cache_key, content)
             return content
         except Exception as e:
             last_err = e
-            # 429 / 一部の不明エラーは待機→リトライ
-            err_msg = str(e)
-            if "insufficient_quota" in err_msg or "429" in err_msg:
-                time.sleep(wait * (attempt + 1))
-            elif "model_not_found" in err_msg or "does not exist" in err_msg:
-                # フォールバック
+            if is_model_missing(e) and use_model != fallback_model:
+                # フォールバック（待たずに切り替えて再試行）。キャッシュは実際に応答したモデルで引く／書く
                 use_model = fallback_model
-                time.sleep(2)
-            else:
-                time.sleep(wait)
+                cache_key = _cache_key(use_model, temperature, max_tokens, system_prompt, user_prompt)
+                cached = _cache_get(cache_key)
+                if cached:
+                    return cached
+                continue
+            if attempt == retry - 1 or is_permanent_error(e):
+                break
+            # 429/5xx・接続エラー・空応答は待って再試行（Retry-After があれば従う。並行中の呼び出しが同時に再送しないよう揺らす）
+            headers = getattr(getattr(e, "response", None), "headers", None) or {}
+            delay = backoff_delay(delay, headers.get("retry-after"))
+            await asyncio.sleep(delay)
     raise RuntimeError(f"OpenAI応答取得に失敗: {last_err}")
 
+async def run_batch_api(client, model, temperature, max_tokens, system_prompt, user_prompts):
+    """
+    キャッシュに無いプロンプトを JSONL にして Batch API へ1回で投入 → 完了までポーリング → custom_id で入力順へ戻す。
+    応答が欠けた／空だった商品は None（呼び出し側で通常の呼び出しに回す）。
+    """
+    keys = [_cache_key(model, temperature, max_tokens, system_prompt, u) for u in user_prompts]
+    contents = [_cache_get(k) or None for k in keys]
+    todo = [i for i, c in enumerate(contents) if c is None]
+    if not todo:
+        return contents
+
+    with BATCH_INPUT_PATH.open("wb") as f:
+        for i in todo:
+            user_prompt = user_prompts[i]
+            req = {
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": build_chat_body(model, temperature, max_tokens, system_prompt, user_prompt),
+            }
+            f.write(_json_line(req))
+    with BATCH_INPUT_PATH.open("rb") as f:
+        input_file = await client.files.create(file=f, purpose="batch")
+    batch = await client.batches.create(input_file_id=input_file.id, endpoint="/v1/chat/completions",
+                                        completion_window="24h")
+    print(f"   - Batch投入: {batch.id}（{len(todo)}件）")
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        await asyncio.sleep(BATCH_POLL_SEC)
+        batch = await client.batches.retrieve(batch.id)
+    if batch.status != "completed" or not batch.output_file_id:
+        raise RuntimeError(f"Batch が完了しませんでした: {batch.id} status={batch.status}")
+
+    output = await client.files.content(batch.output_file_id)
+    for ln in output.text.splitlines():
+        if not ln.strip():
+            continue
+        try:
+            rec = _json_loads(ln)
+            body = rec["response"]["body"]
+            choice = body["choices"][0]
+            content = (choice["message"]["content"] or "").strip()
+            i = int(rec["custom_id"])
+        except (KeyError, IndexError, TypeError, ValueError, AttributeError):
+            continue
+        if content:
+            contents[i] = content
+            if choice.get("finish_reason") != "length":
+                _cache_set(keys[i], content)
+    missing = sum(1 for c in contents if c is None)
+    if missing:
+        print(f"   - Batchで欠けた {missing}件は個別に再生成します")
+    return contents
+
 # ─────────────────────────────────────────────────────────
 # 7) ローカル整形（自然カット/禁則/重複/補完）
 # ─────────────────────────────────────────────────────────
@@ -432,34 +698,85 @@ def minimal_fallback(product: str):
 def ensure_outdir():
     OUT_DIR.mkdir(parents=True, exist_ok=True)
 
-def write_raw(products, all_raw):
-    with RAW_PATH.open("w", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        w.writerow(["商品名"] + [f"ALT_raw_{i+1}" for i in range(20)])
-        for p, lines in zip(products, all_raw):
-            row = [p] + (lines[:20] + [""] * max(0, 20 - len(lines)))
-            w.writerow(row)
-
-def write_refined(products, all_refined):
-    with REF_PATH.open("w", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        w.writerow(["商品名"] + [f"ALT_{i+1}" for i in range(20)])
-        for p, lines in zip(products, all_refined):
-            row = [p] + (lines[:20] + [""] * max(0, 20 - len(lines)))
-            w.writerow(row)
-
-def write_diff(products, all_raw, all_refined):
-    with DIFF_PATH.open("w", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        header = ["商品名"] + [f"ALT_raw_{i+1}" for i in range(20)] + [f"ALT_refined_{i+1}" for i in range(20)]
-        w.writerow(header)
-        for p, r, ref in zip(products, all_raw, all_refined):
-            r_line   = (r[:20]   + [""] * max(0, 20 - len(r)))
-            ref_line = (ref[:20] + [""] * max(0, 20 - len(ref)))
-            w.writerow([p] + r_line + ref_line)
+def pad20(lines):
+    return lines[:20] + [""] * max(0, 20 - len(lines))
+
+FLUSH_EVERY = 64  # 何商品ぶん溜めてから writerows でまとめて書くか
+
+def open_csv(path, header):
+    """書き出し先を開いてヘッダだけ書く。本体は未書き出し行リストに入力順で溜めて flush_rows でまとめて追記"""
+    f = path.open("w", newline="", encoding="utf-8")
+    w = csv.writer(f)
+    w.writerow(header)
+    return f, w, []
+
+def flush_rows(outs):
+    """溜めた行を writerows で一括書き出ししてディスクへ流す（途中で落ちても済んだ分は残る）"""
+    for f, w, rows in outs:
+        w.writerows(rows)
+        rows.clear()
+        f.flush()
 
 # ─────────────────────────────────────────────────────────
-# 9) メイン
+# 9) 並行生成
+# ─────────────────────────────────────────────────────────
+async def generate_raw(client, model, fallback_model, mode, temperature, max_tokens, product, user_prompt, content=None, bucket=None):
+    """1商品ぶんの生ALT（20行以上）。content（Batch の応答）が無ければ通常呼び出し。OpenAI全滅時も欠番なしに最小構文で埋める"""
+    try:
+        if content is None:
+            content = await call_openai_lines(
+                client, model, fallback_model, mode, temperature, max_tokens,
+                SYSTEM_PROMPT, user_prompt, bucket=bucket
+            )
+        raw_lines = sanitize_model_bullets(content)
+
+        # 空/短文を最小構文で補填（20行確保のための安全弁）
+        if len(raw_lines) < 20:
+            raw_lines += [minimal_fallback(product) for _ in range(20 - len(raw_lines))]
+        return raw_lines
+    except Exception:
+        return [minimal_fallback(product)] * 20
+
+async def generate_all(client, model, fallback_model, mode, temperature, max_tokens, products, buckets, forbidden_all, emit):
+    """
+    全商品を CONCURRENCY 本ずつ並行に生成し、完了分から入力順に emit(i, raw_lines) へ渡す。
+    USE_BATCH_API なら先に Batch で一括取得。
+    """
+    prompt_tail = build_prompt_tail(forbidden_all)
+    router_index = build_router_index(buckets)
+    user_prompts = [build_user_prompt(p, semantic_router(p, router_index, top_k=28), prompt_tail) for p in products]
+    sem = asyncio.Semaphore(CONCURRENCY)
+    # 同時数だけでなく分間の送信量も抑える（上限未設定なら素通し）
+    bucket = TokenBucket() if (RPM_LIMIT > 0 or TPM_LIMIT > 0) else None
+
+    async def one(i, product, content):
+        async with sem:
+            return i, await generate_raw(client, model, fallback_model, mode, temperature, max_tokens,
+                                         product, user_prompts[i], content, bucket=bucket)
+
+    try:
+        contents = [None] * len(products)
+        if USE_BATCH_API and products:
+            try:
+                contents = await run_batch_api(client, model, temperature, max_tokens, SYSTEM_PROMPT, user_prompts)
+            except Exception as e:
+                # Batch の投入失敗・failed/expired/cancelled は全商品を通常の呼び出しで生成する
+                print(f"   - Batchが使えませんでした（{e}）。通常の呼び出しで生成します")
+
+        pending, next_i = {}, 0
+        tasks = [one(i, p, contents[i]) for i, p in enumerate(products)]
+        for fut in tqdm(asyncio.as_completed(tasks), desc="🧠 生成中", total=len(tasks)):
+            i, raw = await fut
+            pending[i] = raw
+            while next_i in pending:
+                emit(next_i, pending.pop(next_i))
+                next_i += 1
+    finally:
+        # 接続プールはこのイベントループに紐づくので、ループを抜ける前に閉じる
+        await client.close()
+
+# ─────────────────────────────────────────────────────────
+# 10) メイン
 # ─────────────────────────────────────────────────────────
 def main():
     print("🌸 ALTライター v5.0（Semantic Router Ready + “要/かんなめ”）")
@@ -472,52 +789,54 @@ def main():
     # 知見の吸収（柔軟）→ Semantic Router で商品ごとのトップ語彙抽出
     buckets, forbidden_all = load_knowledge_for_router()
 
-    all_raw, all_refined = [], []
-
-    for product in tqdm(products, desc="🧠 生成中", total=len(products)):
-        try:
-            top_terms = semantic_router(product, buckets, top_k=28)
-            user_prompt = build_user_prompt(product, top_terms, forbidden_all)
-            content = call_openai_lines(
-                client, model, fallback_model, mode, temperature, max_tokens,
-                SYSTEM_PROMPT, user_prompt, retry=4, wait=6
-            )
-            raw_lines = sanitize_model_bullets(content)
-
-            # 空/短文を最小構文で補填（20行確保のための安全弁）
-            if len(raw_lines) < 20:
-                raw_lines += [minimal_fallback(product) for _ in range(20 - len(raw_lines))]
-
-        except Exception:
-            # OpenAI全滅時も欠番なしに進める
-            raw_lines = [minimal_fallback(product)] * 20
-
+    # 書き出し先を先に開き、生成できた商品から入力順に FLUSH_EVERY 件ずつ追記（全件をメモリに溜めない）
+    outs = [
+        open_csv(RAW_PATH, ["商品名"] + [f"ALT_raw_{i+1}" for i in range(20)]),
+        open_csv(REF_PATH, ["商品名"] + [f"ALT_{i+1}" for i in range(20)]),
+        open_csv(DIFF_PATH, ["商品名"] + [f"ALT_raw_{i+1}" for i in range(20)] + [f"ALT_refined_{i+1}" for i in range(20)]),
+    ]
+    rows_raw, rows_ref, rows_diff = (rows for _, _, rows in outs)
+
+    # 平均文字数は合計と本数だけ保持
+    len_stats = {"raw": [0, 0], "ref": [0, 0]}
+    def tally(key, lines):
+        lens = [len(x) for x in lines if x]
+        len_stats[key][0] += sum(lens)
+        len_stats[key][1] += len(lens)
+
+    def avg_len(key):
+        total, count = len_stats[key]
+        return total / max(1, count)
+
+    def emit(i, raw_lines):
         refined = refine_lines(raw_lines)
 
         # 行頭/行末のゴミ除去・体言止め混在許容
         refined = [ln.strip(" ・-—●") for ln in refined]
 
-        all_raw.append(raw_lines[:20])
-        all_refined.append(refined[:20])
-
-        # 軽いスロットリング（429緩和）
-        time.sleep(0.2)
+        raw_line, ref_line = pad20(raw_lines), pad20(refined)
+        rows_raw.append([products[i]] + raw_line)
+        rows_ref.append([products[i]] + ref_line)
+        rows_diff.append([products[i]] + raw_line + ref_line)
+        tally("raw", raw_line)
+        tally("ref", ref_line)
+        if len(rows_raw) >= FLUSH_EVERY:
+            flush_rows(outs)
 
-    # 書き出し
-    write_raw(products, all_raw)
-    write_refined(products, all_refined)
-    write_diff(products, all_raw, all_refined)
-
-    # ざっくり統計
-    def avg_len(blocks):
-        lens = [len(x) for lines in blocks for x in lines if x]
-        return (sum(lens) / max(1, len(lens)))
+    # 商品ごとの OpenAI 呼び出しを並行に（同時数はセマフォで制限。以前の逐次＋0.2秒待ちの代わり）
+    try:
+        asyncio.run(generate_all(client, model, fallback_model, mode, temperature, max_tokens,
+                                 products, buckets, forbidden_all, emit))
+    finally:
+        flush_rows(outs)
+        for f, _, _ in outs:
+            f.close()
 
     print("✅ 出力完了:")
     print(f"   - AI生出力 : {RAW_PATH}")
     print(f"   - 整形後   : {REF_PATH}")
     print(f"   - 差分比較 : {DIFF_PATH}")
-    print(f"📏 文字数(平均): raw={avg_len(all_raw):.1f} / refined={avg_len(all_refined):.1f}")
+    print(f"📏 文字数(平均): raw={avg_len('raw'):.1f} / refined={avg_len('ref'):.1f}")
     print("🔒 仕様メモ:")
     print("   - “要/かんなめ”常駐、禁則強化、自然文1〜2文、句点終止、楽天ALT特化")
     print(f"   - AI目標 {RAW_MIN}〜{RAW_MAX}字 → ローカル整形 {FINAL_MIN}〜{FINAL_MAX}字")
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+salescopy_fusion_refine.py
+- v5.4 Sales Copy Fusion のローカル整形（AI出力 → 句点終止・80〜110字 × 20本、近似重複は除去）
+- 文字列処理だけの純Python。型注釈付きなので mypyc でそのままコンパイルできる:
+    mypyc salescopy_fusion_refine.py
+  生成された .so が同じディレクトリにあれば import 時に優先して読み込まれる（無ければ本ファイルが動く）
+"""
+
+from __future__ import annotations
+
+import re
+from typing import FrozenSet, List
+
+# 整形後の目標字数
+FINAL_MIN, FINAL_MAX = 80, 110
+
+# 近似重複の判定（文字3-gram集合の Jaccard がこれ以上なら同じ文とみなす）
+NEAR_DUP_THRESHOLD = 0.85
+
+# 行ごとに使うのでモジュール読込時に1回だけコンパイル
+META_RE = re.compile(r"(画像|写真|映っている|クリック|こちら|コチラ)")        # 画像メタ語
+SENT_CUT_RE = re.compile(r"[。．！？\.\,\s][^。．！？\.\,\s]*$")       # 最後の区切り以降
+
+TRAILING_QUOTES = {'"', "'", '“', '”', '‘', '’', '「', '」', '『', '』'}
+TRAILING_QUOTE_CHARS = "".join(TRAILING_QUOTES)   # rstrip 用
+SENT_ENDS = ("。", "！", "?", "？", "!")
+
+# 20本に満たないときの補完文
+FILLER_LINE = "自然な日本語のALTテキストです。製品の特徴を伝えます。"
+
+def normalize_line(t: str) -> str:
+    if not t:
+        return ""
+    t = " ".join(t.split())
+    # 禁止語の軽い正規化（画像メタ）
+    t = META_RE.sub("", t)
+    t = t.strip()
+    return t
+
+def is_natural_sentence(t: str) -> bool:
+    if not t:
+        return False
+    # 句点/終端記号で終わる or これから付与可能
+    return True
+
+def soft_clip_sentence(t: str, min_len: int = FINAL_MIN, max_len: int = FINAL_MAX) -> str:
+    if not t:
+        return ""
+    # 末尾に引用符があれば除去（v5.4仕様）
+    return _clip_stripped(t.strip().rstrip(TRAILING_QUOTE_CHARS).rstrip(), min_len, max_len)
+
+def _clip_stripped(t: str, min_len: int, max_len: int) -> str:
+    """前後の空白・末尾の引用符を除いた t を句点終止にして max_len 以内へ"""
+    # 句点終止に整える
+    if not t.endswith(SENT_ENDS):
+        t = t + "。"
+
+    # 上限をソフトにカット（句読点やスペース優先）
+    if len(t) > max_len:
+        # 句点を基準に手前で落とす
+        cut = t[:max_len]
+        # 直近の句点/読点/空白で切る
+        m = SENT_CUT_RE.search(cut)
+        if m:
+            cut = cut[:m.start()].rstrip()
+        if not cut:
+            cut = t[:max_len].rstrip()
+        # 再び引用符が末尾に来る可能性も落とす
+        cut = cut.rstrip(TRAILING_QUOTE_CHARS)
+        # 終端を再付与
+        if not cut.endswith(SENT_ENDS):
+            cut = cut + "。"
+        t = cut
+    # 最小長を下回る場合、無理に追記はしない（自然さ優先）
+    return t
+
+def trigrams(s: str) -> FrozenSet[str]:
+    """文字3-gram集合（3文字未満は文字列そのもの）"""
+    return frozenset(s[i:i + 3] for i in range(len(s) - 2)) or frozenset((s,))
+
+def is_near_duplicate(grams: FrozenSet[str], seen: List[FrozenSet[str]],
+                      threshold: float = NEAR_DUP_THRESHOLD) -> bool:
+    for g in seen:
+        if len(grams & g) >= threshold * len(grams | g):
+            return True
+    return False
+
+def refine_line(ln: str) -> str:
+    """
+    1行分の normalize_line → is_natural_sentence → soft_clip_sentence を1関数で（結果は同じ）。
+    空白の詰め・画像メタ語の除去・前後の空白と末尾引用符の除去をそれぞれ1回の走査で済ませる
+    """
+    t = META_RE.sub("", " ".join(ln.split())).strip() if ln else ""
+    if not t:
+        return ""
+    return _clip_stripped(t.rstrip(TRAILING_QUOTE_CHARS).rstrip(), FINAL_MIN, FINAL_MAX)
+
+def unique_refined(lines: List[str]) -> List[str]:
+    """整形して空行・近似重複を落とした行（補完前）"""
+    out: List[str] = []
+    seen: List[FrozenSet[str]] = []  # 採用済みの文の3-gram集合（完全一致だけでなく言い回し違いの重複も落とす）
+    for ln in lines:
+        s = refine_line(ln)
+        if not s:
+            continue
+        grams = trigrams(s)
+        if not is_near_duplicate(grams, seen):
+            seen.append(grams)
+            out.append(s)
+    return out
+
+def refine_lines(lines: List[str]) -> List[str]:
+    out = unique_refined(lines)
+    # 20本に満たない場合は補完（簡易）
+    while len(out) < 20:
+        out.append(FILLER_LINE)
+    return out[:20]
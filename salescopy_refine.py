@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+salescopy_refine.py
+- v5.2 Sales Copy Persona Writer のローカル整形（AI出力 → 80〜110字 × 20本）
+- 文字列処理だけの純Python。型注釈付きなので mypyc でそのままコンパイルできる:
+    mypyc salescopy_refine.py
+  生成された .so が同じディレクトリにあれば import 時に優先して読み込まれる（無ければ本ファイルが動く）
+"""
+
+from __future__ import annotations
+
+import re
+from difflib import SequenceMatcher
+from functools import lru_cache
+from typing import Dict, List, Match, Optional, Pattern, Sequence, Set, Tuple
+
+# 先頭番号・空白・連続読点の掃除を1パスで行う結合パターン
+CLEAN_RE = re.compile(r"(?P<enum>^\s*[\d一二三四五六七八九十①②③④⑤⑥⑦⑧⑨⑩\-\*\・•]\s*[\.．、]?\s*)|(?P<ws>\s+)|(?P<cma>、{3,})")
+_CLEAN_REPL: Dict[str, str] = {"enum": "", "ws": " ", "cma": "、、"}
+# 補完用の語尾変形で読点を差し込む位置（3文字以上の語句）
+LIGHT_VAR_RE = re.compile(r"([^\s、。]{3,})")
+# 補完用の語尾バリエーション。元は します→できます→しやすいです→…になります の連鎖置換だったので、
+# 連鎖した結果を直接引く表にして1パスで置換する
+LIGHT_VAR_ENDINGS: Dict[str, str] = {
+    "できます。": "しやすいになります。",
+    "します。": "しやすいになります。",
+    "です。": "になります。",
+}
+LIGHT_VAR_ENDING_RE = re.compile("|".join(map(re.escape, LIGHT_VAR_ENDINGS)))
+
+# 文長ポリシー（ローカルで最終調整）
+FINAL_MIN, FINAL_MAX = 80, 110
+
+# 重複近似の閾値
+SIM_THRESHOLD = 0.90
+
+# 体言止めの適用率（目安）
+TAIGEN_RATE = 0.35
+
+def _clean_repl(m: Match[str]) -> str:
+    return _CLEAN_REPL[m.lastgroup or "ws"]
+
+def _clean_and_scrub(s: str, forbid_words: Sequence[str] = ()) -> str:
+    """番号/箇条書き掃除・空白圧縮・読点圧縮（1パス）→ 禁則語除去（1パス）"""
+    t = CLEAN_RE.sub(_clean_repl, s).strip(" ・-—●　")
+    return scrub_forbidden(t, forbid_words) if forbid_words else t
+
+def soft_clip_sentence(text: str, min_len: int = FINAL_MIN, max_len: int = FINAL_MAX,
+                       forbid_words: Sequence[str] = ()) -> str:
+    t = (text or "").strip()
+    if not t:
+        return ""
+    # 番号/箇条書き掃除・空白圧縮・禁則語除去（完全除去）
+    t = _clean_and_scrub(t, forbid_words)
+
+    # 長すぎる場合：max_len+10 程度まで許容 → 最後の「。」でカットして80〜110に寄せる
+    hard_cap = max_len + 10
+    if len(t) > hard_cap:
+        # hard_cap 以内で最後の「。」（切り出し前の文字列上で探す）
+        end = t.rfind("。", 0, hard_cap) + 1
+        if end and end >= min_len:  # 自然な句点終止がminを満たすなら採用
+            t = t[:end]
+        else:
+            t = t[:hard_cap]
+
+    return t.strip()
+
+@lru_cache(maxsize=8)
+def forbidden_pattern(words: Tuple[str, ...]) -> Optional[Pattern[str]]:
+    """禁則語を1本の正規表現に（長い語を優先）。語リストが変わらない限り使い回す"""
+    ws = sorted({w for w in words if isinstance(w, str) and w}, key=len, reverse=True)
+    return re.compile("|".join(map(re.escape, ws))) if ws else None
+
+def scrub_forbidden(s: str, forbid_words: Sequence[str]) -> str:
+    """禁則語を1パスで完全除去"""
+    pat = forbidden_pattern(tuple(forbid_words))
+    return pat.sub("", s) if pat else s
+
+def ends_with_punctuation(s: str) -> bool:
+    return s.endswith(("。", "！", "？"))
+
+def to_taigen_if_needed(s: str) -> str:
+    """語尾自然化：です/ます を体言止めへ（軽率な削りを避ける）"""
+    t = s.strip()
+    # 既に体言止めっぽいならそのまま
+    if ends_with_punctuation(t):
+        if t.endswith("。"):
+            # 3〜4文字の敬体を限定的に落とす
+            for rep in ("します。", "できます。", "でした。", "です。", "ます。"):
+                if t.endswith(rep) and len(t) > len(rep) + 8:
+                    return t[:-len("です。")] + "です" if rep == "です。" else t[:-1]  # 末尾句点だけ削る
+        return t
+    # 体言止めっぽい末尾ならそのまま
+    return t
+
+def similarity_matcher(u: str) -> SequenceMatcher[str]:
+    """採用済みの文 u 用の比較器（u 側の索引 b2j は一度だけ構築して使い回す）"""
+    sm: SequenceMatcher[str] = SequenceMatcher(None)
+    sm.set_seq2(u)
+    return sm
+
+def is_near_duplicate(s: str, matchers: List[SequenceMatcher[str]], threshold: float = SIM_THRESHOLD) -> bool:
+    """
+    SequenceMatcher(None, s, u).ratio() >= threshold となる u があるか。
+    real_quick_ratio / quick_ratio は ratio の上限値なので、安い順に足切りしてから ratio を計算する。
+    """
+    for sm in matchers:
+        sm.set_seq1(s)
+        if (sm.real_quick_ratio() >= threshold
+                and sm.quick_ratio() >= threshold
+                and sm.ratio() >= threshold):
+            return True
+    return False
+
+def uniq_by_similarity(lines: List[str], threshold: float = SIM_THRESHOLD) -> List[str]:
+    """高類似の文を除去"""
+    uniq: List[str] = []
+    matchers: List[SequenceMatcher[str]] = []
+    for s in lines:
+        if not is_near_duplicate(s, matchers, threshold):
+            uniq.append(s)
+            matchers.append(similarity_matcher(s))
+    return uniq
+
+def fallback_sentence(product: str) -> str:
+    return f"{product} の使い勝手を高める設計で、日常の不便を減らす実用的な一品です。"
+
+def _light_var_repl(m: Match[str]) -> str:
+    return LIGHT_VAR_ENDINGS[m.group()]
+
+def light_variation(s: str) -> str:
+    """補完用の語尾変形"""
+    # 語尾バリエーション（軽い置換・1パス）
+    t = LIGHT_VAR_ENDING_RE.sub(_light_var_repl, s)
+    if t == s:
+        # 句内に軽微な助詞を追加（過剰な変化は避ける）
+        t = LIGHT_VAR_RE.sub(r"\1、", t, count=1)
+        t = t.replace("、、", "、")
+    # 最後に軽く整形
+    t = soft_clip_sentence(t)
+    return t
+
+def refine_20_lines(product: str, raw_lines: Sequence[str], forbid_words: Sequence[str]) -> List[str]:
+    # 正規化 → 句点/体言止め許容 → 長さ整形
+    norm: List[str] = []
+    for ln in raw_lines:
+        if not ln:
+            continue
+        s = soft_clip_sentence(ln, forbid_words=forbid_words)
+        if not s:
+            continue
+        norm.append(s)
+
+    # 類似除去
+    norm = uniq_by_similarity(norm)
+
+    # 末尾句点と体言止めの混在（後で割合を整える）
+    out: List[str] = []
+    for s in norm:
+        if not s:
+            continue
+        # “単語羅列”っぽい短文は破棄
+        if len(s) < 20:
+            continue
+        out.append(s)
+
+    # 長さは soft_clip_sentence で FINAL_MAX+10 以内に整形済み（再クリップ不要）
+    final = out
+
+    # 体言止め割合を整える（約 TAIGEN_RATE）
+    rng = list(range(len(final)))
+    if rng:
+        target_n = max(1, int(len(final) * TAIGEN_RATE))
+        chosen: Set[int] = set()
+        i = 0
+        while len(chosen) < target_n and i < len(rng):
+            idx = rng[i]
+            if final[idx].endswith("。"):
+                # “です/ます/ました”の場合は句点だけ残しつつ自然に
+                final[idx] = to_taigen_if_needed(final[idx])
+                if final[idx].endswith("。"):
+                    # 体言化しきれなければ文末句点は維持
+                    pass
+                else:
+                    # 体言になって句点消えた場合 → そのまま
+                    pass
+                chosen.add(idx)
+            i += 1
+
+    # 20本に満たなければ補完（語尾変形）
+    base = final[:]
+    matchers = [similarity_matcher(x) for x in final]
+    i = 0
+    while len(final) < 20 and base:
+        cand = light_variation(base[i % len(base)])
+        # 類似抑制
+        if not is_near_duplicate(cand, matchers):
+            final.append(cand)
+            matchers.append(similarity_matcher(cand))
+        i += 1
+        if i > 200:  # 念のためのブレーク
+            break
+
+    # まだ足りなければ補完文（類似でもそのまま埋める）
+    while len(final) < 20:
+        final.append(fallback_sentence(product))
+
+    # 多すぎるなら先頭20
+    return final[:20]
@@ -100,6 +100,10 @@ LATIN_LISTY_RE   = re.compile(r"[A-Za-z0-9]+(?:\s*[／/・,]\s*[A-Za-z0-9]+){2,}
 
 # 名詞羅列の簡易検知（雑だが実用重視）
 JAGGED_LISTY_RE  = re.compile(r"(?:[^\u3000-\u303F\u3040-\u30FF\u4E00-\u9FFF]{2,}|・|／|/|,){3,}")
+# 羅列の区切り（・ / ／ , 、と前後の空白）を読点1つへ
+LISTY_SEP_RE     = re.compile(r"\s*[,、・/／]\s*")
+# 補完用：先頭の一単語（2〜5字）
+HEAD_WORD_RE     = re.compile(r"^(\S{2,5})")
 
 # =========================
 # 環境 & クライアント
@@ -310,15 +314,21 @@ def call_openai_20_lines(client, model, product, knowledge_text, forbidden_words
 # =========================
 TAIGEN_OK_RATIO = 0.35  # 体言止め許容率（最終20本のうちおよそ35%まで）
 
+# 明示の用言終止（これで終わる文は体言止めではない）
+YOGEN_ENDINGS = ("です", "ます", "でした", "でした。", "します", "できます", "となります", "になります")
+# 短文補完の補助句
+NATURALIZE_ADDONS = ("の設計です", "に対応します", "が魅力", "を実現", "をサポート", "に最適", "で安心")
+# 補完用の語尾バリエーション（最初に当たった1つだけ適用）
+LIGHT_VARIATION_REPLS = (("します。", "できます。"), ("できます。", "しやすいです。"), ("です。", "になります。"))
+
 def is_taigen_stop(s: str) -> bool:
     # 末尾が「です。」「ます。」等でなければ名詞終止の可能性 → 句点は前提
     if not s.endswith("。"):
         return False
     tail = s[:-1].strip()
     # 明示の用言終止を排除
-    for yogen in ("です", "ます", "でした", "でした。", "します", "できます", "となります", "になります"):
-        if tail.endswith(yogen):
-            return False
+    if tail.endswith(YOGEN_ENDINGS):
+        return False
     # 「〜対応」「〜仕様」「〜設計」「〜構造」などは体言扱い可
     return True
 
@@ -376,12 +386,9 @@ def naturalize_short(s: str) -> str:
     if not t:
         return ""
     # ごく軽い補助句
-    addons = [
-        "の設計です", "に対応します", "が魅力", "を実現", "をサポート", "に最適", "で安心"
-    ]
     t2 = t
     if not t2.endswith(("です", "ます", "最適", "魅力", "設計", "仕様", "対応")):
-        t2 = t2 + random.choice(addons)
+        t2 = t2 + random.choice(NATURALIZE_ADDONS)
     return t2 + "。"
 
 def refine_20_lines(raw_lines, forbids):
@@ -400,9 +407,8 @@ def refine_20_lines(raw_lines, forbids):
 
         if looks_like_listy(ln):
             # 名詞羅列くさい → 軽補正
-            ln = ln.replace("・", "、").replace("/", "、").replace("／", "、")
-            ln = re.sub(r"\s*[,、]\s*", "、", ln)
-            ln = re.sub(r"(、){3,}", "、、", ln)
+            ln = LISTY_SEP_RE.sub("、", ln)
+            ln = MULTI_COMMA_RE.sub("、、", ln)
 
         # 短すぎるとき軽補完
         if len(ln) < 25:
@@ -453,16 +459,13 @@ def refine_20_lines(raw_lines, forbids):
     def light_variation(s: str) -> str:
         v = s
         # 軽い語尾バリエーション
-        repls = [("します。", "できます。"),
-                 ("できます。", "しやすいです。"),
-                 ("です。", "になります。")]
-        for a, b in repls:
+        for a, b in LIGHT_VARIATION_REPLS:
             if v.endswith(a):
                 v = v[:-len(a)] + b
                 break
         if v == s:
             # 先頭の一単語の後ろに読点（重複は抑制）
-            v = re.sub(r"^(\S{2,5})", r"\1、", v, count=1)
+            v = HEAD_WORD_RE.sub(r"\1、", v, count=1)
             v = v.replace("、、", "、")
             if not v.endswith("。"):
                 v += "。"
@@ -83,20 +83,12 @@ def init_env_and_client():
 def load_products(path: str):
     if not os.path.exists(path):
         raise SystemExit(f"入力CSVが見つかりません: {path}")
-    items = []
     with open(path, "r", encoding="utf-8", newline="") as f:
         r = csv.DictReader(f)
         if "商品名" not in r.fieldnames:
             raise SystemExit("入力CSVに『商品名』ヘッダが見つかりません。")
-        for row in r:
-            nm = (row.get("商品名") or "").strip()
-            if nm: items.append(nm)
-    # 重複除去（順序維持）
-    seen, uniq = set(), []
-    for nm in items:
-        if nm not in seen:
-            uniq.append(nm); seen.add(nm)
-    return uniq
+        # 重複除去（順序維持）
+        return list(dict.fromkeys(nm for row in r if (nm := (row.get("商品名") or "").strip())))
 
 # ====== 知見 読み込み・要約 ======
 def safe_load_json(path):
@@ -69,21 +69,12 @@ def init_env_and_client():
 def load_products(path):
     if not os.path.exists(path):
         raise SystemExit(f"入力CSVが見つかりません: {path}")
-    products = []
     with open(path, "r", encoding="utf-8", newline="") as f:
         r = csv.DictReader(f)
         if "商品名" not in r.fieldnames:
             raise SystemExit("CSVに『商品名』列がありません。")
-        for row in r:
-            nm = (row.get("商品名") or "").strip()
-            if nm:
-                products.append(nm)
-    seen, uniq = set(), []
-    for nm in products:
-        if nm not in seen:
-            uniq.append(nm)
-            seen.add(nm)
-    return uniq
+        # 空欄を除き、初出順のまま重複除去
+        return list(dict.fromkeys(nm for row in r if (nm := (row.get("商品名") or "").strip())))
 
 # ====== 知見要約 ======
 def safe_load_json(path):
@@ -13,6 +13,7 @@ ALT長文生成 v4.6（自然文＋安定生成＋リトライ保護）
     ✅ 名詞羅列禁止・自然文強制
     ✅ OpenAI空応答対策
     ✅ 安定スロットリング＋リトライ保護
+    ✅ aiohttp 共有セッションで並列生成（OPENAI_CONCURRENCY 件まで同時実行）
 """
 
 import os
@@ -20,7 +21,13 @@ import re
 import csv
 import glob
 import json
-import time
+import pickle
+import random
+import asyncio
+import hashlib
+import importlib.util
+import sqlite3
+import unicodedata
 from dotenv import load_dotenv
 from collections import defaultdict
 
@@ -29,10 +36,25 @@ try:
 except Exception:
     def tqdm(x, **k): return x
 
+# httpx(AsyncClient) は高並列で詰まるため、SDKを介さず aiohttp で直接叩く
+# 商品CSVの読込は pandas があれば使う（pyarrow もあればそのパーサ。無ければ csv.DictReader）
 try:
-    from openai import OpenAI
+    import pandas as pd
 except Exception:
-    raise SystemExit("openai SDKが見つかりません。`pip install openai python-dotenv` を実行してください。")
+    pd = None
+CSV_ENGINE = "pyarrow" if importlib.util.find_spec("pyarrow") else "c"
+
+# JSON読込は orjson があれば使う（無ければ標準 json）
+try:
+    import orjson
+    _json_loads = orjson.loads
+except Exception:
+    _json_loads = json.loads
+
+try:
+    import aiohttp
+except Exception:
+    raise SystemExit("aiohttp が見つかりません。`pip install aiohttp python-dotenv` を実行してください。")
 
 # ====== 定数 ======
 INPUT_CSV = "./rakuten.csv"
@@ -41,23 +63,37 @@ RAW_PATH = os.path.join(OUT_DIR, "alt_text_ai_raw_longform_v4.6.csv")
 REF_PATH = os.path.join(OUT_DIR, "alt_text_refined_final_longform_v4.6.csv")
 DIFF_PATH = os.path.join(OUT_DIR, "alt_text_diff_longform_v4.6.csv")
 SEMANTICS_DIR = "./output/semantics"
+KB_CACHE_PREFIX = ".cache_v4_6_"   # 知見要約キャッシュ（JSON群の mtime 依存）
 
 FORBIDDEN = [
     "画像", "写真", "見た目", "上の画像", "下の写真", "当店", "当社", "レビュー", "ランキング",
     "クリック", "こちら", "競合", "優位性", "業界最高", "最安", "No.1", "ナンバーワン",
     "リンク", "ページ", "カート", "購入はこちら", "送料無料（確約）", "返金保証"
 ]
+# 禁則語を1パスで除去するための結合パターン（長い語を優先）
+FORBIDDEN_RE = re.compile("|".join(map(re.escape, sorted(FORBIDDEN, key=len, reverse=True))))
 
 RAW_MIN, RAW_MAX = 100, 130
 FINAL_MIN, FINAL_MAX = 80, 110
 
+# ====== 応答キャッシュ（同一プロンプトは再実行時もAPIを呼ばない。OPENAI_PROMPT_CACHE=0 で無効） ======
+PROMPT_CACHE_PATH = os.path.join(OUT_DIR, ".cache.sqlite")
+PROMPT_CACHE_ENABLED = os.getenv("OPENAI_PROMPT_CACHE", "1") != "0"
+
+# ====== OpenAI（HTTP直叩き） ======
+OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
+CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "8"))
+NO_RETRY_STATUS = {400, 401, 403, 404}   # リトライしても変わらないので即あきらめる
+RPM_LIMIT = int(os.getenv("OPENAI_RPM", "0"))   # 0 なら均等割りせずヘッダ追従のみ
+RATE_LOW_REQUESTS = 2        # x-ratelimit-remaining-requests がこれ以下ならリセットまで待つ
+RATE_LOW_TOKENS = 4000       # x-ratelimit-remaining-tokens がこれ以下ならリセットまで待つ
+
 # ====== 正規表現 ======
 LEADING_ENUM_RE = re.compile(r"^\s*[\d①②③④⑤⑥⑦⑧⑨⑩\-\*\・●]\s*[\.．、]?\s*")
-MULTI_COMMA_RE = re.compile(r"、{3,}")
 WS_RE = re.compile(r"\s+")
 
 # ====== 環境設定 ======
-def init_env_and_client():
+def init_env():
     load_dotenv(override=True)
     api_key = os.getenv("OPENAI_API_KEY", "").strip()
     if not api_key:
@@ -65,41 +101,98 @@ def init_env_and_client():
     model = os.getenv("OPENAI_MODEL", "gpt-5").strip()
     temp = float(os.getenv("OPENAI_TEMPERATURE", "1.2").strip())
     max_tokens = int(os.getenv("OPENAI_MAX_TOKENS", "2000").strip())
-    client = OpenAI(api_key=api_key)
-    return client, model, temp, max_tokens
+    return api_key, model, temp, max_tokens
+
+def open_session(api_key):
+    """全リクエストで共有する aiohttp セッション（接続プールは並列数に合わせる）"""
+    return aiohttp.ClientSession(
+        headers={"Authorization": f"Bearer {api_key}"},
+        connector=aiohttp.TCPConnector(limit=CONCURRENCY),
+        timeout=aiohttp.ClientTimeout(total=180),
+    )
 
 # ====== 入力 ======
+def product_key(name):
+    # 表記ゆれを吸収した重複判定キー（NFKC・空白圧縮・小文字化）
+    return " ".join(unicodedata.normalize("NFKC", name).split()).lower()
+
 def load_products(path):
     if not os.path.exists(path):
         raise SystemExit(f"❌ 入力CSVが見つかりません: {path}")
-    products = []
-    with open(path, "r", encoding="utf-8", newline="") as f:
-        reader = csv.DictReader(f)
-        if "商品名" not in reader.fieldnames:
-            raise SystemExit("❌ CSVに『商品名』列が存在しません。")
-        for r in reader:
-            nm = (r.get("商品名") or "").strip()
-            if nm:
-                products.append(nm)
-    seen, uniq = set(), []
+    products = None
+    if pd is not None:
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            if "商品名" not in next(csv.reader(f), []):
+                raise SystemExit("❌ CSVに『商品名』列が存在しません。")
+        try:
+            col = pd.read_csv(path, usecols=["商品名"], dtype=str, keep_default_na=False,
+                              encoding="utf-8", engine=CSV_ENGINE)["商品名"]
+            products = [nm for nm in col.str.strip().tolist() if nm]
+        except Exception:
+            pass  # 改行入りの引用セルなど pyarrow で読めない行は DictReader で読み直す
+    if products is None:
+        products = []
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            reader = csv.DictReader(f)
+            if "商品名" not in reader.fieldnames:
+                raise SystemExit("❌ CSVに『商品名』列が存在しません。")
+            for r in reader:
+                nm = (r.get("商品名") or "").strip()
+                if nm:
+                    products.append(nm)
+    # 重複除去（順序保持）。全角/半角・空白・大小文字だけの違いは同一商品として1回だけ生成し、
+    # 別表記は aliases[代表表記] に残して書き出し時に同じ行をコピーする
+    seen, uniq, aliases = {}, [], {}
     for nm in products:
-        if nm not in seen:
+        key = product_key(nm)
+        rep = seen.get(key)
+        if rep is None:
+            seen[key] = nm
             uniq.append(nm)
-            seen.add(nm)
-    return uniq
+        elif nm != rep and nm not in aliases.setdefault(rep, []):
+            aliases[rep].append(nm)
+    return uniq, aliases
 
 # ====== 知見要約 ======
 def safe_load_json(path):
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(path, "rb") as f:
+            return _json_loads(f.read())
+    except Exception:
+        return None
+
+def _kb_cache_path(files):
+    sig_src = repr(sorted((p, os.path.getmtime(p)) for p in files)) + repr(FORBIDDEN)
+    sig = hashlib.sha1(sig_src.encode("utf-8")).hexdigest()
+    return os.path.join(SEMANTICS_DIR, f"{KB_CACHE_PREFIX}{sig}.pkl")
+
+def _kb_cache_load(cache_path):
+    try:
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
     except Exception:
         return None
 
+def _kb_cache_save(cache_path, result):
+    try:
+        for old in glob.glob(os.path.join(SEMANTICS_DIR, f"{KB_CACHE_PREFIX}*.pkl")):
+            if old != cache_path:
+                os.remove(old)
+        tmp = cache_path + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(result, f)
+        os.replace(tmp, cache_path)
+    except Exception:
+        pass
+
 def summarize_knowledge():
     if not os.path.isdir(SEMANTICS_DIR):
         return "主要スペック・用途・対象・機能・便益を自然に含める。", FORBIDDEN[:]
     files = glob.glob(os.path.join(SEMANTICS_DIR, "*.json"))
+    cache_path = _kb_cache_path(files)
+    cached = _kb_cache_load(cache_path)
+    if cached is not None:
+        return cached
     clusters, market, concept, tmpl, forbid_local = [], [], [], [], []
     for p in files:
         data = safe_load_json(p)
@@ -147,6 +240,7 @@ def summarize_knowledge():
     def cap(xs, n): return "、".join(list(dict.fromkeys([x for x in xs if isinstance(x, str)]))[:n])
     text = f"語彙:{cap(clusters,6)} / 市場語:{cap(market,6)} / 構造:{cap(concept,5)} / 骨子:{cap(tmpl,3)}。"
     text += "自然な日本語で1〜2文、句点終止で書く。"
+    _kb_cache_save(cache_path, (text, all_forbid))
     return text, all_forbid
 
 # ====== プロンプト ======
@@ -159,40 +253,151 @@ SYSTEM_PROMPT = (
     "画像や写真、レビュー、ランキング、当店などのメタ語は禁止。\n"
 )
 
-def build_user_prompt(product, knowledge_text, forbid_words):
+def build_prompt_prefix(knowledge_text, forbid_words):
+    # 共通部分（実行中は不変なので一度だけ組み立てる）。商品名は末尾に付ける（プロンプトキャッシュは先頭一致）
     forbid_txt = "、".join(sorted(set(forbid_words)))
     return (
-        f"商品名: {product}\n"
         f"{knowledge_text}\n"
         f"禁止語: {forbid_txt}\n"
-        "20行の自然文ALTを出力してください。各行は句点終止の1〜2文。"
+        "20行の自然文ALTを出力してください。各行は句点終止の1〜2文。\n"
     )
 
+def build_user_prompt(product, prompt_prefix):
+    return f"{prompt_prefix}商品名: {product}"
+
 # ====== OpenAI呼び出し（安定版） ======
-def call_openai_20_lines(client, model, temp, max_tokens, product, kb_text, forbid_words, retry=3, wait=6):
-    user_prompt = build_user_prompt(product, kb_text, forbid_words)
+def backoff_delay(attempt, retry_after=None, base=1.0, cap=60.0):
+    # 指数バックオフ（full jitter）。Retry-After ヘッダがあればそれに従う
+    if retry_after is not None:
+        try:
+            return min(cap, max(0.0, float(retry_after)))
+        except (TypeError, ValueError):
+            pass
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+RESET_PART_RE = re.compile(r"([\d.]+)(ms|s|m|h)")   # x-ratelimit-reset-* の "6m0s" 等を分解
+
+def parse_reset(v):
+    # x-ratelimit-reset-* の "1s" / "6m0s" / "20ms" 形式を秒に
+    unit_sec = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(n) * unit_sec[u] for n, u in RESET_PART_RE.findall(v or ""))
+
+class RateGate:
+    """送信タイミングの調整役：RPM_LIMIT の均等割り＋レスポンスの x-ratelimit-* ヘッダ追従"""
+    def __init__(self, rpm=RPM_LIMIT):
+        self.interval = 60.0 / rpm if rpm > 0 else 0.0
+        self.next_at = 0.0
+
+    async def wait(self):
+        now = asyncio.get_running_loop().time()
+        delay = self.next_at - now
+        self.next_at = max(now, self.next_at) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def update(self, headers):
+        pause = 0.0
+        for kind, low in (("requests", RATE_LOW_REQUESTS), ("tokens", RATE_LOW_TOKENS)):
+            try:
+                remaining = int(headers.get(f"x-ratelimit-remaining-{kind}"))
+            except (TypeError, ValueError):
+                continue
+            if remaining <= low:
+                pause = max(pause, parse_reset(headers.get(f"x-ratelimit-reset-{kind}")))
+        if pause:
+            now = asyncio.get_running_loop().time()
+            self.next_at = max(self.next_at, now + pause)
+
+_cache_conn = None
+
+def _cache_db():
+    global _cache_conn
+    if _cache_conn is None:
+        os.makedirs(OUT_DIR, exist_ok=True)
+        _cache_conn = sqlite3.connect(PROMPT_CACHE_PATH)
+        _cache_conn.execute("CREATE TABLE IF NOT EXISTS kv(k TEXT PRIMARY KEY, v BLOB)")
+    return _cache_conn
+
+def _cache_key(model, temperature, user_prompt):
+    return hashlib.sha1((SYSTEM_PROMPT + user_prompt + model + str(temperature)).encode("utf-8")).hexdigest()
+
+def _cache_get(key):
+    if not PROMPT_CACHE_ENABLED:
+        return None
+    row = _cache_db().execute("SELECT v FROM kv WHERE k = ?", (key,)).fetchone()
+    return _json_loads(row[0]) if row else None
+
+def _cache_set(key, lines):
+    if not PROMPT_CACHE_ENABLED:
+        return
+    db = _cache_db()
+    db.execute("INSERT OR REPLACE INTO kv (k, v) VALUES (?, ?)", (key, json.dumps(lines, ensure_ascii=False)))
+    db.commit()
+
+async def call_openai_20_lines(session, model, temp, max_tokens, product, prompt_prefix, retry=6, wait=1.0, gate=None):
+    user_prompt = build_user_prompt(product, prompt_prefix)
+    cache_key = _cache_key(model, temp, user_prompt)
+    cached = _cache_get(cache_key)
+    if cached:
+        return cached
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt},
+        ],
+        "max_completion_tokens": max_tokens,
+        "temperature": temp,
+    }
     for attempt in range(retry):
+        status, retry_after = None, None
         try:
-            res = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": user_prompt},
-                ],
-                max_completion_tokens=max_tokens,
-                temperature=temp,
-            )
-            content = (res.choices[0].message.content or "").strip()
+            if gate:
+                await gate.wait()
+            async with session.post(OPENAI_CHAT_URL, json=payload) as resp:
+                if gate:
+                    gate.update(resp.headers)
+                body = await resp.json(content_type=None)
+                if resp.status != 200:
+                    status, retry_after = resp.status, resp.headers.get("retry-after")
+                    err = (body or {}).get("error") or {}
+                    raise RuntimeError(f"HTTP {resp.status}: {err.get('message', '')}")
+            content = (body["choices"][0]["message"].get("content") or "").strip()
             if not content:
                 raise ValueError("空応答を検出")
-            lines = [ln.strip() for ln in content.split("\n") if ln.strip()]
-            return lines[:80]
+            lines = [ln.strip() for ln in content.split("\n") if ln.strip()][:80]
+            _cache_set(cache_key, lines)
+            return lines
         except Exception as e:
             print(f"⚠️ OpenAIエラー({attempt+1}/{retry}): {e}")
-            time.sleep(wait)
+            if status in NO_RETRY_STATUS:
+                break
+            if attempt + 1 < retry:
+                await asyncio.sleep(backoff_delay(attempt, retry_after, base=wait))
     # fallback
     return [f"{product}は高品質な設計で、快適に使用できます。"] * 20
 
+async def generate_all(api_key, model, temp, max_tokens, products, prompt_prefix, emit):
+    """全商品を並列に生成（同時実行数は CONCURRENCY で制限）。完了分から入力順に emit(i, raw) へ渡す"""
+    sem = asyncio.Semaphore(CONCURRENCY)
+    gate = RateGate()
+    pending, next_i = {}, 0
+    session = open_session(api_key)
+    try:
+        async def one(i, p):
+            async with sem:
+                return i, await call_openai_20_lines(session, model, temp, max_tokens, p, prompt_prefix, gate=gate)
+
+        tasks = [one(i, p) for i, p in enumerate(products)]
+        for fut in tqdm(asyncio.as_completed(tasks), desc="🧠 生成中", total=len(tasks)):
+            i, raw = await fut
+            pending[i] = raw
+            while next_i in pending:
+                emit(next_i, pending.pop(next_i))
+                next_i += 1
+    finally:
+        await session.close()
+
 # ====== ローカル整形 ======
 def looks_listy(s):
     if not s: return True
@@ -207,8 +412,7 @@ def rewrite_listy_to_sentence(s):
     head = "、".join(bits[:2])
     tail = "、".join(bits[2:]) if len(bits) > 2 else ""
     cand = f"{head}を備え、{tail}でも使いやすい設計です。" if tail else f"{head}に対応し、日常を快適にします。"
-    for ng in FORBIDDEN:
-        cand = cand.replace(ng, "")
+    cand = FORBIDDEN_RE.sub("", cand)
     if not cand.endswith("。"):
         cand += "。"
     return cand
@@ -230,12 +434,11 @@ def soft_clip_sentence(t):
     if not t.endswith("。"):
         t += "。"
     if len(t) > 120:
-        cut = t[:120]
-        p = cut.rfind("。")
-        if p != -1:
-            t = cut[:p+1]
-    for ng in FORBIDDEN:
-        t = t.replace(ng, "")
+        # 120字以内で最後の「。」まで（切り出し前の文字列上で探す）
+        end = t.rfind("。", 0, 120) + 1
+        if end:
+            t = t[:end]
+    t = FORBIDDEN_RE.sub("", t)
     return t.strip()
 
 def refine_20_lines(raw_lines):
@@ -248,52 +451,81 @@ def refine_20_lines(raw_lines):
 
 # ====== 出力 ======
 def ensure_outdir(): os.makedirs(OUT_DIR, exist_ok=True)
-def write_csv(path, products, data, prefix):
-    with open(path, "w", encoding="utf-8", newline="") as f:
-        w = csv.writer(f)
-        w.writerow(["商品名"] + [f"{prefix}_{i+1}" for i in range(20)])
-        for p, lines in zip(products, data):
-            row = [p] + (lines[:20] + [""] * max(0, 20 - len(lines)))
-            w.writerow(row)
+FLUSH_EVERY = 256     # 何商品ぶん溜めてから writerows でまとめて書くか
+CSV_BUFFER = 1 << 20  # 書き込みバッファ（1MB）
+
+def pad20(lines):
+    return lines[:20] + [""] * max(0, 20 - len(lines))
+
+def open_csv(path, header):
+    """書き出し先を開いてヘッダだけ書く。本体は未書き出し行リストに溜めて flush_rows でまとめて追記"""
+    f = open(path, "w", encoding="utf-8", newline="", buffering=CSV_BUFFER)
+    w = csv.writer(f, lineterminator="\n")
+    w.writerow(header)
+    return f, w, []
+
+def flush_rows(outs):
+    """溜めた行を writerows で一括書き出ししてディスクへ流す"""
+    for f, w, rows in outs:
+        w.writerows(rows)
+        rows.clear()
+        f.flush()
 
 # ====== メイン ======
 def main():
     print("🌸 ALT長文生成 v4.6（自然文＋安定生成＋リトライ）")
-    client, model, temp, max_tokens = init_env_and_client()
+    api_key, model, temp, max_tokens = init_env()
     ensure_outdir()
 
-    products = load_products(INPUT_CSV)
-    print(f"✅ 対象商品: {len(products)}件")
+    products, aliases = load_products(INPUT_CSV)
+    n_alias = sum(len(v) for v in aliases.values())
+    print(f"✅ 対象商品: {len(products)}件" + (f"（表記ゆれ {n_alias}件は生成結果を共有）" if n_alias else ""))
 
     kb_text, forb = summarize_knowledge()
-    all_raw, all_ref = [], []
+    prompt_prefix = build_prompt_prefix(kb_text, forb)
 
-    for p in tqdm(products, desc="🧠 生成中", total=len(products)):
-        raw = call_openai_20_lines(client, model, temp, max_tokens, p, kb_text, forb)
-        refined = refine_20_lines(raw)
-        all_raw.append(raw[:20])
-        all_ref.append(refined)
-        time.sleep(0.8)
+    # 出力は商品ごとに逐次追記（全件をメモリに溜めない）
+    outs = [
+        open_csv(RAW_PATH, ["商品名"] + [f"ALT_raw_{i+1}" for i in range(20)]),
+        open_csv(REF_PATH, ["商品名"] + [f"ALT_{i+1}" for i in range(20)]),
+        open_csv(DIFF_PATH, ["商品名"] + [f"ALT_raw_{i+1}" for i in range(20)] + [f"ALT_ref_{i+1}" for i in range(20)]),
+    ]
+    rows_raw, rows_ref, rows_diff = (rows for _, _, rows in outs)
 
-    write_csv(RAW_PATH, products, all_raw, "ALT_raw")
-    write_csv(REF_PATH, products, all_ref, "ALT")
+    # 平均文字数は合計と本数だけ保持
+    len_stats = {"raw": [0, 0], "ref": [0, 0]}
+    def tally(key, lines):
+        lens = [len(x) for x in lines if x]
+        len_stats[key][0] += sum(lens)
+        len_stats[key][1] += len(lens)
 
-    # diff 出力
-    with open(DIFF_PATH, "w", encoding="utf-8", newline="") as f:
-        w = csv.writer(f)
-        w.writerow(["商品名"] + [f"ALT_raw_{i+1}" for i in range(20)] + [f"ALT_ref_{i+1}" for i in range(20)])
-        for p, raw, ref in zip(products, all_raw, all_ref):
-            w.writerow([p] + raw[:20] + ref[:20])
+    def avg_len(key):
+        total, count = len_stats[key]
+        return total / count if count else 0
 
-    def avg_len(block):
-        lens = [len(x) for lines in block for x in lines if x]
-        return sum(lens) / len(lens) if lens else 0
+    def emit(i, raw):
+        raw_line, ref_line = pad20(raw), pad20(refine_20_lines(raw))
+        for name in [products[i]] + aliases.get(products[i], []):
+            rows_raw.append([name] + raw_line)
+            rows_ref.append([name] + ref_line)
+            rows_diff.append([name] + raw_line + ref_line)
+        tally("raw", raw_line)
+        tally("ref", ref_line)
+        if len(rows_raw) >= FLUSH_EVERY:
+            flush_rows(outs)
+
+    try:
+        asyncio.run(generate_all(api_key, model, temp, max_tokens, products, prompt_prefix, emit))
+    finally:
+        flush_rows(outs)
+        for f, _, _ in outs:
+            f.close()
 
     print("✅ 出力完了:")
     print(f"   - AI生出力: {RAW_PATH}")
     print(f"   - 整形後   : {REF_PATH}")
     print(f"   - 差分比較 : {DIFF_PATH}")
-    print(f"📏 平均文字数 raw={avg_len(all_raw):.1f}, refined={avg_len(all_ref):.1f}")
+    print(f"📏 平均文字数 raw={avg_len('raw'):.1f}, refined={avg_len('ref'):.1f}")
 
 if __name__ == "__main__":
     main()
@@ -11,8 +11,15 @@ ALT長文生成 v4.6r1（自然文＋安定生成＋自動バックオフ）
 - 機能:
     ✅ gpt-5対応（.env固定）
     ✅ 名詞羅列禁止・自然文強制
-    ✅ OpenAI 429/Quota制限で10分自動バックオフ
+    ✅ OpenAI 429/5xx は Retry-After 優先＋指数バックオフ（decorrelated jitter）で再試行
+       認証エラー・不正リクエスト・クォータ切れは待たずに即中断
     ✅ 空応答補完＋句点終止保証
+    ✅ 商品ごとのAI生成を並列化（OPENAI_CONCURRENCY、既定8）
+    ✅ OPENAI_RPM / OPENAI_TPM のトークンバケットで送信前に流量調整
+    ✅ 同一プロンプトの応答をキャッシュ（再実行時はAPIを呼ばない）
+    ✅ 大量件数（500件以上）の整形はプロセス並列（REFINE_PROCS、既定CPU数）
+    ✅ 出力上限（max_completion_tokens）を実測 p95×1.1 へ自動で絞る（OPENAI_ADAPTIVE_TOKENS=0 で無効）
+    ✅ OPENAI_BATCH=N で N 商品を1リクエストにまとめて生成（既定1。見出しが崩れた商品は単品で再生成）
 """
 
 import os
@@ -21,8 +28,28 @@ import csv
 import glob
 import json
 import time
+import random
+import hashlib
+import sqlite3
+import importlib.util
+import threading
 from dotenv import load_dotenv
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+# 商品CSVの読込は pandas があれば使う（pyarrow もあればそのパーサ。無ければ csv.DictReader）
+try:
+    import pandas as pd
+except Exception:
+    pd = None
+CSV_ENGINE = "pyarrow" if importlib.util.find_spec("pyarrow") else "c"
+
+# JSON読込は orjson があれば使う（無ければ標準 json）
+try:
+    import orjson
+    _json_loads = orjson.loads
+except Exception:
+    _json_loads = json.loads
 
 try:
     from tqdm.auto import tqdm
@@ -41,6 +68,9 @@ RAW_PATH = os.path.join(OUT_DIR, "alt_text_ai_raw_longform_v4.6r1.csv")
 REF_PATH = os.path.join(OUT_DIR, "alt_text_refined_final_longform_v4.6r1.csv")
 DIFF_PATH = os.path.join(OUT_DIR, "alt_text_diff_longform_v4.6r1.csv")
 SEMANTICS_DIR = "./output/semantics"
+# OpenAI応答のキャッシュ（OPENAI_PROMPT_CACHE=0 で無効）
+PROMPT_CACHE_PATH = os.path.join(OUT_DIR, ".cache.sqlite")
+PROMPT_CACHE_ENABLED = os.getenv("OPENAI_PROMPT_CACHE", "1") != "0"
 
 FORBIDDEN = [
     "画像", "写真", "見た目", "上の画像", "下の写真", "当店", "当社", "レビュー", "ランキング",
@@ -50,11 +80,26 @@ FORBIDDEN = [
 
 RAW_MIN, RAW_MAX = 100, 130
 FINAL_MIN, FINAL_MAX = 80, 110
+CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "8"))   # 同時リクエスト数（スレッド数）
+NO_RETRY_STATUS = {400, 401, 403, 404}                     # 再試行しても結果が変わらない
+RPM_LIMIT = int(os.getenv("OPENAI_RPM", "0"))              # 0 なら無制限
+TPM_LIMIT = int(os.getenv("OPENAI_TPM", "0"))              # 0 なら無制限
+ADAPTIVE_TOKENS = os.getenv("OPENAI_ADAPTIVE_TOKENS", "1") != "0"
+TOKEN_BUDGET_FLOOR = 800    # 自動調整でもこれより下げない
+TOKEN_BUDGET_WARMUP = 10    # この件数を観測するまでは設定値のまま
+BATCH_SIZE = max(1, int(os.getenv("OPENAI_BATCH", "1")))   # 1リクエストにまとめる商品数
+# モデルの1応答あたり出力上限。まとめ生成の max_completion_tokens はこれを超えないように抑える
+MAX_OUTPUT_TOKENS = int(os.getenv("OPENAI_MAX_OUTPUT_TOKENS", "16384"))
+REFINE_PROCS = int(os.getenv("REFINE_PROCS", "0")) or (os.cpu_count() or 1)  # 整形のプロセス数
+PARALLEL_REFINE_MIN = 500   # これ未満の件数はプロセス起動の方が高くつくので逐次
 
 # ====== 正規表現 ======
 LEADING_ENUM_RE = re.compile(r"^\s*[\d①②③④⑤⑥⑦⑧⑨⑩\-\*\・●]\s*[\.．、]?\s*")
 MULTI_COMMA_RE = re.compile(r"、{3,}")
 WS_RE = re.compile(r"\s+")
+BATCH_HEAD_RE = re.compile(r"^\s*===\s*P(\d+)\s*===.*$", re.M)   # まとめ生成の商品見出し行
+# 禁則語は1本の正規表現で1パス除去（長い語を優先：「購入はこちら」を「こちら」より先に）
+FORBIDDEN_RE = re.compile("|".join(map(re.escape, sorted(FORBIDDEN, key=len, reverse=True))))
 
 # ====== 環境設定 ======
 def init_env_and_client():
@@ -72,27 +117,28 @@ def init_env_and_client():
 def load_products(path):
     if not os.path.exists(path):
         raise SystemExit(f"❌ 入力CSVが見つかりません: {path}")
-    products = []
+    if pd is not None:
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            if "商品名" not in next(csv.reader(f), []):
+                raise SystemExit("❌ CSVに『商品名』列が存在しません。")
+        try:
+            col = pd.read_csv(path, usecols=["商品名"], dtype=str, keep_default_na=False,
+                              encoding="utf-8", engine=CSV_ENGINE)["商品名"]
+            return list(dict.fromkeys(nm for nm in col.str.strip().tolist() if nm))
+        except Exception:
+            pass  # 改行入りの引用セルなど pyarrow で読めない行は DictReader で読み直す
     with open(path, "r", encoding="utf-8", newline="") as f:
         reader = csv.DictReader(f)
         if "商品名" not in reader.fieldnames:
             raise SystemExit("❌ CSVに『商品名』列が存在しません。")
-        for r in reader:
-            nm = (r.get("商品名") or "").strip()
-            if nm:
-                products.append(nm)
-    seen, uniq = set(), []
-    for nm in products:
-        if nm not in seen:
-            uniq.append(nm)
-            seen.add(nm)
-    return uniq
+        # 空欄を除き、初出順のまま重複除去
+        return list(dict.fromkeys(nm for r in reader if (nm := (r.get("商品名") or "").strip())))
 
 # ====== 知見要約 ======
 def safe_load_json(path):
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(path, "rb") as f:
+            return _json_loads(f.read())
     except Exception:
         return None
 
@@ -101,8 +147,10 @@ def summarize_knowledge():
         return "主要スペック・用途・対象・機能・便益を自然に含める。", FORBIDDEN[:]
     files = glob.glob(os.path.join(SEMANTICS_DIR, "*.json"))
     clusters, market, concept, tmpl, forbid_local = [], [], [], [], []
-    for p in files:
-        data = safe_load_json(p)
+    # 読込はI/O待ちが主なのでスレッドで並行（集約は元の順で逐次）
+    with ThreadPoolExecutor(max_workers=min(32, len(files) or 1)) as ex:
+        loaded = list(zip(files, ex.map(safe_load_json, files)))
+    for p, data in loaded:
         if not data:
             continue
         name = os.path.basename(p).lower()
@@ -144,7 +192,7 @@ def summarize_knowledge():
             forbid_local += [v for v in data_dict.get("forbidden_words", []) if isinstance(v, str)]
 
     all_forbid = list({*FORBIDDEN, *forbid_local})
-    def cap(xs, n): return "、".join(list(dict.fromkeys([x for x in xs if isinstance(x, str)]))[:n])
+    def cap(xs, n): return "、".join(list(dict.fromkeys(x for x in xs if isinstance(x, str)))[:n])
     text = f"語彙:{cap(clusters,6)} / 市場語:{cap(market,6)} / 構造:{cap(concept,5)} / 骨子:{cap(tmpl,3)}。"
     text += "自然な日本語で1〜2文、句点終止で書く。"
     return text, all_forbid
@@ -158,43 +206,249 @@ SYSTEM_PROMPT = (
     "画像や写真、レビュー、ランキング、当店などのメタ語は禁止。\n"
 )
 
-def build_user_prompt(product, knowledge_text, forbid_words):
+def build_prompt_tail(knowledge_text, forbid_words):
+    """商品名より後ろ（知見・禁止語・指示）は全商品共通なので1回だけ組み立てる"""
     forbid_txt = "、".join(sorted(set(forbid_words)))
     return (
-        f"商品名: {product}\n"
         f"{knowledge_text}\n"
         f"禁止語: {forbid_txt}\n"
         "20行の自然文ALTを出力してください。各行は句点終止の1〜2文。"
     )
 
+def build_user_prompt(product, prompt_tail):
+    return f"商品名: {product}\n{prompt_tail}"
+
+def build_batch_prompt(products, prompt_tail):
+    heads = "\n".join(f"=== P{k} === 商品名: {p}" for k, p in enumerate(products, 1))
+    return (
+        f"{heads}\n{prompt_tail}\n"
+        f"上記{len(products)}商品それぞれについて、必ず「=== P番号 ===」の見出し行を1行置き、その直後に20行を出力してください。"
+    )
+
+def split_batch_content(content, n, truncated=False):
+    """
+    まとめ生成の応答を見出しで分割 → {商品番号(1始まり): 行リスト}。
+    番号外・20行未満・重複見出しは捨てる。上限で打ち切られた応答（truncated）は最後の商品が途中なので捨てる
+    """
+    parts = BATCH_HEAD_RE.split(content)
+    out = {}
+    last = None
+    for k, body in zip(parts[1::2], parts[2::2]):
+        k = int(k)
+        lines = [ln.strip() for ln in body.split("\n") if ln.strip()][:80]
+        last = k
+        if 1 <= k <= n and len(lines) >= 20 and k not in out:
+            out[k] = lines
+    if truncated and last is not None:
+        out.pop(last, None)
+    return out
+
 # ====== OpenAI呼び出し ======
-def call_openai_20_lines(client, model, temp, max_tokens, product, kb_text, forbid_words, retry=2, wait=10):
-    user_prompt = build_user_prompt(product, kb_text, forbid_words)
+class TokenBucket:
+    """RPM/TPM のトークンバケット（スレッド間で共有）。経過時間で補充し、足りない分だけ待ってから消費する"""
+    def __init__(self, rpm=RPM_LIMIT, tpm=TPM_LIMIT):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.available_requests = float(rpm)
+        self.available_tokens = float(tpm)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        if self.rpm > 0:
+            self.available_requests = min(self.rpm, self.available_requests + elapsed * self.rpm / 60.0)
+        if self.tpm > 0:
+            self.available_tokens = min(self.tpm, self.available_tokens + elapsed * self.tpm / 60.0)
+
+    def consume(self, est_tokens=0):
+        tokens = min(est_tokens, self.tpm)  # 容量超えの見積りで永久に待たないように
+        while True:
+            with self.lock:
+                self._refill(time.monotonic())
+                short_req = (1 - self.available_requests) * 60.0 / self.rpm if self.rpm > 0 else 0.0
+                short_tok = (tokens - self.available_tokens) * 60.0 / self.tpm if self.tpm > 0 else 0.0
+                delay = max(short_req, short_tok)
+                if delay <= 0:
+                    if self.rpm > 0:
+                        self.available_requests -= 1
+                    if self.tpm > 0:
+                        self.available_tokens -= tokens
+                    return
+            time.sleep(delay)
+
+_cache_conn = None
+_cache_lock = threading.Lock()  # 1本の接続をワーカースレッドで共有するため直列化
+
+def _cache_db():
+    global _cache_conn
+    if _cache_conn is None:
+        os.makedirs(OUT_DIR, exist_ok=True)
+        _cache_conn = sqlite3.connect(PROMPT_CACHE_PATH, check_same_thread=False)
+        _cache_conn.execute("CREATE TABLE IF NOT EXISTS kv(k TEXT PRIMARY KEY, v BLOB)")
+    return _cache_conn
+
+def _cache_key(model, temp, user_prompt):
+    payload = json.dumps({"m": model, "t": temp, "s": SYSTEM_PROMPT, "u": user_prompt}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _cache_get(key):
+    if not PROMPT_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        row = _cache_db().execute("SELECT v FROM kv WHERE k = ?", (key,)).fetchone()
+    return _json_loads(row[0]) if row else None
+
+def _cache_set(key, lines):
+    if not PROMPT_CACHE_ENABLED:
+        return
+    with _cache_lock:
+        db = _cache_db()
+        db.execute("INSERT OR REPLACE INTO kv (k, v) VALUES (?, ?)", (key, json.dumps(lines, ensure_ascii=False)))
+        db.commit()
+
+def backoff_delay(prev, retry_after=None, base=1.0, cap=60.0):
+    """次の待機秒数。Retry-After ヘッダがあればそれに従い、無ければ decorrelated jitter（前回×3 までの乱数）"""
+    if retry_after is not None:
+        try:
+            return min(cap, max(0.0, float(retry_after)))
+        except (TypeError, ValueError):
+            pass
+    return min(cap, random.uniform(base, max(base, prev * 3)))
+
+def is_permanent_error(e):
+    """再試行しても無駄なエラー（認証・不正リクエスト・クォータ切れ）"""
+    return getattr(e, "status_code", None) in NO_RETRY_STATUS or getattr(e, "code", None) == "insufficient_quota"
+
+class TokenBudget:
+    """
+    max_completion_tokens の自動調整役（スレッド間で共有）
+    - 直近 window 件の usage.completion_tokens の p95×1.1 を上限にする（[floor, 設定値] にクランプ）
+    - 上限で打ち切られた応答（finish_reason=length）が出たら観測を捨て、設定値に戻して測り直す
+    """
+    def __init__(self, cap, floor=TOKEN_BUDGET_FLOOR, warmup=TOKEN_BUDGET_WARMUP, window=50):
+        self.cap = cap
+        self.floor = min(floor, cap)
+        self.warmup = warmup
+        self.used = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def current(self):
+        with self.lock:
+            if len(self.used) < self.warmup:
+                return self.cap
+            xs = sorted(self.used)
+        p95 = xs[min(len(xs) - 1, int(len(xs) * 0.95))]
+        return max(self.floor, min(self.cap, int(p95 * 1.1)))
+
+    def observe(self, res):
+        n = getattr(getattr(res, "usage", None), "completion_tokens", None)
+        truncated = getattr(res.choices[0], "finish_reason", None) == "length"
+        with self.lock:
+            if truncated:
+                self.used.clear()
+            elif isinstance(n, int) and n > 0:
+                self.used.append(n)
+
+def call_openai_20_lines(client, model, temp, max_tokens, product, prompt_tail, retry=6, wait=1.0, bucket=None, budget=None):
+    user_prompt = build_user_prompt(product, prompt_tail)
+    cache_key = _cache_key(model, temp, user_prompt)
+    cached = _cache_get(cache_key)
+    if cached:
+        return cached
+    delay = wait
+    full = False  # 絞った上限で打ち切られたら以降は設定値で取り直す
     for attempt in range(retry):
         try:
+            limit = budget.current() if (budget and not full) else max_tokens
+            if bucket:
+                bucket.consume(est_tokens=limit + len(user_prompt) // 2)
             res = client.chat.completions.create(
                 model=model,
                 messages=[
                     {"role": "system", "content": SYSTEM_PROMPT},
                     {"role": "user", "content": user_prompt},
                 ],
-                max_completion_tokens=max_tokens,
+                max_completion_tokens=limit,
                 temperature=temp,
             )
+            if budget:
+                budget.observe(res)
+            truncated = getattr(res.choices[0], "finish_reason", None) == "length"
+            if truncated and limit < max_tokens:
+                # p95 で絞った上限で切れた → 途中までの応答は使わず、設定値ですぐ取り直す
+                full = True
+                continue
             content = (res.choices[0].message.content or "").strip()
             if not content:
                 raise ValueError("空応答を検出")
-            lines = [ln.strip() for ln in content.split("\n") if ln.strip()]
-            return lines[:80]
+            lines = [ln.strip() for ln in content.split("\n") if ln.strip()][:80]
+            if not truncated:
+                _cache_set(cache_key, lines)  # 補完文（失敗時）・途中で切れた応答はキャッシュしない
+            return lines
         except Exception as e:
             print(f"⚠️ OpenAIエラー({attempt+1}/{retry}): {e}")
-            if "insufficient_quota" in str(e):
-                print("💤 クォータ制限による一時停止。10分待機後に再試行します。")
-                time.sleep(600)  # 10分待機
-            else:
-                time.sleep(wait)
+            if is_permanent_error(e):
+                print("⛔ 再試行しても解消しないエラーのため中断します。")
+                break
+            if attempt + 1 < retry:
+                headers = getattr(getattr(e, "response", None), "headers", None) or {}
+                delay = backoff_delay(delay, headers.get("retry-after"), base=wait)
+                time.sleep(delay)
     return [f"{product}は高品質な設計で、快適に使用できます。"] * 20
 
+def call_openai_batch(client, model, temp, max_tokens, items, prompt_tail, bucket=None, budget=None):
+    """
+    items: [(入力位置, 商品名)] → [(入力位置, 行リスト)]
+    キャッシュに無い商品を1リクエストにまとめて生成し、見出しで分割できなかった商品だけ単品呼び出しへ回す
+    """
+    if len(items) == 1:
+        i, p = items[0]
+        return [(i, call_openai_20_lines(client, model, temp, max_tokens, p, prompt_tail, bucket=bucket, budget=budget))]
+    results, pending = [], []
+    # まとめ生成の応答は他の商品と一緒に作った別プロンプトの結果なので、単品とは別キー（batch:）に置く。
+    # 単品の応答はまとめ生成でもそのまま使える
+    for i, p in items:
+        user_prompt = build_user_prompt(p, prompt_tail)
+        cached = _cache_get(_cache_key(model, temp, "batch:" + user_prompt)) or _cache_get(_cache_key(model, temp, user_prompt))
+        if cached:
+            results.append((i, cached))
+        else:
+            pending.append((i, p))
+    if len(pending) > 1:
+        user_prompt = build_batch_prompt([p for _, p in pending], prompt_tail)
+        got = {}
+        # 1商品ぶんの上限×件数（モデルの出力上限で頭打ち。足りずに切れた商品は単品へ回る）
+        limit = min((budget.current() if budget else max_tokens) * len(pending), MAX_OUTPUT_TOKENS)
+        try:
+            if bucket:
+                bucket.consume(est_tokens=limit + len(user_prompt) // 2)
+            res = client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": user_prompt},
+                ],
+                max_completion_tokens=limit,
+                temperature=temp,
+            )
+            truncated = getattr(res.choices[0], "finish_reason", None) == "length"
+            got = split_batch_content((res.choices[0].message.content or "").strip(), len(pending), truncated)
+        except Exception as e:
+            print(f"⚠️ まとめ生成エラー（単品で再試行します）: {e}")
+        rest = []
+        for k, (i, p) in enumerate(pending, 1):
+            if k in got:
+                _cache_set(_cache_key(model, temp, "batch:" + build_user_prompt(p, prompt_tail)), got[k])
+                results.append((i, got[k]))
+            else:
+                rest.append((i, p))
+        pending = rest
+    for i, p in pending:
+        results.append((i, call_openai_20_lines(client, model, temp, max_tokens, p, prompt_tail, bucket=bucket, budget=budget)))
+    return results
+
 # ====== ローカル整形 ======
 def looks_listy(s):
     if not s: return True
@@ -209,8 +463,7 @@ def rewrite_listy_to_sentence(s):
     head = "、".join(bits[:2])
     tail = "、".join(bits[2:]) if len(bits) > 2 else ""
     cand = f"{head}を備え、{tail}でも使いやすい設計です。" if tail else f"{head}に対応し、日常を快適にします。"
-    for ng in FORBIDDEN:
-        cand = cand.replace(ng, "")
+    cand = FORBIDDEN_RE.sub("", cand)
     if not cand.endswith("。"):
         cand += "。"
     return cand
@@ -236,9 +489,7 @@ def soft_clip_sentence(t):
         p = cut.rfind("。")
         if p != -1:
             t = cut[:p+1]
-    for ng in FORBIDDEN:
-        t = t.replace(ng, "")
-    return t.strip()
+    return FORBIDDEN_RE.sub("", t).strip()
 
 def refine_20_lines(raw_lines):
     raw_lines = normalize_lines(raw_lines)
@@ -248,15 +499,32 @@ def refine_20_lines(raw_lines):
         uniq.append(f"{uniq[-1]}より使いやすいデザインです。")
     return uniq[:20]
 
+def use_process_refine(n):
+    """n 件の整形をプロセス並列にするか（少数ならプロセス起動の方が高くつく）"""
+    return n >= PARALLEL_REFINE_MIN and REFINE_PROCS > 1
+
+def refine_all(raws):
+    """全商品の整形をプロセス並列で（純CPU処理。結果は入力順）"""
+    with ProcessPoolExecutor(max_workers=REFINE_PROCS) as ex:
+        return list(ex.map(refine_20_lines, raws, chunksize=max(1, len(raws) // (REFINE_PROCS * 4))))
+
 # ====== 出力 ======
+PAD20 = [""] * 20
+CSV_BUFFER = 1 << 20  # 書き込みバッファ（1MB）
+
 def ensure_outdir(): os.makedirs(OUT_DIR, exist_ok=True)
 def write_csv(path, products, data, prefix):
-    with open(path, "w", encoding="utf-8", newline="") as f:
+    with open(path, "w", encoding="utf-8", newline="", buffering=CSV_BUFFER) as f:
         w = csv.writer(f)
         w.writerow(["商品名"] + [f"{prefix}_{i+1}" for i in range(20)])
-        for p, lines in zip(products, data):
-            row = [p] + (lines[:20] + [""] * max(0, 20 - len(lines)))
-            w.writerow(row)
+        # 20列に満たない分は空欄で埋め、まとめて書き出す
+        w.writerows([p] + (lines + PAD20)[:20] for p, lines in zip(products, data))
+
+def write_diff(path, products, all_raw, all_ref):
+    with open(path, "w", encoding="utf-8", newline="", buffering=CSV_BUFFER) as f:
+        w = csv.writer(f)
+        w.writerow(["商品名"] + [f"ALT_raw_{i+1}" for i in range(20)] + [f"ALT_ref_{i+1}" for i in range(20)])
+        w.writerows([p] + raw[:20] + ref[:20] for p, raw, ref in zip(products, all_raw, all_ref))
 
 # ====== メイン ======
 def main():
@@ -268,27 +536,44 @@ def main():
     print(f"✅ 対象商品: {len(products)}件")
 
     kb_text, forb = summarize_knowledge()
-    all_raw, all_ref = [], []
+    prompt_tail = build_prompt_tail(kb_text, forb)
 
-    for p in tqdm(products, desc="🧠 生成中", total=len(products)):
-        raw = call_openai_20_lines(client, model, temp, max_tokens, p, kb_text, forb)
-        refined = refine_20_lines(raw)
-        all_raw.append(raw[:20])
-        all_ref.append(refined)
-        time.sleep(1.5)  # 負荷分散スリープ
+    # AI生成は BATCH_SIZE 商品ずつ CONCURRENCY 本並列（結果は入力順の位置へ）
+    raws = [None] * len(products)
+    all_ref = [None] * len(products)
+    process_refine = use_process_refine(len(products))
+    bucket = TokenBucket()
+    budget = TokenBudget(max_tokens) if ADAPTIVE_TOKENS else None
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        items = list(enumerate(products))
+        futs = [
+            pool.submit(call_openai_batch, client, model, temp, max_tokens, items[k:k + BATCH_SIZE], prompt_tail, bucket=bucket, budget=budget)
+            for k in range(0, len(items), BATCH_SIZE)
+        ]
+        for fut in tqdm(as_completed(futs), desc="🧠 生成中", total=len(futs)):
+            for i, raw in fut.result():
+                raws[i] = raw
+                if not process_refine:
+                    # 届いた順に整形（ワーカーはHTTP待ちなので、その間にこちらで整形が進む）
+                    all_ref[i] = refine_20_lines(raw)
 
-    write_csv(RAW_PATH, products, all_raw, "ALT_raw")
-    write_csv(REF_PATH, products, all_ref, "ALT")
+    if process_refine:
+        all_ref = refine_all(raws)
+    all_raw = [raw[:20] for raw in raws]
 
-    # diff 出力
-    with open(DIFF_PATH, "w", encoding="utf-8", newline="") as f:
-        w = csv.writer(f)
-        w.writerow(["商品名"] + [f"ALT_raw_{i+1}" for i in range(20)] + [f"ALT_ref_{i+1}" for i in range(20)])
-        for p, raw, ref in zip(products, all_raw, all_ref):
-            w.writerow([p] + raw[:20] + ref[:20])
+    # 3ファイルは互いに独立なので並行して書き出す（例外は result() で表に出す）
+    with ThreadPoolExecutor(max_workers=3) as ex:
+        jobs = [
+            ex.submit(write_csv, RAW_PATH, products, all_raw, "ALT_raw"),
+            ex.submit(write_csv, REF_PATH, products, all_ref, "ALT"),
+            ex.submit(write_diff, DIFF_PATH, products, all_raw, all_ref),
+        ]
+        for job in jobs:
+            job.result()
 
     print(f"✅ 出力完了:\n   - AI生出力: {RAW_PATH}\n   - 整形後   : {REF_PATH}\n   - 差分比較 : {DIFF_PATH}")
 
 if __name__ == "__main__":
     main()
-import atlas_autosave_core
+    # 自動保存はスクリプトとして実行したときだけ（整形プロセスは spawn 時に __mp_main__ として読み込むので走らせない）
+    import atlas_autosave_core
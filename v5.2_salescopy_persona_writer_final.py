@@ -11,6 +11,7 @@ v5.2 Sales Copy Persona Writer (ALT for Rakuten, 20 lines each)
     - .env から OPENAI_API_KEY を取得
     - OPENAI_MODEL（指定なければ 'gpt-4o'）/ OPENAI_TEMPERATURE / OPENAI_MAX_TOKENS を使用
     - chat.completions（response_format={"type":"text"}）
+    - 商品ごとの生成は OPENAI_CONCURRENCY 本並列（既定8、スレッド）
 - 仕様要点:
     - 楽天ALT専用（Yahooで使う販促語は避ける）
     - 画像描写語・メタ語・競合比較のメタ表現は禁止
@@ -26,18 +27,41 @@ import csv
 import glob
 import json
 import time
+import pickle
+import random
+import hashlib
+import importlib.util
+import sqlite3
+import threading
+import unicodedata
 from pathlib import Path
-from difflib import SequenceMatcher
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import defaultdict, deque
 
 from dotenv import load_dotenv
 
+from salescopy_refine import FINAL_MIN, FINAL_MAX, refine_20_lines
+
 # tqdm（未インストールでも動く）
 try:
     from tqdm.auto import tqdm
 except Exception:
     def tqdm(x, **k): return x
 
+# 商品CSVの読込は pandas があれば使う（pyarrow もあればそのパーサ。無ければ csv.DictReader）
+try:
+    import pandas as pd
+except Exception:
+    pd = None
+CSV_ENGINE = "pyarrow" if importlib.util.find_spec("pyarrow") else "c"
+
+# JSON読込は orjson があれば使う（無ければ標準 json）
+try:
+    import orjson
+    _json_loads = orjson.loads
+except Exception:
+    _json_loads = json.loads
+
 # OpenAI SDK（新旧混在対策）
 try:
     from openai import OpenAI
@@ -56,8 +80,14 @@ RAW_PATH = os.path.join(OUT_DIR, "alt_text_ai_raw_salescopy_v5_2.csv")
 REF_PATH = os.path.join(OUT_DIR, "alt_text_refined_salescopy_v5_2.csv")
 DIFF_PATH = os.path.join(OUT_DIR, "alt_text_diff_salescopy_v5_2.csv")
 
+# OpenAI応答のキャッシュ（同一プロンプトは再実行時もAPIを呼ばない。OPENAI_PROMPT_CACHE=0 で無効）
+PROMPT_CACHE_PATH = os.path.join(OUT_DIR, ".cache.sqlite")
+PROMPT_CACHE_ENABLED = os.getenv("OPENAI_PROMPT_CACHE", "1") != "0"
+
 # 知見（要：かんなめ）
 SEMANTICS_DIR = "./output/semantics"
+# 知見集約のキャッシュ（JSON群の mtime が変わらない限り再利用）
+KB_CACHE_PREFIX = ".cache_v5_2_"
 
 # 禁則語（画像描写語・メタ・店舗メタなど）— 楽天ALT専用
 FORBIDDEN_BASE = [
@@ -70,18 +100,26 @@ FORBIDDEN_BASE = [
 
 # 句読点や箇条書きの掃除
 LEADING_ENUM_RE = re.compile(r"^\s*[\d一二三四五六七八九十①②③④⑤⑥⑦⑧⑨⑩\-\*\・\u2022]\s*[\.．、]?\s*")
-WS_RE = re.compile(r"\s+")
-MULTI_COMMA_RE = re.compile(r"、{3,}")
-
 # 文長ポリシー
-RAW_MIN, RAW_MAX = 100, 130     # AIにはこのレンジを狙わせる
-FINAL_MIN, FINAL_MAX = 80, 110  # ローカルで最終調整
+RAW_MIN, RAW_MAX = 100, 130     # AIにはこのレンジを狙わせる（最終調整の FINAL_MIN/MAX は salescopy_refine 側）
+
+# 同時に投げるリクエスト数（スレッド数）
+CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "8"))
+
+# リトライしても結果が変わらないHTTPステータス（即あきらめる）
+NO_RETRY_STATUS = {400, 401, 403, 404}
 
-# 重複近似の閾値
-SIM_THRESHOLD = 0.90
+# レート制御：OPENAI_RPM / OPENAI_TPM のトークンバケット（0 ならその軸は無制限＝ヘッダ追従のみ）
+# 残量が閾値以下ならリセットまで待つ
+RPM_LIMIT = int(os.getenv("OPENAI_RPM", "0"))
+TPM_LIMIT = int(os.getenv("OPENAI_TPM", "0"))
+RATE_LOW_REQUESTS = 2
+RATE_LOW_TOKENS = 4000
 
-# 体言止めの適用率（目安）
-TAIGEN_RATE = 0.35
+# 出力上限の自動調整：直近の completion_tokens の p95×1.1 へ絞る（OPENAI_ADAPTIVE_TOKENS=0 で無効）
+ADAPTIVE_TOKENS = os.getenv("OPENAI_ADAPTIVE_TOKENS", "1") != "0"
+TOKEN_BUDGET_FLOOR = 800    # これより下げない
+TOKEN_BUDGET_WARMUP = 10    # この件数を観測するまでは設定値のまま
 
 # ==============
 # 1) “要（かんなめ）”
@@ -113,36 +151,146 @@ def init_env_and_client():
 # ==============
 # 3) 入力（商品名）
 # ==============
+def product_key(name: str) -> str:
+    """表記ゆれを吸収した重複判定キー（NFKC・空白圧縮・小文字化）"""
+    return " ".join(unicodedata.normalize("NFKC", name).split()).lower()
+
 def load_products(path: str):
     if not os.path.exists(path):
         raise SystemExit(f"❌ 入力CSVが見つかりません: {path}")
-    products = []
-    with open(path, "r", encoding="utf-8", newline="") as f:
-        reader = csv.DictReader(f)
-        if "商品名" not in reader.fieldnames:
-            raise SystemExit("❌ 入力CSVに『商品名』ヘッダが見つかりません。")
-        for r in reader:
-            nm = (r.get("商品名") or "").strip()
-            if nm:
-                products.append(nm)
-    # 重複除去（順序保持）
-    seen, uniq = set(), []
+    products = None
+    if pd is not None:
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            if "商品名" not in next(csv.reader(f), []):
+                raise SystemExit("❌ 入力CSVに『商品名』ヘッダが見つかりません。")
+        try:
+            col = pd.read_csv(path, usecols=["商品名"], dtype=str, keep_default_na=False,
+                              encoding="utf-8", engine=CSV_ENGINE)["商品名"]
+            products = [nm for nm in col.str.strip().tolist() if nm]
+        except Exception:
+            pass  # 改行入りの引用セルなど pyarrow で読めない行は DictReader で読み直す
+    if products is None:
+        products = []
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            reader = csv.DictReader(f)
+            if "商品名" not in reader.fieldnames:
+                raise SystemExit("❌ 入力CSVに『商品名』ヘッダが見つかりません。")
+            for r in reader:
+                nm = (r.get("商品名") or "").strip()
+                if nm:
+                    products.append(nm)
+    # 重複除去（順序保持）。全角/半角・空白・大小文字だけの違いは同一商品として1回だけ生成し、
+    # 別表記は aliases[代表表記] に残して書き出し時に同じ行をコピーする
+    seen, uniq, aliases = {}, [], {}
     for nm in products:
-        if nm not in seen:
-            seen.add(nm)
+        key = product_key(nm)
+        rep = seen.get(key)
+        if rep is None:
+            seen[key] = nm
             uniq.append(nm)
-    return uniq
+        elif nm != rep and nm not in aliases.setdefault(rep, []):
+            aliases[rep].append(nm)
+    return uniq, aliases
 
 # ==============
 # 4) 知見集約（要）
 # ==============
 def safe_load_json(path):
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(path, "rb") as f:
+            return _json_loads(f.read())
+    except Exception:
+        return None
+
+def _kb_cache_path(paths):
+    """JSON群の (パス, mtime) と基本禁則語からキャッシュファイル名を決める"""
+    sig_src = repr(sorted((p, os.path.getmtime(p)) for p in paths)) + repr(FORBIDDEN_BASE)
+    sig = hashlib.sha1(sig_src.encode("utf-8")).hexdigest()
+    return os.path.join(SEMANTICS_DIR, f"{KB_CACHE_PREFIX}{sig}.pkl")
+
+def _kb_cache_load(cache_path):
+    try:
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
     except Exception:
         return None
 
+def _kb_cache_save(cache_path, result):
+    # 古い世代は掃除してから原子的に書き込む（失敗しても本処理は続行）
+    try:
+        for old in glob.glob(os.path.join(SEMANTICS_DIR, f"{KB_CACHE_PREFIX}*.pkl")):
+            if old != cache_path:
+                os.remove(old)
+        tmp = cache_path + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(result, f)
+        os.replace(tmp, cache_path)
+    except Exception:
+        pass
+
+def _str_items(xs):
+    return [x for x in xs if isinstance(x, str)] if isinstance(xs, list) else []
+
+# 各抽出器は (配列データ, dictデータ) を受け取り文字列のリストを返す（該当しない側は空）
+def _kb_lexical(lst, dct):
+    out = []
+    for item in lst:
+        if isinstance(item, dict) and isinstance(item.get("terms"), list):
+            out += _str_items(item["terms"])
+        elif isinstance(item, str):
+            out.append(item)
+    arr = dct.get("clusters") or dct.get("lexical") or []
+    if isinstance(arr, list):
+        for c in arr:
+            if isinstance(c, dict) and isinstance(c.get("terms"), list):
+                out += _str_items(c["terms"])
+    return out
+
+def _kb_market(lst, dct):
+    out = []
+    for v in lst:
+        if isinstance(v, dict) and isinstance(v.get("vocabulary"), str):
+            out.append(v["vocabulary"])
+        elif isinstance(v, str):
+            out.append(v)
+    return out + _str_items(dct.get("vocabulary") or dct.get("vocab") or [])
+
+def _kb_semantics(lst, dct):
+    out = _str_items(lst)
+    for k in ["concepts", "semantics", "frames", "features", "facets", "benefits", "scenes", "targets", "use_cases"]:
+        out += _str_items(dct.get(k) or [])
+    return out
+
+def _kb_persona(lst, dct):
+    out = _str_items(lst)
+    t = dct.get("tone") or dct.get("style") or {}
+    if isinstance(t, dict):
+        out += [v for v in t.values() if isinstance(v, str)]
+    # fallback: フラット文字列の配列も拾う
+    for k in ["persona", "tones", "styles"]:
+        out += _str_items(dct.get(k) or [])
+    return out
+
+def _kb_forbid(lst, dct):
+    return _str_items(lst) + _str_items(dct.get("forbidden_words") or [])
+
+def _kb_templates(lst, dct):
+    return _str_items(lst) + _str_items(dct.get("hints") or dct.get("templates") or [])
+
+# ファイル名（小文字）に含まれる語 → 集約先・抽出器。上から順に最初に当たったものだけ使う
+KB_DISPATCH = [
+    (("lexical",), "clusters", _kb_lexical),
+    (("market",), "market", _kb_market),
+    (("semantic",), "semantics", _kb_semantics),
+    (("persona",), "persona", _kb_persona),
+    (("normalized", "forbid"), "forbid", _kb_forbid),
+    (("template",), "templates", _kb_templates),
+]
+
+def uniq_cap(xs, n):
+    """文字列だけを出現順のまま重複除去して先頭 n 件（dict の挿入順を利用した O(n)）"""
+    return list(dict.fromkeys(x for x in xs if isinstance(x, str)))[:n]
+
 def summarize_knowledge_relaxed():
     """
     /output/semantics 配下の JSON 群（形式バラバラOK）を「要」として緩やかに統合。
@@ -153,95 +301,41 @@ def summarize_knowledge_relaxed():
     - normalized_*.json          → 禁則語など
     - template_composer.json     → 骨子ヒント
     """
-    clusters, market, semantics, persona, templates, forbid_local = [], [], [], [], [], []
     if not os.path.isdir(SEMANTICS_DIR):
         # 要の初期知見（最低限）
         base_text = ("知見: 主要キーワード・スペック・対応機種・利用シーン・対象・便益を自然に織り込み、"
                      "箇条書きを避け、自然な日本語で2文以内を基本。")
         return base_text, FORBIDDEN_BASE[:]
 
-    for p in glob.glob(os.path.join(SEMANTICS_DIR, "*.json")):
-        data = safe_load_json(p)
+    files = glob.glob(os.path.join(SEMANTICS_DIR, "*.json"))
+    cache_path = _kb_cache_path(files)
+    cached = _kb_cache_load(cache_path)
+    if cached is not None:
+        return cached
+
+    buckets = {bucket: [] for _, bucket, _ in KB_DISPATCH}
+    # 読込はI/O待ちが主なのでスレッドで並行（集約は元の順で逐次）
+    with ThreadPoolExecutor(max_workers=min(32, len(files) or 1)) as ex:
+        loaded = list(zip(files, ex.map(safe_load_json, files)))
+    for p, data in loaded:
         if data is None:
             continue
         name = os.path.basename(p).lower()
-
-        try:
-            # 配列/dict 混在を吸収
-            if "lexical" in name:
-                if isinstance(data, list):
-                    for item in data:
-                        if isinstance(item, dict) and "terms" in item and isinstance(item["terms"], list):
-                            clusters += [t for t in item["terms"] if isinstance(t, str)]
-                        elif isinstance(item, str):
-                            clusters.append(item)
-                elif isinstance(data, dict):
-                    arr = data.get("clusters") or data.get("lexical") or []
-                    if isinstance(arr, list):
-                        for c in arr:
-                            if isinstance(c, dict) and isinstance(c.get("terms"), list):
-                                clusters += [t for t in c["terms"] if isinstance(t, str)]
-
-            elif "market_vocab" in name or "market" in name:
-                if isinstance(data, list):
-                    for v in data:
-                        if isinstance(v, dict) and isinstance(v.get("vocabulary"), str):
-                            market.append(v["vocabulary"])
-                        elif isinstance(v, str):
-                            market.append(v)
-                elif isinstance(data, dict):
-                    vocab = data.get("vocabulary") or data.get("vocab") or []
-                    if isinstance(vocab, list):
-                        market += [x for x in vocab if isinstance(x, str)]
-
-            elif "structured_semantics" in name or "semantic" in name:
-                if isinstance(data, dict):
-                    for k in ["concepts", "semantics", "frames", "features", "facets", "benefits", "scenes", "targets", "use_cases"]:
-                        arr = data.get(k) or []
-                        if isinstance(arr, list):
-                            semantics += [x for x in arr if isinstance(x, str)]
-                elif isinstance(data, list):
-                    semantics += [x for x in data if isinstance(x, str)]
-
-            elif "styled_persona" in name or "persona" in name:
-                if isinstance(data, dict):
-                    t = data.get("tone") or data.get("style") or {}
-                    if isinstance(t, dict):
-                        for v in t.values():
-                            if isinstance(v, str):
-                                persona.append(v)
-                    # fallback: フラット文字列の配列も拾う
-                    for k in ["persona", "tones", "styles"]:
-                        arr = data.get(k) or []
-                        if isinstance(arr, list):
-                            persona += [x for x in arr if isinstance(x, str)]
-                elif isinstance(data, list):
-                    persona += [x for x in data if isinstance(x, str)]
-
-            elif "normalized" in name or "forbid" in name:
-                if isinstance(data, dict):
-                    fw = data.get("forbidden_words") or []
-                    if isinstance(fw, list):
-                        forbid_local += [w for w in fw if isinstance(w, str)]
-                elif isinstance(data, list):
-                    forbid_local += [w for w in data if isinstance(w, str)]
-
-            elif "template_composer" in name or "template" in name:
-                if isinstance(data, dict):
-                    hints = data.get("hints") or data.get("templates") or []
-                    if isinstance(hints, list):
-                        templates += [h for h in hints if isinstance(h, str)]
-                elif isinstance(data, list):
-                    templates += [x for x in data if isinstance(x, str)]
-
-        except Exception:
-            # 形式不一致は黙ってスキップ（堅牢重視）
-            pass
+        # 配列/dict 混在を吸収してから、ファイル名で最初に当たった抽出器へ
+        lst = data if isinstance(data, list) else []
+        dct = data if isinstance(data, dict) else {}
+        for keys, bucket, extract in KB_DISPATCH:
+            if any(k in name for k in keys):
+                try:
+                    buckets[bucket] += extract(lst, dct)
+                except Exception:
+                    # 形式不一致は黙ってスキップ（堅牢重視）
+                    pass
+                break
+    clusters, market, semantics = buckets["clusters"], buckets["market"], buckets["semantics"]
+    persona, templates, forbid_local = buckets["persona"], buckets["templates"], buckets["forbid"]
 
     # ユニーク＆上限
-    def uniq_cap(xs, n):
-        return list(dict.fromkeys([x for x in xs if isinstance(x, str)]))[:n]
-
     clusters = uniq_cap(clusters, 18)
     market   = uniq_cap(market,   18)
     semantics= uniq_cap(semantics,18)
@@ -263,6 +357,7 @@ def summarize_knowledge_relaxed():
         kb_text = ("知見（要）: 主要キーワード・スペック・対応機種・利用シーン・対象・便益を自然に織り込む。"
                    "箇条書きを避け、自然な日本語で2文以内を基本。")
     kb_text += " ALTは画像描写語やECメタ語を使わず、自然文として読めること。"
+    _kb_cache_save(cache_path, (kb_text, forbid_all))
     return kb_text, forbid_all
 
 # ==============
@@ -280,39 +375,197 @@ SYSTEM_PROMPT = (
     "出力はテキスト20行のみ（JSON/箇条書き/番号/ラベル禁止）。"
 )
 
-def build_user_prompt(product: str, knowledge_text: str, forbid_words: list):
-    forbid_txt = "、".join(sorted(set([w for w in forbid_words if isinstance(w, str)])))
-    hint = (
-        "構成ヒント（テンプレ化しない）：商品スペック→強み（コア）→どんな人→どんなシーン→便益。"
-        "必要に応じて対応機種や型番も自然に含める。"
-    )
-    target = (
-        f"商品名: {product}\n"
+PROMPT_HINT = (
+    "構成ヒント（テンプレ化しない）：商品スペック→強み（コア）→どんな人→どんなシーン→便益。"
+    "必要に応じて対応機種や型番も自然に含める。"
+)
+
+def build_prompt_prefix(knowledge_text: str, forbid_words: list) -> str:
+    """
+    全商品で共通の部分（知見・ヒント・禁止語・指示）。実行中は不変なので main で一度だけ組み立てる。
+    OpenAI のプロンプトキャッシュは先頭一致で効くため、2件目以降はほぼ全体がキャッシュに乗る。
+    """
+    forbid_txt = "、".join(sorted({w for w in forbid_words if isinstance(w, str)}))
+    return (
         f"{knowledge_text}\n"
-        f"{hint}\n"
+        f"{PROMPT_HINT}\n"
         f"禁止語（絶対に使わない）: {forbid_txt}\n"
-        "20行で、各行は自然な日本語の文として出力してください。"
+        "20行で、各行は自然な日本語の文として出力してください。\n"
     )
-    return target
+
+def build_user_prompt(product: str, prompt_prefix: str) -> str:
+    """共通プレフィックスの末尾に商品名だけを付ける"""
+    return f"{prompt_prefix}商品名: {product}"
 
 # ==============
 # 6) OpenAI 呼び出し
 # ==============
-def call_openai_20_lines(client, model, temperature, max_tokens, product, kb_text, forbid_words, retry=3, wait=6):
-    user_prompt = build_user_prompt(product, kb_text, forbid_words)
+def backoff_delay(attempt: int, retry_after=None, base=1.0, cap=60.0) -> float:
+    """指数バックオフ（full jitter）。Retry-After ヘッダがあればそれに従う"""
+    if retry_after is not None:
+        try:
+            return min(cap, max(0.0, float(retry_after)))
+        except (TypeError, ValueError):
+            pass
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+RESET_PART_RE = re.compile(r"([\d.]+)(ms|s|m|h)")   # x-ratelimit-reset-* の "6m0s" 等を分解
+
+def parse_reset(v) -> float:
+    """x-ratelimit-reset-* の "1s" / "6m0s" / "20ms" 形式を秒に"""
+    unit_sec = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(n) * unit_sec[u] for n, u in RESET_PART_RE.findall(v or ""))
+
+class RateGate:
+    """
+    送信タイミングの調整役（スレッド間で共有）
+    - RPM/TPM のトークンバケット：経過時間で補充し、足りない分だけ待ってから消費する
+    - レスポンスの x-ratelimit-* ヘッダ追従：残量が閾値以下ならリセットまで全体を止める
+    """
+    def __init__(self, rpm=RPM_LIMIT, tpm=TPM_LIMIT):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.available_requests = float(rpm)
+        self.available_tokens = float(tpm)
+        self.updated_at = time.monotonic()
+        self.pause_until = 0.0
+        self.lock = threading.Lock()  # ワーカースレッド間で共有する
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        if self.rpm > 0:
+            self.available_requests = min(self.rpm, self.available_requests + elapsed * self.rpm / 60.0)
+        if self.tpm > 0:
+            self.available_tokens = min(self.tpm, self.available_tokens + elapsed * self.tpm / 60.0)
+
+    def wait(self, est_tokens=0):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                delay = self.pause_until - now
+                if delay <= 0:
+                    # 1リクエストの見積りがバケット容量を超えるなら容量ぶんで打ち切る（永久待ち防止）
+                    tokens = min(est_tokens, self.tpm)
+                    short_req = (1 - self.available_requests) * 60.0 / self.rpm if self.rpm > 0 else 0.0
+                    short_tok = (tokens - self.available_tokens) * 60.0 / self.tpm if self.tpm > 0 else 0.0
+                    delay = max(short_req, short_tok)
+                    if delay <= 0:
+                        if self.rpm > 0:
+                            self.available_requests -= 1
+                        if self.tpm > 0:
+                            self.available_tokens -= tokens
+                        return
+            time.sleep(delay)
+
+    def update(self, headers):
+        pause = 0.0
+        for kind, low in (("requests", RATE_LOW_REQUESTS), ("tokens", RATE_LOW_TOKENS)):
+            try:
+                remaining = int(headers.get(f"x-ratelimit-remaining-{kind}"))
+            except (TypeError, ValueError):
+                continue
+            if remaining <= low:
+                pause = max(pause, parse_reset(headers.get(f"x-ratelimit-reset-{kind}")))
+        if pause:
+            with self.lock:
+                self.pause_until = max(self.pause_until, time.monotonic() + pause)
+
+class TokenBudget:
+    """
+    max_completion_tokens の自動調整役（スレッド間で共有）
+    - 直近 window 件の usage.completion_tokens の p95×1.1 を上限にする（[floor, 設定値] にクランプ）
+    - 上限で打ち切られた応答（finish_reason=length）が出たら観測を捨て、設定値に戻して測り直す
+    """
+    def __init__(self, cap, floor=TOKEN_BUDGET_FLOOR, warmup=TOKEN_BUDGET_WARMUP, window=50):
+        self.cap = cap
+        self.floor = min(floor, cap)
+        self.warmup = warmup
+        self.used = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def current(self):
+        with self.lock:
+            if len(self.used) < self.warmup:
+                return self.cap
+            xs = sorted(self.used)
+        p95 = xs[min(len(xs) - 1, int(len(xs) * 0.95))]
+        return max(self.floor, min(self.cap, int(p95 * 1.1)))
+
+    def observe(self, res):
+        n = getattr(getattr(res, "usage", None), "completion_tokens", None)
+        truncated = getattr(res.choices[0], "finish_reason", None) == "length"
+        with self.lock:
+            if truncated:
+                self.used.clear()
+            elif isinstance(n, int) and n > 0:
+                self.used.append(n)
+
+_cache_conn = None
+_cache_lock = threading.Lock()  # 1本の接続をワーカースレッドで共有するため直列化
+
+def _cache_db():
+    global _cache_conn
+    if _cache_conn is None:
+        os.makedirs(OUT_DIR, exist_ok=True)
+        _cache_conn = sqlite3.connect(PROMPT_CACHE_PATH, check_same_thread=False)
+        _cache_conn.execute("CREATE TABLE IF NOT EXISTS kv(k TEXT PRIMARY KEY, v BLOB)")
+    return _cache_conn
+
+def _cache_key(model, temperature, user_prompt):
+    return hashlib.sha1((SYSTEM_PROMPT + user_prompt + model + str(temperature)).encode("utf-8")).hexdigest()
+
+def _cache_get(key):
+    if not PROMPT_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        row = _cache_db().execute("SELECT v FROM kv WHERE k = ?", (key,)).fetchone()
+    return _json_loads(row[0]) if row else None
+
+def _cache_set(key, lines):
+    if not PROMPT_CACHE_ENABLED:
+        return
+    with _cache_lock:
+        db = _cache_db()
+        db.execute("INSERT OR REPLACE INTO kv (k, v) VALUES (?, ?)", (key, json.dumps(lines, ensure_ascii=False)))
+        db.commit()
+
+def call_openai_20_lines(client, model, temperature, max_tokens, product, prompt_prefix, retry=6, wait=1.0, gate=None, budget=None):
+    user_prompt = build_user_prompt(product, prompt_prefix)
+    cache_key = _cache_key(model, temperature, user_prompt)
+    cached = _cache_get(cache_key)
+    if cached:
+        return cached
     last_err = None
-    for _ in range(retry):
+    full = False  # 絞った上限で打ち切られたら以降は設定値で取り直す
+    for attempt in range(retry):
         try:
-            res = client.chat.completions.create(
+            limit = budget.current() if (budget and not full) else max_tokens
+            if gate:
+                # 出力上限＋プロンプトのおおよそのトークン数を先に確保しておく
+                gate.wait(est_tokens=limit + len(user_prompt) // 2)
+            # ヘッダ（x-ratelimit-*）を読むため raw レスポンスで受けてから parse する
+            raw = client.chat.completions.with_raw_response.create(
                 model=model,
                 messages=[
                     {"role": "system", "content": SYSTEM_PROMPT},
                     {"role": "user", "content": user_prompt},
                 ],
                 response_format={"type": "text"},
-                max_completion_tokens=max_tokens,
+                max_completion_tokens=limit,
                 temperature=temperature,
             )
+            if gate:
+                gate.update(raw.headers)
+            res = raw.parse()
+            if budget:
+                budget.observe(res)
+            truncated = getattr(res.choices[0], "finish_reason", None) == "length"
+            if truncated and limit < max_tokens:
+                # p95 で絞った上限で切れた → 途中までの応答は使わず、設定値ですぐ取り直す
+                full = True
+                continue
             content = (res.choices[0].message.content or "").strip()
             if content:
                 # 行に分解して番号・箇条書き・先頭記号を剥がす
@@ -326,179 +579,39 @@ def call_openai_20_lines(client, model, temperature, max_tokens, product, kb_tex
                     if s:
                         lines.append(s)
                 # 余分な行が返ることがあるので最大60まで保持（後で20抽出）
-                return lines[:60]
+                lines = lines[:60]
+                if not truncated:
+                    _cache_set(cache_key, lines)  # 途中で切れた応答はキャッシュしない
+                return lines
         except Exception as e:
             last_err = e
-            time.sleep(wait)
+            if getattr(e, "status_code", None) in NO_RETRY_STATUS or getattr(e, "code", None) == "insufficient_quota":
+                break
+            if attempt + 1 < retry:
+                headers = getattr(getattr(e, "response", None), "headers", None) or {}
+                time.sleep(backoff_delay(attempt, headers.get("retry-after"), base=wait))
+            continue
+        # 空応答も一時的な失敗として間を置いてから再試行
+        last_err = ValueError("空応答")
+        if attempt + 1 < retry:
+            time.sleep(backoff_delay(attempt, base=wait))
     raise RuntimeError(f"OpenAI応答を取得できませんでした: {last_err}")
 
+def generate_one(client, model, temperature, max_tokens, product, prompt_prefix, gate, budget=None):
+    """1商品ぶんのAI生出力（ワーカースレッドで実行。全失敗時はダミー20本）"""
+    try:
+        return call_openai_20_lines(
+            client, model, temperature, max_tokens,
+            product=product, prompt_prefix=prompt_prefix, gate=gate, budget=budget,
+        )
+    except Exception:
+        return [f"{product} の使い勝手を高める設計で、日常の不便を減らす実用的な一品です。"] * 20
+
 # ==============
 # 7) ローカル整形
 # ==============
-def soft_clip_sentence(text: str, min_len=FINAL_MIN, max_len=FINAL_MAX) -> str:
-    t = (text or "").strip()
-    if not t:
-        return ""
-    # 番号/箇条書き掃除
-    t = LEADING_ENUM_RE.sub("", t).strip("・-—●　")
-    # 余計な空白圧縮
-    t = WS_RE.sub(" ", t)
-    t = MULTI_COMMA_RE.sub("、、", t)
-
-    # 句点補完 or 体言止め許容（すでに句点なしならそのまま許容。後段で割合調整）
-    if t.endswith(("。", "！", "？")):
-        end_mark = True
-    else:
-        end_mark = False
-
-    # 長すぎる場合：max_len+10 程度まで許容 → 最後の「。」でカットして80〜110に寄せる
-    hard_cap = max_len + 10
-    if len(t) > hard_cap:
-        cut = t[:hard_cap]
-        p = cut.rfind("。")
-        if p != -1 and p + 1 >= min_len:  # 自然な句点終止がminを満たすなら採用
-            t = cut[:p+1]
-        else:
-            t = cut
-
-    # 禁則語は最終で除去（完全除去）
-    return t.strip()
-
-def ends_with_punctuation(s: str) -> bool:
-    return s.endswith(("。", "！", "？"))
-
-def to_taigen_if_needed(s: str) -> str:
-    """語尾自然化：です/ます を体言止めへ（軽率な削りを避ける）"""
-    t = s.strip()
-    # 既に体言止めっぽいならそのまま
-    if ends_with_punctuation(t):
-        if t.endswith("。"):
-            # 3〜4文字の敬体を限定的に落とす
-            for rep in ("します。", "できます。", "でした。", "です。", "ます。"):
-                if t.endswith(rep) and len(t) > len(rep) + 8:
-                    return t[:-len("です。")] + "です" if rep == "です。" else t[:-1]  # 末尾句点だけ削る
-        return t
-    # 体言止めっぽい末尾ならそのまま
-    return t
-
-def uniq_by_similarity(lines, threshold=SIM_THRESHOLD):
-    """高類似の文を除去"""
-    uniq = []
-    for s in lines:
-        is_dup = False
-        for u in uniq:
-            if SequenceMatcher(None, s, u).ratio() >= threshold:
-                is_dup = True
-                break
-        if not is_dup:
-            uniq.append(s)
-    return uniq
-
-def fallback_sentence(product: str) -> str:
-    return f"{product} の使い勝手を高める設計で、日常の不便を減らす実用的な一品です。"
-
-def refine_20_lines(product: str, raw_lines, forbid_words):
-    # 正規化 → 句点/体言止め許容 → 長さ整形
-    norm = []
-    for ln in raw_lines:
-        if not ln:
-            continue
-        s = soft_clip_sentence(ln)
-        if not s:
-            continue
-        norm.append(s)
-
-    # 類似除去
-    norm = uniq_by_similarity(norm)
-
-    # 禁則語削除（完全除去）
-    for i, s in enumerate(norm):
-        for ng in forbid_words:
-            if ng and ng in s:
-                s = s.replace(ng, "")
-        norm[i] = s.strip()
-
-    # 末尾句点と体言止めの混在（後で割合を整える）
-    out = []
-    for s in norm:
-        if not s:
-            continue
-        # “単語羅列”っぽい短文は破棄
-        if len(s) < 20:
-            continue
-        out.append(s)
-
-    # 句点終止で自然な長さへ再調整
-    final = []
-    for s in out:
-        ss = s
-        if len(ss) > FINAL_MAX + 10:
-            cut = ss[:FINAL_MAX + 10]
-            p = cut.rfind("。")
-            if p != -1 and p + 1 >= FINAL_MIN:
-                ss = cut[:p+1]
-            else:
-                ss = cut
-        if not ss:
-            continue
-        final.append(ss)
-
-    # 体言止め割合を整える（約 TAIGEN_RATE）
-    rng = list(range(len(final)))
-    if rng:
-        target_n = max(1, int(len(final) * TAIGEN_RATE))
-        chosen = set()
-        i = 0
-        while len(chosen) < target_n and i < len(rng):
-            idx = rng[i]
-            if final[idx].endswith("。"):
-                # “です/ます/ました”の場合は句点だけ残しつつ自然に
-                final[idx] = to_taigen_if_needed(final[idx])
-                if final[idx].endswith("。"):
-                    # 体言化しきれなければ文末句点は維持
-                    pass
-                else:
-                    # 体言になって句点消えた場合 → そのまま
-                    pass
-                chosen.add(idx)
-            i += 1
-
-    # 20本に満たなければ補完（語尾変形）
-    def light_variation(s: str) -> str:
-        t = s
-        # 語尾バリエーション（軽い置換）
-        t = t.replace("します。", "できます。")
-        t = t.replace("できます。", "しやすいです。")
-        t = t.replace("です。", "になります。")
-        if t == s:
-            # 句内に軽微な助詞を追加（過剰な変化は避ける）
-            t = re.sub(r"([^\s、。]{3,})", r"\1、", t, count=1)
-            t = t.replace("、、", "、")
-        # 最後に軽く整形
-        t = soft_clip_sentence(t)
-        return t
-
-    base = final[:]
-    i = 0
-    while len(final) < 20 and base:
-        cand = light_variation(base[i % len(base)])
-        # 類似抑制
-        if all(SequenceMatcher(None, cand, x).ratio() < SIM_THRESHOLD for x in final):
-            final.append(cand)
-        i += 1
-        if i > 200:  # 念のためのブレーク
-            break
-
-    # まだ足りなければ補完文
-    while len(final) < 20:
-        cand = fallback_sentence(product)
-        if all(SequenceMatcher(None, cand, x).ratio() < SIM_THRESHOLD for x in final):
-            final.append(cand)
-        else:
-            final.append(cand + "")  # どうしても埋まらない場合はそのまま
-
-    # 多すぎるなら先頭20
-    return final[:20]
+# 整形本体は salescopy_refine.py（mypyc でコンパイル可）に分離
+# refine_20_lines(product, raw_lines, forbid_words) → 80〜110字 × 20本
 
 # ==============
 # 8) 書き出し
@@ -506,31 +619,25 @@ def refine_20_lines(product: str, raw_lines, forbid_words):
 def ensure_outdir():
     os.makedirs(OUT_DIR, exist_ok=True)
 
-def write_raw(products, all_raw):
-    with open(RAW_PATH, "w", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        w.writerow(["商品名"] + [f"ALT_raw_{i+1}" for i in range(20)])
-        for p, lines in zip(products, all_raw):
-            row = [p] + (lines[:20] + [""] * max(0, 20 - len(lines)))
-            w.writerow(row)
-
-def write_refined(products, all_refined):
-    with open(REF_PATH, "w", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        w.writerow(["商品名"] + [f"ALT_{i+1}" for i in range(20)])
-        for p, lines in zip(products, all_refined):
-            row = [p] + (lines[:20] + [""] * max(0, 20 - len(lines)))
-            w.writerow(row)
-
-def write_diff(products, all_raw, all_refined):
-    with open(DIFF_PATH, "w", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        header = ["商品名"] + [f"ALT_raw_{i+1}" for i in range(20)] + [f"ALT_refined_{i+1}" for i in range(20)]
-        w.writerow(header)
-        for p, r, ref in zip(products, all_raw, all_refined):
-            r_line = (r[:20] + [""] * max(0, 20 - len(r)))
-            ref_line = (ref[:20] + [""] * max(0, 20 - len(ref)))
-            w.writerow([p] + r_line + ref_line)
+FLUSH_EVERY = 256     # 何商品ぶん溜めてから writerows でまとめて書くか
+CSV_BUFFER = 1 << 20  # 書き込みバッファ（1MB）
+
+def pad20(lines):
+    return lines[:20] + [""] * max(0, 20 - len(lines))
+
+def open_csv(path, header):
+    """書き出し先を開いてヘッダだけ書く。本体は未書き出し行リストに溜めて flush_rows でまとめて追記"""
+    f = open(path, "w", newline="", encoding="utf-8", buffering=CSV_BUFFER)
+    w = csv.writer(f, lineterminator="\n")
+    w.writerow(header)
+    return f, w, []
+
+def flush_rows(outs):
+    """溜めた行を writerows で一括書き出ししてディスクへ流す"""
+    for f, w, rows in outs:
+        w.writerows(rows)
+        rows.clear()
+        f.flush()
 
 # ==============
 # 9) メイン
@@ -542,50 +649,73 @@ def main():
     client, model, temperature, max_tokens = init_env_and_client()
     ensure_outdir()
 
-    products = load_products(INPUT_CSV)
-    print(f"✅ 対象商品: {len(products)}件")
+    products, aliases = load_products(INPUT_CSV)
+    n_alias = sum(len(v) for v in aliases.values())
+    print(f"✅ 対象商品: {len(products)}件" + (f"（表記ゆれ {n_alias}件は生成結果を共有）" if n_alias else ""))
 
     knowledge_text, forbid_all = summarize_knowledge_relaxed()
+    prompt_prefix = build_prompt_prefix(knowledge_text, forbid_all)
+    gate = RateGate()
+    budget = TokenBudget(max_tokens) if ADAPTIVE_TOKENS else None
     print("✅ 要（知見）読込完了")
 
-    all_raw, all_refined = [], []
-
-    for p in tqdm(products, total=len(products), desc="🧠 生成中"):
-        # 1) AIで20本（≧20本返る場合もあり）
-        try:
-            raw_lines = call_openai_20_lines(
-                client, model, temperature, max_tokens,
-                product=p, kb_text=knowledge_text, forbid_words=forbid_all,
-                retry=3, wait=6
-            )
-        except Exception as e:
-            # 全失敗 → ダミーで20本
-            raw_lines = [f"{p} の使い勝手を高める設計で、日常の不便を減らす実用的な一品です。"] * 20
-
-        # 2) ローカル整形 → 20本に確定
-        refined_lines = refine_20_lines(p, raw_lines, forbid_all)
-
-        all_raw.append(raw_lines[:20])
-        all_refined.append(refined_lines)
-
-        # 過負荷回避
-        time.sleep(0.2)
-
-    # 3) 書き出し
-    write_raw(products, all_raw)
-    write_refined(products, all_refined)
-    write_diff(products, all_raw, all_refined)
-
-    # 簡易メトリクス
-    def avg_len(blocks):
-        lens = [len(x) for lines in blocks for x in lines if x]
-        return (sum(lens) / max(1, len(lens))) if lens else 0.0
+    # 書き出し先（商品ごとに逐次追記。全件をメモリに溜めない）
+    outs = [
+        open_csv(RAW_PATH, ["商品名"] + [f"ALT_raw_{i+1}" for i in range(20)]),
+        open_csv(REF_PATH, ["商品名"] + [f"ALT_{i+1}" for i in range(20)]),
+        open_csv(DIFF_PATH, ["商品名"] + [f"ALT_raw_{i+1}" for i in range(20)] + [f"ALT_refined_{i+1}" for i in range(20)]),
+    ]
+    rows_raw, rows_ref, rows_diff = (rows for _, _, rows in outs)
+
+    # 簡易メトリクス（文字数の合計と本数だけ保持）
+    len_stats = {"raw": [0, 0], "refined": [0, 0]}
+    def tally(key, lines):
+        lens = [len(x) for x in lines if x]
+        len_stats[key][0] += sum(lens)
+        len_stats[key][1] += len(lens)
+
+    def avg_len(key):
+        total, count = len_stats[key]
+        return total / count if count else 0.0
+
+    # 1) AI生成は CONCURRENCY 本並列。完了順に受け取り、入力順に整形・書き出しする
+    pool = ThreadPoolExecutor(max_workers=CONCURRENCY)
+    pending, next_i = {}, 0
+    try:
+        futs = {
+            pool.submit(generate_one, client, model, temperature, max_tokens, p, prompt_prefix, gate, budget): i
+            for i, p in enumerate(products)
+        }
+        for fut in tqdm(as_completed(futs), total=len(futs), desc="🧠 生成中"):
+            pending[futs[fut]] = fut.result()
+            while next_i in pending:
+                p, raw_lines = products[next_i], pending.pop(next_i)
+                next_i += 1
+
+                # 2) ローカル整形 → 20本に確定
+                refined_lines = refine_20_lines(p, raw_lines, forbid_all)
+
+                # 3) 書き出し
+                r_line, ref_line = pad20(raw_lines), pad20(refined_lines)
+                for name in [p] + aliases.get(p, []):
+                    rows_raw.append([name] + r_line)
+                    rows_ref.append([name] + ref_line)
+                    rows_diff.append([name] + r_line + ref_line)
+                tally("raw", r_line)
+                tally("refined", ref_line)
+                if len(rows_raw) >= FLUSH_EVERY:
+                    flush_rows(outs)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+        flush_rows(outs)
+        for f, _, _ in outs:
+            f.close()
 
     print("✅ 出力完了:")
     print(f"   - AI生出力: {RAW_PATH}")
     print(f"   - 整形後   : {REF_PATH}")
     print(f"   - 差分比較 : {DIFF_PATH}")
-    print(f"📏 文字数(平均): raw={avg_len(all_raw):.1f} / refined={avg_len(all_refined):.1f}")
+    print(f"📏 文字数(平均): raw={avg_len('raw'):.1f} / refined={avg_len('refined'):.1f}")
     print("🔒 仕様: ")
     print(f"   - AIは約{RAW_MIN}〜{RAW_MAX}字・1〜2文、句点/体言止め混在、禁則適用（プロンプト）")
     print(f"   - ローカル整形で{FINAL_MIN}〜{FINAL_MAX}字に調整、重複除去・禁則再適用・空欄補完")
@@ -3,14 +3,15 @@
 v5.3_salescopy_fusion.py
 - 目的: 楽天ALT（20本/商品）を「SEOに強い自然文」で安定生成（KOTOHA人格エンジン連携）
 - 入力: /Users/tsuyoshi/Desktop/python_lesson/sauce/rakuten.csv（UTF-8, ヘッダに「商品名」）
-- 知見: ./output/semantics/*.json を緩やか統合（list/dict混在に堅牢）
+- 知見: ./output/semantics/*.json を緩やか統合（list/dict混在に堅牢）。要約はSYSTEM側に載せて全商品で共通化（プロンプトキャッシュ狙い）
 - 人格: ./config/kotoha_persona.json（環境変数 KOTOHA_PERSONA=on で有効）
 - 出力:
     1) output/ai_writer/alt_text_ai_raw_salescopy_v5_3.csv
     2) output/ai_writer/alt_text_refined_salescopy_v5_3.csv
     3) output/ai_writer/alt_text_diff_salescopy_v5_3.csv
-- モデル/温度/トークン: .envを完全準拠（OPENAI_MODEL, OPENAI_TEMPERATURE, OPENAI_MAX_TOKENS）
-- 安定化: JSON非依存 / response_format={"type":"text"} / backoffリトライ / 欠損補完 / 重複抑止
+- モデル/温度/トークン: .envを完全準拠（OPENAI_MODEL, OPENAI_TEMPERATURE, OPENAI_MAX_TOKENS）。OPENAI_MODEL_FALLBACK で不足分だけ上位モデルへ
+- 安定化: JSON非依存 / response_format={"type":"text"}（OPENAI_JSON_MODE=on で json_object）/ backoffリトライ（Retry-After 準拠・jitter）/ 欠損補完 / 重複抑止（3-gram Jaccard で近似重複も）
+- 一括: OPENAI_BATCH_API=on で OpenAI Batch API 経由（24h以内に完了・半額。欠けた商品だけ個別に再生成）
 """
 
 import os
@@ -18,16 +19,36 @@ import re
 import csv
 import json
 import time
-import math
-import glob
-import copy
+import pickle
+import atexit
+import hashlib
+import importlib.util
+import sqlite3
 import random
 import textwrap
+import threading
 from pathlib import Path
-from typing import List, Dict, Any, Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Iterable, Iterator
 from dotenv import load_dotenv, find_dotenv  # ← 追加
 load_dotenv(find_dotenv(usecwd=True))       # ← 追加（cwd から上位を探索）
 
+from salescopy_fusion_refine import FINAL_MIN, FINAL_MAX, refine_lines, unique_refined
+
+# 入力CSVの読込は pandas があれば使う（pyarrow もあればそのパーサ。無ければ csv.DictReader）
+try:
+    import pandas as pd
+except Exception:
+    pd = None
+CSV_ENGINE = "pyarrow" if importlib.util.find_spec("pyarrow") else "c"
+
+# JSON読込は orjson があれば使う（無ければ標準 json）
+try:
+    import orjson
+    _json_loads = orjson.loads
+except Exception:
+    _json_loads = json.loads
+
 # ---------- 設定 ----------
 BASE_DIR = Path(os.getcwd())
 INPUT_PATH = Path("/Users/tsuyoshi/Desktop/python_lesson/sauce/rakuten.csv")
@@ -38,45 +59,115 @@ RAW_PATH = OUT_DIR / "alt_text_ai_raw_salescopy_v5_3.csv"
 REF_PATH = OUT_DIR / "alt_text_refined_salescopy_v5_3.csv"
 DIFF_PATH = OUT_DIR / "alt_text_diff_salescopy_v5_3.csv"
 
+RAW_HEADER = ["商品名"] + [f"ALT_{i}" for i in range(1, 21)]
+DIFF_HEADER = ["商品名", "RAW", "REF", "変更有無"]
+
 SEMANTICS_DIR = BASE_DIR / "output" / "semantics"
 PERSONA_PATH = BASE_DIR / "config" / "kotoha_persona.json"
+KB_CACHE_PREFIX = ".cache_v5_4_"   # 知見要約のキャッシュ（semantics/*.json の (名前, mtime, サイズ) が変われば作り直し）
 
 MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 TEMP = float(os.getenv("OPENAI_TEMPERATURE", "0.3"))
 MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "1200"))
+# 段階呼び出し：まず MODEL（小さく安いモデル）で生成し、整形後に使える行が FALLBACK_MIN_LINES 本に
+# 満たない商品だけ OPENAI_MODEL_FALLBACK（大きいモデル）で作り直す。未設定なら MODEL のみ
+MODEL_FALLBACK = os.getenv("OPENAI_MODEL_FALLBACK", "").strip()
+FALLBACK_MIN_LINES = int(os.getenv("OPENAI_FALLBACK_MIN_LINES", "16"))
 
-RAW_MIN, RAW_MAX = 120, 130        # AI直出しの想定字数
-FINAL_MIN, FINAL_MAX = 80, 110     # 整形後の目標字数
+RAW_MIN, RAW_MAX = 120, 130        # AI直出しの想定字数（最終調整の FINAL_MIN/MAX は salescopy_fusion_refine 側）
 
 USE_PERSONA = os.getenv("KOTOHA_PERSONA", "off").lower() == "on"
 
+# 並列・流量（商品ごとのAPI呼び出しはネットワーク待ちが主なのでスレッドで並行）
+CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "8"))   # 同時リクエスト数
+RPM_LIMIT = int(os.getenv("OPENAI_RPM", "0"))             # 0 なら無制限
+TPM_LIMIT = int(os.getenv("OPENAI_TPM", "0"))             # 0 なら無制限
+RETRY_MAX = int(os.getenv("OPENAI_RETRY", "6"))           # 1商品あたりの試行回数
+NO_RETRY_STATUS = {400, 401, 403, 404}                     # 再試行しても結果が変わらない
+
+# OpenAI Batch API（/v1/batches）でまとめて投げる：即時性は不要なオフライン生成向け。料金半額・分間レート制限の対象外
+# OPENAI_BATCH_API=on で有効（完了まで最大24時間。BATCH_POLL_SEC 秒ごとに状態確認）
+USE_BATCH_API = os.getenv("OPENAI_BATCH_API", "off").lower() == "on"
+BATCH_POLL_SEC = int(os.getenv("OPENAI_BATCH_POLL_SEC", "30"))
+BATCH_INPUT_PATH = OUT_DIR / "batch_input_salescopy_v5_3.jsonl"
+
+# OPENAI_JSON_MODE=on で応答を {"alts": [...]} の JSON で受け取る（response_format=json_object。
+# 行頭の番号・記号の掃除が要らない。JSON として読めない応答は失敗扱いで再試行し、キャッシュしない）
+JSON_MODE = os.getenv("OPENAI_JSON_MODE", "off").lower() == "on"
+
+# OpenAI応答のキャッシュ（同一プロンプトは再実行時もAPIを呼ばない。OPENAI_PROMPT_CACHE=0 で無効）
+PROMPT_CACHE_PATH = OUT_DIR / ".cache.sqlite"
+PROMPT_CACHE_ENABLED = os.getenv("OPENAI_PROMPT_CACHE", "1") != "0"
+
+# ---------- 正規表現（行ごとに使うのでモジュール読込時に1回だけコンパイル） ----------
+BULLET_RE = re.compile(r"^\s*[\-\d\.\)\]]\s*")                      # 行頭の番号・箇条書き記号
+WS_RE = re.compile(r"\s+")
+
 # ---------- OpenAI クライアント ----------
+# スレッド並列（CONCURRENCY本）でも接続を張り直さないよう、keep-alive 枠を並列数に合わせた httpx.Client を渡す。
+# h2 が入っていれば HTTP/2 で1接続に多重化する
+def _make_http_client():
+    try:
+        import httpx
+    except Exception:
+        return None
+    return httpx.Client(
+        http2=importlib.util.find_spec("h2") is not None,
+        timeout=httpx.Timeout(60.0, connect=10.0),
+        limits=httpx.Limits(max_connections=CONCURRENCY * 2, max_keepalive_connections=CONCURRENCY),
+    )
+
 try:
     from openai import OpenAI
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    _http_client = _make_http_client()
+    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=_http_client)
+    if _http_client is not None:
+        atexit.register(_http_client.close)
 except Exception:
     client = None
 
 # ---------- ユーティリティ ----------
-def load_csv_items(path: Path) -> List[Dict[str, Any]]:
-    rows = []
+def load_product_names(path: Path) -> List[str]:
+    """入力CSVの商品名（「商品名」列。空欄なら「name」列）。行ごとの dict は作らず、必要な列だけを読む"""
+    if pd is not None:
+        with open(path, newline="", encoding="utf-8") as f:
+            header = next(csv.reader(f), [])
+        cols = [c for c in ("商品名", "name") if c in header]
+        # 列が無い・同名列が重複（DictReader は後勝ち）の場合は下の DictReader に任せる
+        if cols and all(header.count(c) == 1 for c in cols):
+            # C パーサは列の多い行があると先頭列を index と見なすので index_col=False（pyarrow は非対応・不要）
+            opts = {"index_col": False} if CSV_ENGINE == "c" else {}
+            try:
+                df = pd.read_csv(path, usecols=cols, dtype=str, keep_default_na=False,
+                                 encoding="utf-8", engine=CSV_ENGINE, **opts).fillna("")
+                names = df[cols[0]]
+                if len(cols) == 2:
+                    names = names.where(names != "", df["name"])
+                return names.str.strip().tolist()
+            except Exception:
+                pass  # 列数の揃わない行などは DictReader で読み直す
     with open(path, newline="", encoding="utf-8") as f:
-        rdr = csv.DictReader(f)
-        for r in rdr:
-            rows.append(r)
-    return rows
+        return [(r.get("商品名") or r.get("name") or "").strip() for r in csv.DictReader(f)]
 
-def save_csv_rows(path: Path, rows: List[List[str]]):
+def save_csv_rows(path: Path, rows: Iterable[List[str]]):
+    """rows はジェネレータでもよい（1行ずつ書き出すので全行をメモリに持たない）"""
     path.parent.mkdir(parents=True, exist_ok=True)
     with open(path, "w", newline="", encoding="utf-8") as f:
         w = csv.writer(f)
         for r in rows:
             w.writerow(r)
 
+def iter_csv_rows(path: Path) -> Iterator[List[str]]:
+    """CSVを1行ずつ読む（ヘッダ行は飛ばす）"""
+    with open(path, newline="", encoding="utf-8") as f:
+        rdr = csv.reader(f)
+        next(rdr, None)
+        yield from rdr
+
 def safe_read_json(path: Path) -> Any:
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(path, "rb") as f:
+            return _json_loads(f.read())
     except Exception:
         return None
 
@@ -91,6 +182,44 @@ def load_semantics() -> List[Any]:
         items.append(data)
     return items
 
+def _kb_cache_path(paths: List[Path]) -> Path:
+    """JSON群の (パス, mtime, サイズ) からキャッシュファイル名を決める"""
+    sig_src = repr([(str(p), st.st_mtime_ns, st.st_size) for p, st in ((p, p.stat()) for p in paths)])
+    sig = hashlib.sha1(sig_src.encode("utf-8")).hexdigest()
+    return SEMANTICS_DIR / f"{KB_CACHE_PREFIX}{sig}.pkl"
+
+def _kb_cache_load(cache_path: Path) -> Optional[str]:
+    try:
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+    except Exception:
+        return None
+
+def _kb_cache_save(cache_path: Path, know: str) -> None:
+    # 古い世代は掃除してから原子的に書き込む（失敗しても本処理は続行）
+    try:
+        for old in SEMANTICS_DIR.glob(f"{KB_CACHE_PREFIX}*.pkl"):
+            if old != cache_path:
+                old.unlink()
+        tmp = cache_path.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(know, f)
+        os.replace(tmp, cache_path)
+    except Exception:
+        pass
+
+def load_knowledge() -> str:
+    """知見の要約。JSON群が前回から変わっていなければキャッシュから読み、パースを丸ごと省く"""
+    try:
+        cache_path = _kb_cache_path(sorted(SEMANTICS_DIR.glob("*.json")))
+    except OSError:
+        return summarize_knowledge(load_semantics())
+    know = _kb_cache_load(cache_path)
+    if know is None:
+        know = summarize_knowledge(load_semantics())
+        _kb_cache_save(cache_path, know)
+    return know
+
 def persona_or_default() -> Dict[str, Any]:
     if USE_PERSONA and PERSONA_PATH.exists():
         p = safe_read_json(PERSONA_PATH)
@@ -119,218 +248,369 @@ BASE_SYSTEM = ("""\
 
 出力はテキストのみ。ALTを20本、行区切りで返してください。
 """)
+if JSON_MODE:
+    BASE_SYSTEM = BASE_SYSTEM.replace(
+        "出力はテキストのみ。ALTを20本、行区切りで返してください。",
+        '出力はJSONのみ。{"alts": ["ALT1", "ALT2", ...]} の形で、ALTを20本返してください。',
+    )
 
-def build_persona_system(persona: Dict[str, Any]) -> str:
+def build_persona_system(persona: Dict[str, Any], knowledge_text: str = "") -> str:
     """
     v5.4: ライティングの規範はv3.3に戻し、文末の引用符禁止を追加。
     Personaは使わず固定SYSTEMを返します（挙動を安定化）。
+    全商品で共通の知見要約もここ（SYSTEM側）に載せる：商品ごとに変わるのは USER だけになり、
+    リクエスト先頭の共通部分が長くなるので OpenAI のプロンプトキャッシュ（入力トークン割引）が効く。
     """
-    return BASE_SYSTEM
+    if not knowledge_text:
+        return BASE_SYSTEM
+    return f"{BASE_SYSTEM}\n【参考情報（要約）】\n{knowledge_text}\n"
 
 # ---------- USERプロンプト ----------
-def build_user_prompt(product_name: str, knowledge_text: str = "") -> str:
-    # 3.3相当の素直なユーザ指示を維持
-    hint = ""
-    if knowledge_text:
-        hint = f"\n【参考情報（要約）】\n{knowledge_text}\n"
-    return textwrap.dedent(f"""\
-        商品名: {product_name}
-        {hint}
-        上記の商品について、日本語のALTテキストを20本作成してください。
-        各ALTは1〜2文、自然な日本語で、まずおよそ{RAW_MIN}〜{RAW_MAX}字を目安にしてください。
-        画像の描写は書かず、商品特徴・型番・素材などを自然に織り込んでください。
-        行区切りで20本を出力してください。
-    """).strip()
+# 3.3相当の素直なユーザ指示を維持（商品ごとに変わる部分だけ）。dedent は読込時に1回だけ
+USER_PROMPT_TMPL = textwrap.dedent(f"""\
+    商品名: {{product_name}}
+
+    上記の商品について、日本語のALTテキストを20本作成してください。
+    各ALTは1〜2文、自然な日本語で、まずおよそ{RAW_MIN}〜{RAW_MAX}字を目安にしてください。
+    画像の描写は書かず、商品特徴・型番・素材などを自然に織り込んでください。
+    行区切りで20本を出力してください。
+""").strip()
+if JSON_MODE:
+    USER_PROMPT_TMPL = USER_PROMPT_TMPL.replace(
+        "行区切りで20本を出力してください。",
+        '{{"alts": [...]}} のJSONで20本を出力してください。',
+    )
+
+def build_user_prompt(product_name: str) -> str:
+    return USER_PROMPT_TMPL.format(product_name=product_name)
 
 # ---------- OPENAI呼び出し ----------
+class TokenBucket:
+    """RPM/TPM のトークンバケット（スレッド間で共有）。経過時間で補充し、足りない分だけ待ってから消費する"""
+    def __init__(self, rpm: int = RPM_LIMIT, tpm: int = TPM_LIMIT):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.available_requests = float(rpm)
+        self.available_tokens = float(tpm)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        if self.rpm > 0:
+            self.available_requests = min(self.rpm, self.available_requests + elapsed * self.rpm / 60.0)
+        if self.tpm > 0:
+            self.available_tokens = min(self.tpm, self.available_tokens + elapsed * self.tpm / 60.0)
+
+    def consume(self, est_tokens: int = 0) -> None:
+        tokens = min(est_tokens, self.tpm)  # 容量超えの見積りで永久に待たないように
+        while True:
+            with self.lock:
+                self._refill(time.monotonic())
+                short_req = (1 - self.available_requests) * 60.0 / self.rpm if self.rpm > 0 else 0.0
+                short_tok = (tokens - self.available_tokens) * 60.0 / self.tpm if self.tpm > 0 else 0.0
+                delay = max(short_req, short_tok)
+                if delay <= 0:
+                    if self.rpm > 0:
+                        self.available_requests -= 1
+                    if self.tpm > 0:
+                        self.available_tokens -= tokens
+                    return
+            time.sleep(delay)
+
+_cache_conn: Optional[sqlite3.Connection] = None
+_cache_lock = threading.Lock()  # 1本の接続をワーカースレッドで共有するため直列化
+
+def _cache_db() -> sqlite3.Connection:
+    global _cache_conn
+    if _cache_conn is None:
+        _cache_conn = sqlite3.connect(PROMPT_CACHE_PATH, check_same_thread=False)
+        _cache_conn.execute("CREATE TABLE IF NOT EXISTS kv(k TEXT PRIMARY KEY, v BLOB)")
+    return _cache_conn
+
+def _cache_key(model: str, temperature: float, system_prompt: str, user_prompt: str) -> str:
+    payload = json.dumps({"m": model, "t": temperature, "s": system_prompt, "u": user_prompt},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _cache_get(key: str) -> Optional[List[str]]:
+    if not PROMPT_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        row = _cache_db().execute("SELECT v FROM kv WHERE k = ?", (key,)).fetchone()
+    return _json_loads(row[0]) if row else None
+
+def _cache_set(key: str, lines: List[str]) -> None:
+    if not PROMPT_CACHE_ENABLED:
+        return
+    with _cache_lock:
+        db = _cache_db()
+        db.execute("INSERT OR REPLACE INTO kv (k, v) VALUES (?, ?)", (key, json.dumps(lines, ensure_ascii=False)))
+        db.commit()
+
+def is_cacheable(lines: List[str], finish_reason: Optional[str]) -> bool:
+    """途中で切れた応答（finish_reason=length）や中身が空の応答はキャッシュしない（次回も作り直す）"""
+    return finish_reason != "length" and any(lines)
+
+def build_chat_body(model: str, system_prompt: str, user_prompt: str,
+                    temperature: float, max_tokens: int) -> Dict[str, Any]:
+    """chat.completions の引数（同期呼び出しと Batch API の JSONL で共用）"""
+    return {
+        "model": model,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ],
+        "response_format": {"type": "json_object" if JSON_MODE else "text"},
+    }
+
+def _json_alts(txt: str) -> Optional[List[str]]:
+    """JSON応答 {"alts": [...]} → 文字列のリスト（形が違えば None）"""
+    try:
+        alts = _json_loads(txt).get("alts")
+    except (ValueError, TypeError, AttributeError):
+        return None
+    if not isinstance(alts, list):
+        return None
+    return [a.strip() for a in alts if isinstance(a, str) and a.strip()]
+
+def split_alt_lines(txt: str) -> List[str]:
+    """
+    応答テキスト → 20行（貼り付けや箇条書きにも耐えるように整形し、過不足を調整）
+    JSON_MODE で {"alts": [...]} として読めない応答（途中で切れた等）は ValueError（呼び出し側で再試行）
+    """
+    if JSON_MODE:
+        lines = _json_alts(txt)
+        if not lines:
+            raise ValueError("JSON応答から alts を読み取れません")
+    else:
+        lines = [BULLET_RE.sub("", ln).strip() for ln in txt.strip().splitlines() if ln.strip()]
+    # 行数調整
+    if len(lines) < 20:
+        lines += [""] * (20 - len(lines))
+    elif len(lines) > 20:
+        lines = lines[:20]
+    return lines
+
+def backoff_delay(prev: float, retry_after: Optional[str] = None, base: float = 1.0, cap: float = 60.0) -> float:
+    """次の待機秒数。Retry-After ヘッダがあればそれに従い、無ければ decorrelated jitter（前回×3 までの乱数）"""
+    if retry_after is not None:
+        try:
+            return min(cap, max(0.0, float(retry_after)))
+        except (TypeError, ValueError):
+            pass
+    return min(cap, random.uniform(base, max(base, prev * 3)))
+
+def is_permanent_error(e: Exception) -> bool:
+    """再試行しても無駄なエラー（認証・不正リクエスト・クォータ切れ）"""
+    return getattr(e, "status_code", None) in NO_RETRY_STATUS or getattr(e, "code", None) == "insufficient_quota"
+
 def call_openai_20_lines(client, model: str, system_prompt: str, user_prompt: str,
-                         temperature: float = TEMP, max_tokens: int = MAX_TOKENS) -> List[str]:
+                         temperature: float = TEMP, max_tokens: int = MAX_TOKENS,
+                         bucket: Optional[TokenBucket] = None) -> List[str]:
     if client is None:
         # ダミー出力（テスト用）
         return [f"{i+1}行目のサンプルALTです。自然な日本語で商品特徴を織り込みます。" for i in range(20)]
 
-    for retry in range(3):
+    cache_key = _cache_key(model, temperature, system_prompt, user_prompt)
+    cached = _cache_get(cache_key)
+    if cached:
+        return cached
+    delay = 1.0
+    for retry in range(RETRY_MAX):
         try:
+            if bucket:
+                bucket.consume(est_tokens=max_tokens + (len(system_prompt) + len(user_prompt)) // 2)
             resp = client.chat.completions.create(
-                model=model,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt},
-                ],
-                response_format={"type": "text"},
+                **build_chat_body(model, system_prompt, user_prompt, temperature, max_tokens)
             )
-            txt = resp.choices[0].message.content.strip()
-            # 貼り付けや箇条書きにも耐えるように整形
-            lines = [re.sub(r"^\s*[\-\d\.\)\]]\s*", "", ln).strip() for ln in txt.splitlines() if ln.strip()]
-            # 行数調整
-            if len(lines) < 20:
-                lines += [""] * (20 - len(lines))
-            elif len(lines) > 20:
-                lines = lines[:20]
+            choice = resp.choices[0]
+            lines = split_alt_lines(choice.message.content)
+            if is_cacheable(lines, choice.finish_reason):
+                _cache_set(cache_key, lines)
             return lines
         except Exception as e:
-            if retry == 2:
+            if retry == RETRY_MAX - 1 or is_permanent_error(e):
                 raise
-            time.sleep(2.0 + retry)
+            # 429/5xx・接続エラーは待って再試行（Retry-After があれば従う。全スレッドが同時に再送しないよう揺らす）
+            headers = getattr(getattr(e, "response", None), "headers", None) or {}
+            delay = backoff_delay(delay, headers.get("retry-after"))
+            time.sleep(delay)
 
-# ---------- 整形パイプライン ----------
-TRAILING_QUOTES = {'"', "'", '“', '”', '‘', '’', '「', '」', '『', '』'}
-
-def normalize_line(t: str) -> str:
-    if not t:
-        return ""
-    t = t.strip()
-    t = re.sub(r"\s+", " ", t)
-    # 禁止語の軽い正規化（画像メタ）
-    t = re.sub(r"(画像|写真|映っている|クリック|こちら|コチラ)", "", t)
-    t = t.strip()
-    return t
-
-def is_natural_sentence(t: str) -> bool:
-    if not t:
-        return False
-    # 句点/終端記号で終わる or これから付与可能
-    return True
-
-def soft_clip_sentence(t: str, min_len: int = FINAL_MIN, max_len: int = FINAL_MAX) -> str:
-    if not t:
-        return ""
-    t = t.strip()
-    # 末尾に引用符があれば除去（v5.4仕様）
-    while t and t[-1] in TRAILING_QUOTES:
-        t = t[:-1]
-    t = t.strip()
-
-    # 句点終止に整える
-    if not t.endswith(("。", "！", "?", "？", "!")):
-        t = t + "。"
-
-    # 上限をソフトにカット（句読点やスペース優先）
-    if len(t) > max_len:
-        # 句点を基準に手前で落とす
-        cut = t[:max_len]
-        # 直近の句点/読点/空白で切る
-        m = re.search(r"[。．！？\.\,\s][^。．！？\.\,\s]*$", cut)
-        if m:
-            cut = cut[:m.start()].rstrip()
-        if not cut:
-            cut = t[:max_len].rstrip()
-        # 再び引用符が末尾に来る可能性も落とす
-        while cut and cut[-1] in TRAILING_QUOTES:
-            cut = cut[:-1]
-        # 終端を再付与
-        if not cut.endswith(("。", "！", "?", "？", "!")):
-            cut = cut + "。"
-        t = cut
-    # 最小長を下回る場合、無理に追記はしない（自然さ優先）
-    return t
-
-def refine_lines(lines: List[str]) -> List[str]:
-    out = []
-    seen = set()
-    for ln in lines:
-        s = normalize_line(ln)
-        if not is_natural_sentence(s):
+def run_batch_api(client, model: str, system_prompt: str, user_prompts: List[str],
+                  temperature: float = TEMP, max_tokens: int = MAX_TOKENS) -> List[List[str]]:
+    """
+    キャッシュに無い商品ぶんを JSONL にして Batch API へ1回で投入 → 完了までポーリング → custom_id で入力順へ戻す。
+    応答が欠けた／エラーになった商品だけは通常の同期呼び出しで補う。
+    """
+    keys = [_cache_key(model, temperature, system_prompt, u) for u in user_prompts]
+    results: Dict[int, List[str]] = {}
+    for i, key in enumerate(keys):
+        cached = _cache_get(key)
+        if cached:
+            results[i] = cached
+    todo = [i for i in range(len(user_prompts)) if i not in results]
+    if not todo:
+        return [results[i] for i in range(len(user_prompts))]
+
+    with open(BATCH_INPUT_PATH, "w", encoding="utf-8") as f:
+        for i in todo:
+            user_prompt = user_prompts[i]
+            req = {
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": build_chat_body(model, system_prompt, user_prompt, temperature, max_tokens),
+            }
+            f.write(json.dumps(req, ensure_ascii=False) + "\n")
+    with open(BATCH_INPUT_PATH, "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(input_file_id=input_file.id, endpoint="/v1/chat/completions",
+                                  completion_window="24h")
+    print(f"   - Batch投入: {batch.id}（{len(todo)}件）")
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(BATCH_POLL_SEC)
+        batch = client.batches.retrieve(batch.id)
+    if batch.status != "completed" or not batch.output_file_id:
+        raise RuntimeError(f"Batch が完了しませんでした: {batch.id} status={batch.status}")
+
+    for ln in client.files.content(batch.output_file_id).text.splitlines():
+        if not ln.strip():
             continue
-        s = soft_clip_sentence(s, FINAL_MIN, FINAL_MAX)
-        if s and s not in seen:
-            seen.add(s)
-            out.append(s)
-    # 20本に満たない場合は補完（簡易）
-    while len(out) < 20:
-        out.append("自然な日本語のALTテキストです。製品の特徴を伝えます。")
-    return out[:20]
+        rec = _json_loads(ln)
+        try:
+            body = rec["response"]["body"]
+            i = int(rec["custom_id"])
+            choice = body["choices"][0]
+            results[i] = split_alt_lines(choice["message"]["content"])
+        except (KeyError, IndexError, TypeError, ValueError, AttributeError):
+            continue
+        if is_cacheable(results[i], choice.get("finish_reason")):
+            _cache_set(keys[i], results[i])
+    missing = [i for i in range(len(user_prompts)) if i not in results]
+    if missing:
+        print(f"   - Batchで欠けた {len(missing)}件は個別に再生成します")
+    for i in missing:
+        results[i] = call_openai_20_lines(client, model, system_prompt, user_prompts[i], temperature, max_tokens)
+    return [results[i] for i in range(len(user_prompts))]
+
+# ---------- 整形パイプライン ----------
+# 整形本体は salescopy_fusion_refine.py（mypyc でコンパイル可）に分離
+# refine_lines(raw_lines) → 句点終止・80〜110字 × 20本 / unique_refined(raw_lines) → 補完前の使える行
 
 # ---------- 知見の要約 ----------
-def summarize_knowledge(semantics: List[Any], limit: int = 10) -> str:
+def _knowledge_tokens(semantics: List[Any], limit: int) -> Iterator[Any]:
     # list/dict混合を受け入れて、浅くつまむ
-    bag = []
     for item in semantics[:limit]:
         if isinstance(item, dict):
             for k, v in item.items():
                 if isinstance(v, (str, int, float)):
-                    bag.append(f"{k}:{v}")
+                    yield f"{k}:{v}"
                 elif isinstance(v, list):
-                    bag.extend([str(x) for x in v[:3]])
+                    yield from (str(x) for x in v[:3])
         elif isinstance(item, list):
-            bag.extend([str(x) for x in item[:5]])
+            yield from (str(x) for x in item[:5])
         elif isinstance(item, str):
-            bag.append(item)
-    txt = "; ".join([re.sub(r"\s+", " ", str(x)) for x in bag if x])
-    return textwrap.shorten(txt, width=500, placeholder="…")
+            yield item
+
+def summarize_knowledge(semantics: List[Any], limit: int = 10, width: int = 500) -> str:
+    """
+    知見を "; " 区切りで width 字に要約。全件を連結してから切り詰めるのではなく、
+    width を超えた時点（＋境界の語を崩さないためにもう1件）で集めるのをやめる
+    """
+    parts: List[str] = []
+    total = 0  # 空白を詰めた後の長さの下限
+    for x in _knowledge_tokens(semantics, limit):
+        if not x:
+            continue
+        t = WS_RE.sub(" ", str(x))
+        parts.append(t)
+        if total > width + 1:
+            break
+        total += len(" ".join(t.split())) + 1
+    return textwrap.shorten("; ".join(parts), width=width, placeholder="…")
 
 # ---------- メイン処理 ----------
-def write_raw(items: List[Dict[str, Any]]) -> List[List[str]]:
+# RAW/整形/差分はいずれも1商品ずつCSVへ書き出し、全行をリストに溜めない
+def _with_header(header: List[str], rows: Iterable[List[str]]) -> Iterator[List[str]]:
+    yield header
+    yield from rows
+
+def write_raw(names: List[str]) -> None:
     persona = persona_or_default()
-    sys_prompt = build_persona_system(persona)
-
-    semantics = load_semantics()
-    know = summarize_knowledge(semantics)
-
-    rows = [["商品名", "ALT_1", "ALT_2", "ALT_3", "ALT_4", "ALT_5",
-             "ALT_6", "ALT_7", "ALT_8", "ALT_9", "ALT_10",
-             "ALT_11", "ALT_12", "ALT_13", "ALT_14", "ALT_15",
-             "ALT_16", "ALT_17", "ALT_18", "ALT_19", "ALT_20"]]
-    for it in items:
-        name = (it.get("商品名") or it.get("name") or "").strip()
-        user_prompt = build_user_prompt(name, know)
-        lines = call_openai_20_lines(client, MODEL, sys_prompt, user_prompt, TEMP, MAX_TOKENS)
-        rows.append([name] + lines)
-    save_csv_rows(RAW_PATH, rows)
-    return rows
-
-def write_refined(raw_rows: List[List[str]]) -> List[List[str]]:
-    header = raw_rows[0]
-    out = [header]
-    for r in raw_rows[1:]:
-        name, lines = r[0], r[1:]
-        refined = refine_lines(lines)
-        out.append([name] + refined)
-    save_csv_rows(REF_PATH, out)
-    return out
-
-def diff_rows(raw_rows: List[List[str]], ref_rows: List[List[str]]) -> List[List[str]]:
-    header = ["商品名", "RAW", "REF", "変更有無"]
-    out = [header]
-    for r_raw, r_ref in zip(raw_rows[1:], ref_rows[1:]):
-        name = r_raw[0]
-        diffs = []
-        for a, b in zip(r_raw[1:], r_ref[1:]):
-            diffs.append([name, a, b, "DIFF" if a != b else "SAME"])
-    # フラット化
-    flat = [header]
-    for r_raw, r_ref in zip(raw_rows[1:], ref_rows[1:]):
-        name = r_raw[0]
-        for a, b in zip(r_raw[1:], r_ref[1:]):
-            flat.append([name, a, b, "DIFF" if a != b else "SAME"])
-    save_csv_rows(DIFF_PATH, flat)
-    return flat
-
-def avg_len(lines: List[str]) -> float:
-    xs = [len(s or "") for s in lines]
-    return sum(xs) / max(1, len(xs))
+    sys_prompt = build_persona_system(persona, load_knowledge())  # 全商品で同一（1回だけ組み立てる）
+
+    bucket = TokenBucket()
+
+    def escalate(name: str, lines: List[str]) -> List[str]:
+        """MODEL の応答で使える行が足りなければ MODEL_FALLBACK で作り直す"""
+        if not MODEL_FALLBACK or len(unique_refined(lines)) >= FALLBACK_MIN_LINES:
+            return lines
+        return call_openai_20_lines(client, MODEL_FALLBACK, sys_prompt, build_user_prompt(name),
+                                    TEMP, MAX_TOKENS, bucket=bucket)
+
+    if USE_BATCH_API and client is not None:
+        user_prompts = [build_user_prompt(name) for name in names]
+        results = run_batch_api(client, MODEL, sys_prompt, user_prompts, TEMP, MAX_TOKENS)
+        rows = ([name] + escalate(name, lines) for name, lines in zip(names, results))
+        save_csv_rows(RAW_PATH, _with_header(RAW_HEADER, rows))
+        return
+
+    def one(name: str) -> List[str]:
+        user_prompt = build_user_prompt(name)
+        lines = call_openai_20_lines(client, MODEL, sys_prompt, user_prompt, TEMP, MAX_TOKENS, bucket=bucket)
+        return escalate(name, lines)
+
+    # CONCURRENCY 本並列で生成（map は入力順で返す）。返ってきた商品から順に書き出す
+    ex = ThreadPoolExecutor(max_workers=CONCURRENCY)
+    try:
+        rows = ([name] + lines for name, lines in zip(names, ex.map(one, names)))
+        save_csv_rows(RAW_PATH, _with_header(RAW_HEADER, rows))
+    finally:
+        # 途中の商品が失敗（Ctrl+C 含む）したら、まだ始まっていない商品のAPI呼び出しは取り消す
+        ex.shutdown(wait=False, cancel_futures=True)
+
+def write_refined() -> None:
+    """RAW CSV を1行ずつ読み、整形した行をそのまま書き出す"""
+    rows = ([r[0]] + refine_lines(r[1:]) for r in iter_csv_rows(RAW_PATH))
+    save_csv_rows(REF_PATH, _with_header(RAW_HEADER, rows))
+
+def diff_rows() -> None:
+    """RAW と整形後の CSV を並べて読み、1本ずつ DIFF/SAME を書き出す"""
+    rows = ([r_raw[0], a, b, "DIFF" if a != b else "SAME"]
+            for r_raw, r_ref in zip(iter_csv_rows(RAW_PATH), iter_csv_rows(REF_PATH))
+            for a, b in zip(r_raw[1:], r_ref[1:]))
+    save_csv_rows(DIFF_PATH, _with_header(DIFF_HEADER, rows))
+
+def avg_len(lines: Iterable[str]) -> float:
+    n = total = 0
+    for s in lines:
+        n += 1
+        total += len(s or "")
+    return total / max(1, n)
 
 def main():
     print("📦 入力CSV:", INPUT_PATH)
-    items = load_csv_items(INPUT_PATH)
-    print(f"   - レコード数: {len(items)}")
+    names = load_product_names(INPUT_PATH)
+    print(f"   - レコード数: {len(names)}")
 
     print("🧠 知見の読み込み:", SEMANTICS_DIR)
 
     print("🤖 OpenAI呼び出しでRAW生成中...")
-    raw_rows = write_raw(items)
+    write_raw(names)
 
     print("✂️  整形（正規化→句点終止→長さ整形→重複抑止）...")
-    ref_rows = write_refined(raw_rows)
+    write_refined()
 
     print("🔍 差分出力...")
-    diff_rows(raw_rows, ref_rows)
+    diff_rows()
 
-    # 軽いメトリクス
-    all_raw = [s for row in raw_rows[1:] for s in row[1:]]
-    all_refined = [s for row in ref_rows[1:] for s in row[1:]]
+    # 軽いメトリクス（書き出したCSVを読み直して集計）
+    all_raw = (s for row in iter_csv_rows(RAW_PATH) for s in row[1:])
+    all_refined = (s for row in iter_csv_rows(REF_PATH) for s in row[1:])
     print(f"   - AI生出力: {RAW_PATH}")
     print(f"   - 整形後   : {REF_PATH}")
     print(f"   - 差分比較 : {DIFF_PATH}")
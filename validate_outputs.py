@@ -2,6 +2,13 @@
 import json, re, sys, csv
 from collections import Counter
 
+# JSON読込は orjson があれば使う（無ければ標準 json）
+try:
+    import orjson
+    _json_loads = orjson.loads
+except Exception:
+    _json_loads = json.loads
+
 # === 設定 ===
 JSON_PATH = sys.argv[1] if len(sys.argv) > 1 else "./output/ai_writer/hybrid_writer_full_latest.json"
 FORBIDDEN_PATHS = [
@@ -16,8 +23,8 @@ def load_forbidden():
     words = set()
     for p in FORBIDDEN_PATHS:
         try:
-            with open(p, "r", encoding="utf-8") as f:
-                data = json.load(f)
+            with open(p, "rb") as f:
+                data = _json_loads(f.read())
             # 構造揺れに対応
             if isinstance(data, dict):
                 cand = data.get("forbidden_words") or data.get("forbidden") or []
@@ -34,9 +41,22 @@ def load_forbidden():
             pass
     return words
 
-def similar(a,b):
-    # ザックリ重複判定（Jaccard）
-    sa, sb = set(a), set(b)
+def build_forbidden_re(words):
+    """
+    禁則語＋画像描写ワードの有無を1回の走査で判定するための結合パターン。
+    ほとんどの文はこれ1回で「どちらも無し」と分かるので、当たった時だけ個別に調べる
+    """
+    ws = sorted((w for w in words if w), key=len, reverse=True)
+    return re.compile("|".join([ALT_IMAGE_WORDS] + [re.escape(w) for w in ws]))
+
+def find_forbidden(text, forbidden, forbidden_re):
+    """text に含まれる禁則語（結合パターンに当たった時だけ語ごとに調べる）"""
+    if forbidden_re is None or not forbidden_re.search(text):
+        return []
+    return [ng for ng in forbidden if ng and ng in text]
+
+def jaccard(sa, sb):
+    # 文字集合同士の Jaccard（集合は呼び出し側で作り置きする）
     if not sa or not sb: return 0.0
     return len(sa & sb) / len(sa | sb)
 
@@ -58,34 +78,33 @@ def validate(record):
         warns.append("copyが商品名転記っぽい")
     # 禁則
     forbidden = validate.forbidden
-    for ng in forbidden:
-        if ng and ng in copy:
-            errors.append(f"copy禁則語: {ng}")
+    forbidden_re = validate.forbidden_re
+    for ng in find_forbidden(copy, forbidden, forbidden_re):
+        errors.append(f"copy禁則語: {ng}")
 
     # alts
     if len(alts) != 20: errors.append(f"ALT件数不正({len(alts)})")
     alt_dup_pairs = 0
-    seen = []
+    seen = []  # 採用済みALTの文字集合（各ALTにつき1回だけ作る）
     for i,a in enumerate(alts):
         if not isinstance(a, str) or not a.strip():
             errors.append(f"ALT[{i}]空/非文字列")
             continue
-        n = jp_len(a)
+        n = len(a)
         if not (80 <= n <= 110):
             errors.append(f"ALT[{i}]長さ不正({n})")
-        # 画像描写禁止
-        if BAN_PAT.search(a):
-            errors.append(f"ALT[{i}]画像描写ワード検出")
-        # 禁則
-        for ng in forbidden:
-            if ng and ng in a:
-                errors.append(f"ALT[{i}]禁則語: {ng}")
+        # 画像描写禁止・禁則（結合パターン1回で素通りできなければ個別に判定）
+        if forbidden_re is None or forbidden_re.search(a):
+            if BAN_PAT.search(a):
+                errors.append(f"ALT[{i}]画像描写ワード検出")
+            for ng in forbidden:
+                if ng and ng in a:
+                    errors.append(f"ALT[{i}]禁則語: {ng}")
         # 重複（緩め）
-        for j,prev in enumerate(seen):
-            if similar(a, prev) >= 0.9:
-                alt_dup_pairs += 1
-                break
-        seen.append(a)
+        sa = frozenset(a)
+        if any(jaccard(sa, prev) >= 0.9 for prev in seen):
+            alt_dup_pairs += 1
+        seen.append(sa)
 
     if alt_dup_pairs > 0:
         warns.append(f"ALT高類似（重複疑い）{alt_dup_pairs}件")
@@ -93,8 +112,8 @@ def validate(record):
     return errors, warns
 
 def main():
-    with open(JSON_PATH, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    with open(JSON_PATH, "rb") as f:
+        data = _json_loads(f.read())
     if isinstance(data, dict) and "items" in data:
         items = data["items"]
     elif isinstance(data, list):
@@ -103,6 +122,7 @@ def main():
         items = [data]
 
     validate.forbidden = load_forbidden()
+    validate.forbidden_re = build_forbidden_re(validate.forbidden)
 
     total = len(items)
     bad = 0
@@ -18,8 +18,28 @@ import os
 import csv
 import json
 import re
+import glob
+import pickle
+import hashlib
 from datetime import datetime
 
+# 入力CSVの読込は pandas があれば使う（商品名列だけをCパーサで読み、整形もまとめて行う）
+try:
+    import pandas as pd
+except Exception:
+    pd = None
+
+# JSONの読み書きは orjson があれば使う（無ければ標準 json。出力は同じ2スペースインデント・UTF-8）
+try:
+    import orjson
+    _json_loads = orjson.loads
+    def _json_dump_bytes(obj):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+except Exception:
+    _json_loads = json.loads
+    def _json_dump_bytes(obj):
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+
 # =========================================================
 # パス設定（あなたの環境専用構成）
 # =========================================================
@@ -39,6 +59,17 @@ PATH_NORMALIZED = os.path.join(SEM_DIR, "normalized_20251031_0039.json")
 
 ENCODING = "cp932"
 
+# 中間JSON群のキャッシュ（各ファイルの mtime・サイズが変わらない限り pickle から読む）
+CONFIG_PATHS = [PATH_LEXICAL, PATH_MARKET, PATH_SEMANT, PATH_PERSONA, PATH_NORMALIZED, PATH_TEMPLATE]
+CONFIG_CACHE_PREFIX = ".cache_hybrid_v5_"
+
+# 禁則語・誇張表現（1本の正規表現で1パス除去。長い語を優先）
+FORBIDDEN_WORDS = [
+    "最強", "日本一", "世界一", "完全無料", "絶対", "永久保証",
+    "100%", "副作用なし", "必ず痩せる", "違法", "危険", "暴力"
+]
+FORBIDDEN_RE = re.compile("|".join(map(re.escape, sorted(FORBIDDEN_WORDS, key=len, reverse=True))))
+
 # =========================================================
 # ユーティリティ関数群
 # =========================================================
@@ -47,18 +78,47 @@ def jlen(s):
     return len(s.strip())
 
 def sanitize(s):
-    """全角スペース除去＋正規化"""
-    s = s.replace("\u3000", " ")
-    return re.sub(r"\s+", " ", s).strip()
+    """全角スペース除去＋正規化（空白の連続を1つに・前後除去）"""
+    return " ".join(s.replace("\u3000", " ").split())
 
 def load_json(path, default=None):
     """JSONローダ（存在しなければデフォルト返却）"""
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(path, "rb") as f:
+            return _json_loads(f.read())
     except Exception:
         return default or {}
 
+def _file_sig(path):
+    try:
+        st = os.stat(path)
+        return (path, st.st_mtime_ns, st.st_size)
+    except OSError:
+        return (path, None, None)
+
+def load_configs():
+    """CONFIG_PATHS を順に読み込んだ辞書のリスト。前回から変わっていなければ pickle キャッシュから読む"""
+    sig = hashlib.sha1(repr([_file_sig(p) for p in CONFIG_PATHS]).encode("utf-8")).hexdigest()
+    cache_path = os.path.join(SEM_DIR, f"{CONFIG_CACHE_PREFIX}{sig}.pkl")
+    try:
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+    except Exception:
+        pass
+    cfgs = [load_json(p) for p in CONFIG_PATHS]
+    # 古い世代は掃除してから原子的に書き込む（失敗しても本処理は続行）
+    try:
+        for old in glob.glob(os.path.join(SEM_DIR, f"{CONFIG_CACHE_PREFIX}*.pkl")):
+            if old != cache_path:
+                os.remove(old)
+        tmp = cache_path + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(cfgs, f)
+        os.replace(tmp, cache_path)
+    except Exception:
+        pass
+    return cfgs
+
 def trim_len(t, min_l, max_l):
     """文字数トリム"""
     t = t.strip()
@@ -79,28 +139,58 @@ def pad_len(t, min_l):
 
 def apply_forbidden(t):
     """禁則語・誇張表現の除去"""
-    forbidden = [
-        "最強", "日本一", "世界一", "完全無料", "絶対", "永久保証",
-        "100%", "副作用なし", "必ず痩せる", "違法", "危険", "暴力"
-    ]
-    for f in forbidden:
-        t = t.replace(f, "")
-    return sanitize(t)
+    return sanitize(FORBIDDEN_RE.sub("", t))
+
+def read_product_names(path):
+    """
+    入力CSV（cp932）から (行数（ヘッダ行込み）, 商品名リスト（sanitize 済み・空欄除外・重複あり）)。
+    空ファイルなら (0, [])、「商品名」列が無ければ RuntimeError
+    """
+    if pd is not None:
+        with open(path, "r", encoding=ENCODING, newline="") as f:
+            header = next(csv.reader(f), [])
+        # 同名列の重複（csv.reader 版は先頭列を使う）や空ファイルは下の csv.reader 版に任せる
+        if header.count("商品名") == 1:
+            try:
+                col = pd.read_csv(path, usecols=["商品名"], dtype=str, keep_default_na=False,
+                                  skip_blank_lines=False, index_col=False, encoding=ENCODING)["商品名"]
+                names = col.fillna("").str.replace("\u3000", " ").str.split().str.join(" ")
+                return len(col) + 1, [nm for nm in names.tolist() if nm]
+            except Exception:
+                pass  # 列数の揃わない行などは csv.reader で読み直す
+
+    with open(path, "r", encoding=ENCODING, newline="") as f:
+        rows = list(csv.reader(f))
+    if not rows:
+        return 0, []
+    try:
+        name_idx = rows[0].index("商品名")
+    except ValueError:
+        raise RuntimeError("⚠️ ヘッダに『商品名』列が見つかりません。")
+    return len(rows), [nm for r in rows[1:] if len(r) > name_idx and (nm := sanitize(r[name_idx]))]
 
 # =========================================================
 # 文生成ヘルパ
 # =========================================================
-def build_copy_alt(name, cluster, market_cfg, sem_cfg):
-    """テンプレートと市場語彙から Copy / ALT を構築"""
+_HOOK_FROM_NAME = object()  # hooks が無いクラスタは商品名をフックに使う
+
+def cluster_parts(cluster, market_cfg):
+    """クラスタごとに固定の (hook, benefit, feature, compat)。商品に依存しないので実行中に1回だけ作る"""
     base = market_cfg.get(cluster, market_cfg.get("general", {}))
 
-    hook = base.get("hooks", [name])[0]
+    hook = base["hooks"][0] if "hooks" in base else _HOOK_FROM_NAME
     benefit = base.get("benefits", ["快適な日常をサポート"])[0]
     feature = base.get("features", ["シンプルな設計"])[0]
     compat = base.get("compat", ["幅広い機種に対応"])[0]
+    return hook, benefit, feature, compat
 
-    pattern = "{hook} {benefit} {feature} {compat}"
-    copy_text = pattern.format(hook=hook, benefit=benefit, feature=feature, compat=compat)
+def build_copy_alt(name, parts):
+    """テンプレートと市場語彙（cluster_parts の結果）から Copy / ALT を構築"""
+    hook, benefit, feature, compat = parts
+    if hook is _HOOK_FROM_NAME:
+        hook = name
+
+    copy_text = f"{hook} {benefit} {feature} {compat}"
     alt_text = f"{name}｜{hook}。{benefit}。{feature}。{compat}。毎日の使用を想定した実用的なアクセサリー。"
 
     return copy_text, alt_text
@@ -111,43 +201,29 @@ def build_copy_alt(name, cluster, market_cfg, sem_cfg):
 def main():
     print("🌸 Hybrid AI Writer v5 実行開始")
 
-    # 各種中間ファイルの読込
-    lexical_cfg = load_json(PATH_LEXICAL)
-    market_cfg  = load_json(PATH_MARKET)
-    sem_cfg     = load_json(PATH_SEMANT)
-    persona_cfg = load_json(PATH_PERSONA)
-    normalized_cfg = load_json(PATH_NORMALIZED)
-    tmpl_cfg    = load_json(PATH_TEMPLATE)
+    # 各種中間ファイルの読込（CONFIG_PATHS の順）
+    lexical_cfg, market_cfg, sem_cfg, persona_cfg, normalized_cfg, tmpl_cfg = load_configs()
 
     # CSV読み込み
     if not os.path.exists(INPUT_CSV):
         raise FileNotFoundError(f"入力CSVが見つかりません: {INPUT_CSV}")
 
-    with open(INPUT_CSV, "r", encoding=ENCODING, newline="") as f:
-        reader = csv.reader(f)
-        rows = list(reader)
-
-    if not rows:
+    # 商品名の抽出
+    total_rows, names = read_product_names(INPUT_CSV)
+    if not total_rows:
         print("⚠️ CSVが空です。")
         return
 
-    header = rows[0]
-    try:
-        name_idx = header.index("商品名")
-    except ValueError:
-        raise RuntimeError("⚠️ ヘッダに『商品名』列が見つかりません。")
-
-    # 商品名の抽出
-    names = [sanitize(r[name_idx]) for r in rows[1:] if len(r) > name_idx and sanitize(r[name_idx])]
     unique_names = list(dict.fromkeys(names))  # 重複除外
 
     print(f"✅ 商品名抽出: {len(names)}件 → 一意化後 {len(unique_names)}件")
 
-    # Copy / ALT 生成
+    # Copy / ALT 生成（クラスタ由来の語句は全商品で共通なので先に1回だけ取り出す）
+    cluster = "general"
+    parts = cluster_parts(cluster, market_cfg)
     results = []
     for nm in unique_names:
-        cluster = "general"
-        copy_draft, alt_draft = build_copy_alt(nm, cluster, market_cfg, sem_cfg)
+        copy_draft, alt_draft = build_copy_alt(nm, parts)
         copy_t = apply_forbidden(trim_len(pad_len(copy_draft, 40), 40, 60))
         alt_t  = apply_forbidden(trim_len(pad_len(alt_draft, 80), 80, 110))
 
@@ -169,7 +245,7 @@ def main():
     meta = {
         "input_csv": INPUT_CSV,
         "encoding": ENCODING,
-        "total_rows": len(rows),
+        "total_rows": total_rows,
         "detected_products": len(unique_names),
         "dicts": {
             "lexical_clusters": PATH_LEXICAL,
@@ -181,8 +257,8 @@ def main():
         }
     }
 
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump({"meta": meta, "items": results}, f, ensure_ascii=False, indent=2)
+    with open(out_path, "wb") as f:
+        f.write(_json_dump_bytes({"meta": meta, "items": results}))
 
     print(f"💾 出力完了: {out_path}")
     print(f"📊 件数: {len(results)}（Copy/ALTとも全件生成）")
@@ -23,24 +23,60 @@ writer_splitter_perfect_integrated.py
 - .env の OPENAI_API_KEY を使用
 - .env の OPENAI_MODEL を優先（未設定時は gpt-4-turbo）
 - ※温度は未指定（モデル既定値=1）/ max_tokens は使用せず max_completion_tokens を使用
+- AsyncOpenAI で商品ごとの呼び出しを並行実行（同時数は .env の OPENAI_CONCURRENCY、既定10。出力は入力順）
+- JSONモードは Structured Outputs（json_schema）→ json_object → テキスト抽出の順に試す
+- 知見要約は .env の KNOWLEDGE_MAX_CHARS 字（既定800）に収まるようヒント語を削ってから全呼び出しに載せる
+- 取り出せた応答は ./output/ai_writer/.cache_splitter.sqlite にプロンプトのハッシュで保存し、
+  再実行時は API を呼ばない（OPENAI_PROMPT_CACHE=0 で無効）
+- .env の OPENAI_RPM / OPENAI_TPM で分間リクエスト数・トークン数の上限内に送信ペースを抑える（0 なら無制限）。
+  API エラー時は Retry-After に従うか、揺らぎ付きの指数バックオフで待って再試行
 """
 
 import os
 import re
 import io
+import csv
 import json
 import glob
 import time
+import hashlib
+import sqlite3
+import importlib.util
+import random
+import asyncio
 import unicodedata
 from datetime import datetime
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
 from tqdm import tqdm
 
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI
 from openai import APIError, RateLimitError, BadRequestError, OpenAIError
 
+# JSONの読み書きは orjson があれば使う（無ければ標準 json。ログは1行1件・UTF-8）
+try:
+    import orjson
+    _json_loads = orjson.loads
+    def _json_line(obj):
+        return orjson.dumps(obj).decode("utf-8") + "\n"
+except Exception:
+    _json_loads = json.loads
+    def _json_line(obj):
+        return json.dumps(obj, ensure_ascii=False) + "\n"
+
+# 同時に投げるリクエスト数（RPM に合わせて .env で調整）
+CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "10"))
+RPM_LIMIT = int(os.getenv("OPENAI_RPM", "0"))             # 0 なら無制限
+TPM_LIMIT = int(os.getenv("OPENAI_TPM", "0"))             # 0 なら無制限
+# 知見要約（全呼び出しに載る）の上限文字数。超えたらヒント語を末尾から削る（0 なら無制限）
+KNOWLEDGE_MAX_CHARS = int(os.getenv("KNOWLEDGE_MAX_CHARS", "800"))
+# OpenAI応答のキャッシュ（同一プロンプトは再実行時もAPIを呼ばない。OPENAI_PROMPT_CACHE=0 で無効）
+PROMPT_CACHE_PATH = "./output/ai_writer/.cache_splitter.sqlite"
+PROMPT_CACHE_ENABLED = os.getenv("OPENAI_PROMPT_CACHE", "1") != "0"
+
 # =========================
 # 基本ユーティリティ
 # =========================
@@ -79,12 +115,12 @@ def read_input_csv(path="./input.csv"):
 
 def load_json_safe(path):
     try:
-        with io.open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with io.open(path, "rb") as f:
+            return _json_loads(f.read())
     except Exception:
         try:
             with io.open(path, "r", encoding="cp932") as f:
-                return json.load(f)
+                return _json_loads(f.read())
         except Exception:
             return None
 
@@ -105,8 +141,12 @@ def pick_semantics():
         "normalized": glob_first(f"{base}/normalized_*.json"),
         "template": os.path.join(base, "template_composer.json") if os.path.exists(os.path.join(base, "template_composer.json")) else None,
     }
-    for k, p in paths.items():
-        bundle[k] = load_json_safe(p) if p else None
+    # 各ファイルは独立なので読み込み（I/O 待ち）をスレッドで重ねる
+    found = {k: p for k, p in paths.items() if p}
+    with ThreadPoolExecutor(max_workers=len(found) or 1) as ex:
+        loaded = dict(zip(found, ex.map(load_json_safe, found.values())))
+    for k in paths:
+        bundle[k] = loaded.get(k)
     return bundle
 
 def to_str_list(x):
@@ -139,13 +179,16 @@ def jlen(s: str) -> int:
     # ざっくり全角/半角の区別なく文字数カウント（要件上は全角上限だが、安定のためlenで運用）
     return len(s)
 
+# 切り詰め後の末尾に残った約物（商品ごとに呼ばれるので読み込み時に1回だけコンパイル）
+TRUNC_TAIL_RE = re.compile(r'[、。・,.;:：；、。…ー\-]\s*$')
+
 def smart_truncate(text, max_len):
     if jlen(text) <= max_len:
         return text
     # 句点・読点・中点・約物で手前カット
     cut = text[:max_len]
     # 末尾を整える
-    cut = re.sub(r'[、。・,.;:：；、。…ー\-]\s*$', '', cut)
+    cut = TRUNC_TAIL_RE.sub('', cut)
     return cut
 
 def enforce_range(text, min_len, max_len):
@@ -240,19 +283,41 @@ def summarize_knowledge(name, kb):
         "template_note": "テンプレ感は出さないが、構成要素（spec/competence/user/scene/benefit）は意識して自然文に溶かし込む。"
     }
     # 文字列化して返す（プロンプトに埋めやすく）
-    return json.dumps(block, ensure_ascii=False)
+    text = json.dumps(block, ensure_ascii=False)
+    # 上限を超えたら、いちばん語数の多いヒントから末尾（＝後ろほど重要度が低い）を削る。禁止語とテンプレ注記は削らない
+    hint_keys = ("lexical_hints", "semantic_hints", "market_trend", "market_scenes", "market_audience", "persona_tone")
+    while KNOWLEDGE_MAX_CHARS > 0 and len(text) > KNOWLEDGE_MAX_CHARS:
+        key = max(hint_keys, key=lambda k: len(block[k]))
+        if not block[key]:
+            break
+        block[key].pop()
+        text = json.dumps(block, ensure_ascii=False)
+    return text
 
 # =========================
 # OpenAI ラッパ
 # =========================
 
+# 並行実行（CONCURRENCY本）でも接続を張り直さないよう、keep-alive 枠を並列数に合わせた httpx.AsyncClient を渡す。
+# h2 が入っていれば HTTP/2 で1接続に多重化する（httpx が無ければ SDK の既定）
+def _make_http_client():
+    try:
+        import httpx
+    except Exception:
+        return None
+    return httpx.AsyncClient(
+        http2=importlib.util.find_spec("h2") is not None,
+        timeout=httpx.Timeout(120.0, connect=10.0),
+        limits=httpx.Limits(max_connections=CONCURRENCY * 2, max_keepalive_connections=CONCURRENCY),
+    )
+
 def load_openai_client():
     load_dotenv()
     api_key = os.getenv("OPENAI_API_KEY", "").strip()
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY が未設定です（.env を確認）")
     model = os.getenv("OPENAI_MODEL", "gpt-4-turbo").strip()
-    client = OpenAI(api_key=api_key)
+    client = AsyncOpenAI(api_key=api_key, http_client=_make_http_client())
     return client, model
 
 JSON_SCHEMA_HINT = """
@@ -270,6 +335,25 @@ JSON_SCHEMA_HINT = """
 - spec / competence / user / scene / benefit の要素を自然に溶け込ませる（テンプレ感は出さない）。
 """
 
+# Structured Outputs 用のスキーマ（対応モデルなら応答が必ずこの形の JSON になる）
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "rakuten": {"type": "string"},
+        "yahoo": {"type": "string"},
+        "alts": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["rakuten", "yahoo", "alts"],
+    "additionalProperties": False,
+}
+# JSONモードで試す順（json_schema 未対応モデルは BadRequest になるので json_object に落とす）
+RESPONSE_FORMATS = [
+    {"type": "json_schema", "json_schema": {"name": "split_copy", "schema": RESPONSE_SCHEMA, "strict": True}},
+    {"type": "json_object"},
+]
+# 一度 BadRequest になった json_schema は以降の商品では試さない（未対応モデルで毎回 400 を待たないように）
+_schema_rejected = False
+
 def build_messages(product_name, knowledge_json_text):
     system = (
         "あなたは日本語のEC商品コピーライターです。"
@@ -294,90 +378,207 @@ def build_messages(product_name, knowledge_json_text):
         {"role": "user",   "content": user}
     ]
 
-def try_json_mode(client, model, messages, max_completion_tokens=700):
+class TokenBucket:
+    """RPM/TPM のトークンバケット（並行実行中の全呼び出しで共有）。経過時間で補充し、足りない分だけ待ってから消費する"""
+    def __init__(self, rpm=RPM_LIMIT, tpm=TPM_LIMIT):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.available_requests = float(rpm)
+        self.available_tokens = float(tpm)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        if self.rpm > 0:
+            self.available_requests = min(self.rpm, self.available_requests + elapsed * self.rpm / 60.0)
+        if self.tpm > 0:
+            self.available_tokens = min(self.tpm, self.available_tokens + elapsed * self.tpm / 60.0)
+
+    async def consume(self, est_tokens=0):
+        tokens = min(est_tokens, self.tpm)  # 容量超えの見積りで永久に待たないように
+        while True:
+            # イベントループは1スレッドなので、確認から消費までの間に他の呼び出しは割り込まない
+            self._refill(time.monotonic())
+            short_req = (1 - self.available_requests) * 60.0 / self.rpm if self.rpm > 0 else 0.0
+            short_tok = (tokens - self.available_tokens) * 60.0 / self.tpm if self.tpm > 0 else 0.0
+            delay = max(short_req, short_tok)
+            if delay <= 0:
+                if self.rpm > 0:
+                    self.available_requests -= 1
+                if self.tpm > 0:
+                    self.available_tokens -= tokens
+                return
+            await asyncio.sleep(delay)
+
+def estimate_tokens(messages, max_completion_tokens):
+    """送信前のトークン見積り（日本語はおおむね2文字=1トークン弱として上振れ側に）"""
+    return max_completion_tokens + sum(len(m["content"]) for m in messages) // 2
+
+def backoff_delay(prev, retry_after=None, base=1.0, cap=60.0):
+    """次の待機秒数。Retry-After ヘッダがあればそれに従い、無ければ decorrelated jitter（前回×3 までの乱数）"""
+    if retry_after is not None:
+        try:
+            return min(cap, max(0.0, float(retry_after)))
+        except (TypeError, ValueError):
+            pass
+    return min(cap, random.uniform(base, max(base, prev * 3)))
+
+def retry_after_of(e):
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    return headers.get("retry-after")
+
+async def try_json_mode(client, model, messages, response_format, max_completion_tokens=700):
     """
-    response_format={'type':'json_object'} を試す。
-    失敗したら例外を投げる（上位でテキストモードにフォールバック）
+    response_format（json_schema / json_object）を試す。
+    失敗したら例外を投げる（上位で次の形式→テキストモードにフォールバック）
     """
-    return client.chat.completions.create(
+    return await client.chat.completions.create(
         model=model,
         messages=messages,
         # 温度は未指定（モデル既定値=1 固定問題を回避）
-        response_format={"type": "json_object"},
+        response_format=response_format,
         max_completion_tokens=max_completion_tokens,
     )
 
-def try_text_mode(client, model, messages, max_completion_tokens=700):
+async def try_text_mode(client, model, messages, max_completion_tokens=700):
     """
     通常モード（テキスト）でJSONを返してもらう
     """
-    return client.chat.completions.create(
+    return await client.chat.completions.create(
         model=model,
         messages=messages,
         max_completion_tokens=max_completion_tokens,
     )
 
+# 応答から JSON 部分を拾うパターン（最初の { から最後の } まで貪欲）と、末尾カンマの手当て
+JSON_BLOCK_RE = re.compile(r'\{.*\}', flags=re.S)
+TRAILING_COMMA_OBJ_RE = re.compile(r',\s*}')
+TRAILING_COMMA_ARR_RE = re.compile(r',\s*]')
+
 def extract_json_from_text(text):
-    # 最初の { から最後の } までを貪欲に取得
-    m = re.search(r'\{.*\}', text, flags=re.S)
+    """応答テキストから JSON オブジェクトを取り出す。取り出せなければ None"""
+    if not text:
+        return None
+    # 速い経路：応答全体がそのまま JSON オブジェクト（大半はこれ）なら正規表現を通さない
+    try:
+        data = _json_loads(text)
+        if isinstance(data, dict):
+            return data
+    except ValueError:
+        pass
+    m = JSON_BLOCK_RE.search(text)
     if not m:
         return None
     chunk = m.group(0)
     try:
-        return json.loads(chunk)
-    except Exception:
+        return _json_loads(chunk)
+    except ValueError:
         # 末尾 , の除去など軽い手当て
-        chunk = re.sub(r',\s*}', '}', chunk)
-        chunk = re.sub(r',\s*]', ']', chunk)
+        chunk = TRAILING_COMMA_OBJ_RE.sub('}', chunk)
+        chunk = TRAILING_COMMA_ARR_RE.sub(']', chunk)
         try:
-            return json.loads(chunk)
-        except Exception:
+            return _json_loads(chunk)
+        except ValueError:
             return None
 
-def call_openai_for_product(client, model, product_name, knowledge_json_text, logf):
-    messages = build_messages(product_name, knowledge_json_text)
+_cache_conn = None
+
+def _cache_db():
+    global _cache_conn
+    if _cache_conn is None:
+        _cache_conn = sqlite3.connect(PROMPT_CACHE_PATH)
+        _cache_conn.execute("CREATE TABLE IF NOT EXISTS kv(k TEXT PRIMARY KEY, v TEXT)")
+    return _cache_conn
+
+def _cache_key(model, messages, max_completion_tokens):
+    payload = json.dumps({"model": model, "messages": messages, "max_completion_tokens": max_completion_tokens},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
-    # まずJSONモードを試す
-    for attempt in range(2):
+def _cache_get(key):
+    if not PROMPT_CACHE_ENABLED:
+        return None
+    row = _cache_db().execute("SELECT v FROM kv WHERE k = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def is_complete_reply(data):
+    """キャッシュしてよい応答か（rakuten / yahoo があり、alts が空でないリスト）"""
+    return (isinstance(data, dict)
+            and isinstance(data.get("rakuten"), str) and isinstance(data.get("yahoo"), str)
+            and isinstance(data.get("alts"), list) and len(data["alts"]) > 0)
+
+def _cache_set(key, data):
+    if not PROMPT_CACHE_ENABLED or not is_complete_reply(data):
+        return
+    db = _cache_db()
+    db.execute("INSERT OR REPLACE INTO kv (k, v) VALUES (?, ?)", (key, json.dumps(data, ensure_ascii=False)))
+    db.commit()
+
+async def call_openai_for_product(client, model, product_name, knowledge_json_text, logf, bucket=None):
+    messages = build_messages(product_name, knowledge_json_text)
+    cache_key = _cache_key(model, messages, 900)
+    cached = _cache_get(cache_key)
+    if cached:
+        return _json_loads(cached)
+    est_tokens = estimate_tokens(messages, 900)
+    delay = 1.0  # API エラー時の待ち（JSON→テキストの両モードで通して伸ばす）
+
+    # まずJSONモードを試す（json_schema → json_object の順。json_schema が断られた後は json_object から）
+    global _schema_rejected
+    formats = [f for f in RESPONSE_FORMATS if not (_schema_rejected and f["type"] == "json_schema")]
+    attempt = 0
+    while formats and attempt < 2:
         try:
-            res = try_json_mode(client, model, messages, max_completion_tokens=900)
+            if bucket:
+                await bucket.consume(est_tokens)
+            res = await try_json_mode(client, model, messages, formats[0], max_completion_tokens=900)
             raw = res.choices[0].message.content or ""
             if logf:
-                logf.write(json.dumps({"product": product_name, "mode": "json", "raw": raw}, ensure_ascii=False) + "\n")
-            data = json.loads(raw)
+                logf.write(_json_line({"product": product_name, "mode": "json", "raw": raw}))
+            data = _json_loads(raw)
+            _cache_set(cache_key, data)
             return data
         except BadRequestError as e:
-            # レスポンスフォーマット未対応モデルなど → テキストモードへ
+            # レスポンスフォーマット未対応モデルなど → 次の形式へ（残っていなければテキストモードへ）
             if logf:
-                logf.write(json.dumps({"product": product_name, "mode": "json_error", "error": str(e)}, ensure_ascii=False) + "\n")
-            break
+                logf.write(_json_line({"product": product_name, "mode": "json_error", "format": formats[0]["type"], "error": str(e)}))
+            if formats[0]["type"] == "json_schema":
+                _schema_rejected = True
+            formats.pop(0)
         except (APIError, RateLimitError, OpenAIError) as e:
             if logf:
-                logf.write(json.dumps({"product": product_name, "mode": "json_api_error", "error": str(e)}, ensure_ascii=False) + "\n")
-            time.sleep(2)
+                logf.write(_json_line({"product": product_name, "mode": "json_api_error", "error": str(e)}))
+            attempt += 1
+            delay = backoff_delay(delay, retry_after_of(e))
+            await asyncio.sleep(delay)
         except Exception as e:
             if logf:
-                logf.write(json.dumps({"product": product_name, "mode": "json_unknown", "error": str(e)}, ensure_ascii=False) + "\n")
+                logf.write(_json_line({"product": product_name, "mode": "json_unknown", "error": str(e)}))
             break
 
     # テキストモードでJSON抽出
     for attempt in range(3):
         try:
-            res = try_text_mode(client, model, messages, max_completion_tokens=900)
+            if bucket:
+                await bucket.consume(est_tokens)
+            res = await try_text_mode(client, model, messages, max_completion_tokens=900)
             raw = res.choices[0].message.content or ""
             if logf:
-                logf.write(json.dumps({"product": product_name, "mode": "text", "raw": raw}, ensure_ascii=False) + "\n")
+                logf.write(_json_line({"product": product_name, "mode": "text", "raw": raw}))
             data = extract_json_from_text(raw)
             if data:
+                _cache_set(cache_key, data)
                 return data
         except (APIError, RateLimitError, OpenAIError) as e:
             if logf:
-                logf.write(json.dumps({"product": product_name, "mode": "text_api_error", "error": str(e)}, ensure_ascii=False) + "\n")
-            time.sleep(2)
+                logf.write(_json_line({"product": product_name, "mode": "text_api_error", "error": str(e)}))
+            delay = backoff_delay(delay, retry_after_of(e))
+            await asyncio.sleep(delay)
         except Exception as e:
             if logf:
-                logf.write(json.dumps({"product": product_name, "mode": "text_unknown", "error": str(e)}, ensure_ascii=False) + "\n")
-            time.sleep(1)
+                logf.write(_json_line({"product": product_name, "mode": "text_unknown", "error": str(e)}))
+            await asyncio.sleep(1)
 
     return None
 
@@ -385,17 +586,28 @@ def call_openai_for_product(client, model, product_name, knowledge_json_text, lo
 # ローカル整形（安全弁）
 # =========================
 
+SPACES_RE = re.compile(r'\s+')
+REPEATED_PUNCT_RE = re.compile(r'[、。]{2,}')
+
+@lru_cache(maxsize=8)
+def forbidden_pattern(words):
+    """禁止語を1本の正規表現に（長い語を優先）。語リストが変わらない限り使い回す"""
+    ws = sorted({w for w in words if w}, key=len, reverse=True)
+    return re.compile("|".join(map(re.escape, ws))) if ws else None
+
 def cleanse_forbidden(text, forbidden):
     t = text.strip()
     if not forbidden:
         return t
-    for w in forbidden:
-        if not w:
-            continue
-        t = t.replace(w, "")
+    pat = forbidden_pattern(tuple(forbidden))
+    if pat:
+        # 除去でつながって新たにできた禁止語も消えるまで（通常は1パス）
+        n = 1
+        while n:
+            t, n = pat.subn("", t)
     # 連続スペース・句読点整形
-    t = re.sub(r'\s+', ' ', t)
-    t = re.sub(r'[、。]{2,}', '。', t)
+    t = SPACES_RE.sub(' ', t)
+    t = REPEATED_PUNCT_RE.sub('。', t)
     return t.strip()
 
 def local_refine(product_name, raw_obj, forbidden):
@@ -440,6 +652,60 @@ def local_refine(product_name, raw_obj, forbidden):
 
     return rak, yah, alts
 
+# =========================
+# 並行生成
+# =========================
+
+async def generate_product(client, model, nm, knowledge_text, forbidden, logf, bucket=None):
+    """1商品ぶん：AI → ローカル最終整形。例外時は None（空欄で出力して後で再生成可能に）"""
+    try:
+        # AI呼び出し
+        data = await call_openai_for_product(client, model, nm, knowledge_text, logf, bucket=bucket)
+        if not data or not isinstance(data, dict):
+            # 空応答→簡易フォールバック
+            data = {
+                "rakuten": f"{nm} の特長を活かし、日常の不満を減らして快適に使えるよう配慮した設計です。",
+                "yahoo": f"{nm} の使いやすさに配慮した設計。",
+                "alts": []
+            }
+        # ローカル最終整形
+        return local_refine(nm, data, forbidden)
+    except Exception as e:
+        logf.write(_json_line({"product": nm, "event": "exception", "error": str(e)}))
+        return None
+
+async def generate_all(client, model, names, knowledge_text, forbidden, logf, emit):
+    """
+    全商品を CONCURRENCY 本ずつ並行に生成し、完了分から入力順に emit(i, res) へ渡す。
+    中断時は先に終わっていた分も（欠番を飛ばして）入力順に渡しきる。
+    """
+    sem = asyncio.Semaphore(CONCURRENCY)
+    # 同時数だけでなく分間の送信量も抑える（上限未設定なら素通し）
+    bucket = TokenBucket() if (RPM_LIMIT > 0 or TPM_LIMIT > 0) else None
+
+    async def one(i, nm):
+        async with sem:
+            return i, await generate_product(client, model, nm, knowledge_text, forbidden, logf, bucket=bucket)
+
+    pbar = tqdm(total=len(names), desc="🧠 商品別AI生成中", ncols=88)
+    pending, next_i = {}, 0
+    try:
+        for fut in asyncio.as_completed([one(i, nm) for i, nm in enumerate(names)]):
+            i, res = await fut
+            pending[i] = res
+            if res is not None:
+                rak, yah, alts = res
+                pbar.set_postfix_str(f"{names[i][:16]}… → R:{jlen(rak)} / Y:{jlen(yah)} / ALT20")
+            pbar.update(1)
+            while next_i in pending:
+                emit(next_i, pending.pop(next_i))
+                next_i += 1
+    finally:
+        for i in sorted(pending):
+            emit(i, pending[i])
+        pbar.close()
+        await client.close()
+
 # =========================
 # 本体
 # =========================
@@ -449,6 +715,8 @@ def main():
     client, model = load_openai_client()
     names = read_input_csv("./input.csv")
     kb = pick_semantics()
+    # ローカル知見を軽量要約に（商品名に依らないので全商品で1回だけ）
+    knowledge_text = summarize_knowledge(None, kb)
 
     out_time = now_stamp()
     path_rakuten = f"./output/ai_writer/rakuten_copy_{out_time}.csv"
@@ -471,58 +739,48 @@ def main():
     print(f"🌸 writer_splitter_perfect_integrated 実行開始（全件AI＋知見要約＋3分割）")
     print(f"✅ 商品名抽出: {len(names)}件（重複除去済）")
 
-    # 出力CSVを先に用意（追記していく）
-    df_rak = pd.DataFrame([], columns=["商品名","楽天コピー"])
-    df_yah = pd.DataFrame([], columns=["商品名","Yahooコピー"])
+    # 出力CSVを先に開いてヘッダだけ書き、できた商品から1行ずつ追記する
+    # （Excel/Windows互換のためBOM付きUTF-8。行バッファなので途中で落ちても済んだ分は残る）
+    f_rak = io.open(path_rakuten, "w", encoding="utf-8-sig", newline="", buffering=1)
+    f_yah = io.open(path_yahoo,  "w", encoding="utf-8-sig", newline="", buffering=1)
+    f_alt = io.open(path_alt,    "w", encoding="utf-8-sig", newline="", buffering=1)
+    # 改行は従来の DataFrame.to_csv と同じ os.linesep（csv.writer 既定の \r\n にしない）
+    w_rak, w_yah, w_alt = (csv.writer(f, lineterminator=os.linesep) for f in (f_rak, f_yah, f_alt))
+    w_rak.writerow(["商品名","楽天コピー"])
+    w_yah.writerow(["商品名","Yahooコピー"])
     # ALTは横持ち20列
-    alt_cols = ["商品名"] + [f"ALT{i}" for i in range(1, 21)]
-    df_alt = pd.DataFrame([], columns=alt_cols)
+    w_alt.writerow(["商品名"] + [f"ALT{i}" for i in range(1, 21)])
 
-    # ログファイル
-    logf = io.open(path_log, "w", encoding="utf-8")
+    # ログファイル（行バッファ）
+    logf = io.open(path_log, "w", encoding="utf-8", buffering=1)
 
-    pbar = tqdm(total=len(names), desc="🧠 商品別AI生成中", ncols=88)
-    for nm in names:
-        try:
-            # ローカル知見を軽量要約に
-            knowledge_text = summarize_knowledge(nm, kb)
-            # AI呼び出し
-            data = call_openai_for_product(client, model, nm, knowledge_text, logf)
-            if not data or not isinstance(data, dict):
-                # 空応答→簡易フォールバック
-                data = {
-                    "rakuten": f"{nm} の特長を活かし、日常の不満を減らして快適に使えるよう配慮した設計です。",
-                    "yahoo": f"{nm} の使いやすさに配慮した設計。",
-                    "alts": []
-                }
-            # ローカル最終整形
-            rak, yah, alts = local_refine(nm, data, knowledge_forbidden_union)
-
-            # 行追加
-            df_rak.loc[len(df_rak)] = [nm, rak]
-            df_yah.loc[len(df_yah)] = [nm, yah]
-            row = [nm] + alts
-            df_alt.loc[len(df_alt)] = row
-
-            pbar.set_postfix_str(f"{nm[:16]}… → R:{jlen(rak)} / Y:{jlen(yah)} / ALT20")
-        except KeyboardInterrupt:
-            logf.write(json.dumps({"product": nm, "event": "keyboard_interrupt"}, ensure_ascii=False) + "\n")
-            break
-        except Exception as e:
-            logf.write(json.dumps({"product": nm, "event": "exception", "error": str(e)}, ensure_ascii=False) + "\n")
-            # フォールバックで空欄追加（後で再生成可能に）
-            df_rak.loc[len(df_rak)] = [nm, ""]
-            df_yah.loc[len(df_yah)] = [nm, ""]
-            df_alt.loc[len(df_alt)] = [nm] + [""]*20
-        finally:
-            pbar.update(1)
-    pbar.close()
-    logf.close()
+    done = 0
 
-    # 出力（Excel/Windows互換のためBOM付きUTF-8）
-    df_rak.to_csv(path_rakuten, index=False, encoding="utf-8-sig")
-    df_yah.to_csv(path_yahoo,  index=False, encoding="utf-8-sig")
-    df_alt.to_csv(path_alt,    index=False, encoding="utf-8-sig")
+    def emit(i, res):
+        nonlocal done
+        nm = names[i]
+        done += 1
+        if res is None:
+            # フォールバックで空欄追加（後で再生成可能に）
+            w_rak.writerow([nm, ""])
+            w_yah.writerow([nm, ""])
+            w_alt.writerow([nm] + [""]*20)
+            return
+        rak, yah, alts = res
+
+        # 行追加
+        w_rak.writerow([nm, rak])
+        w_yah.writerow([nm, yah])
+        w_alt.writerow([nm] + alts)
+
+    # 商品ごとの AI 呼び出しを並行に（完了分から入力順に emit で書き出す）
+    try:
+        asyncio.run(generate_all(client, model, names, knowledge_text, knowledge_forbidden_union, logf, emit))
+    except KeyboardInterrupt:
+        logf.write(_json_line({"event": "keyboard_interrupt", "done": done}))
+    finally:
+        for f in (f_rak, f_yah, f_alt, logf):
+            f.close()
 
     print("✅ 出力完了:")
     print(f"   - 楽天: {path_rakuten}")